@@ -21,6 +21,7 @@
 #include <triqs/arrays.hpp>
 #include <iostream>
 #include <complex>
+#include <algorithm>
 
 #include "argsort.hpp"
 #include "dos_tetra3d.hpp"
@@ -138,6 +139,64 @@ array<double, 2> dos_tetra_weights_3d(array<double, 1> eigk, double en, array<lo
   return array_view<double,2>(cti);
 }
 
+/*
+  Returns DOS weights of all k-points and bands for a mesh of energies
+*/
+array<double, 3> dos_tetra_k_weights_3d(array_view<double, 2> eigk, array_view<double, 1> emesh, array_view<long, 2> itt)
+{
+  int ntet, nk, nb, ne;
+
+  if (first_dim(itt) != NUM_TET_CORNERS + 1)
+  {
+      TRIQS_RUNTIME_ERROR << "  The first dimension of 'itt' must be equal to 5";
+  }
+
+  ntet = second_dim(itt);
+  nk = first_dim(eigk);
+  nb = second_dim(eigk);
+  ne = first_dim(emesh);
+
+  array<double, 3> weights(ne, nk, nb); // DOS weights to be returned
+  weights() = 0.0;
+
+  double eigs0[4], eigs[4], ci[4], emin, emax, en, wt;
+  int i, it, ib, ie, iks[4], inds[4];
+
+// Loop over tetrahedra and bands
+  for (it = 0; it < ntet; it++)
+  {
+    wt = itt(0, it);
+    for (i = 0; i < 4; i++)
+      iks[i] = itt(i + 1, it);
+
+    for (ib = 0; ib < nb; ib++)
+    {
+      for (i = 0; i < 4; i++)
+        eigs0[i] = eigk(iks[i], ib);
+
+      emin = std::min(std::min(eigs0[0], eigs0[1]), std::min(eigs0[2], eigs0[3]));
+      emax = std::max(std::max(eigs0[0], eigs0[1]), std::max(eigs0[2], eigs0[3]));
+
+      for (ie = 0; ie < ne; ie++)
+      {
+        en = emesh(ie);
+// The weights vanish outside of the energy range of the tetrahedron
+        if (en < emin || emax < en) continue;
+
+// 'dos_corner_weights()' sorts the eigenvalues in place
+        for (i = 0; i < 4; i++)
+          eigs[i] = eigs0[i];
+        dos_corner_weights(en, eigs, inds, ci);
+
+        for (i = 0; i < 4; i++)
+          weights(ie, iks[inds[i]], ib) += ci[i] * wt;
+      }
+    }
+  }  // it = 1, ntet
+
+  return weights;
+}
+
 //#ifdef __TETRA_ARRAY_VIEW
 //void tet_dos3d(double en, array_view<double, 1>& eigk,
 //                 array_view<long, 2>& itt, int ntet,
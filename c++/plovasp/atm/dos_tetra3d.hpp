@@ -33,6 +33,17 @@ dos_tetra_weights_3d(array_view<double, 1> eigk, /// Band energies for each k-po
                      double en, /// Energy at which DOS weights are to be calculated
                      array_view<long, 2> itt /// Tetrahedra defined by k-point indices
 );
+/// DOS of a set of bands by analytical tetrahedron method
+///
+///   Returns DOS weights of all k-points and bands for all energies of a mesh.
+///   The corner weights of each tetrahedron are multiplied by its weight (first row of 'itt')
+///   and summed on the corresponding k-points, so that the DOS of a band-projected quantity
+///   is given by sum_{k, b} weights(ie, k, b) * w(k, b).
+array<double, 3> 
+dos_tetra_k_weights_3d(array_view<double, 2> eigk, /// Band energies eigk(k, b) for each k-point and band
+                       array_view<double, 1> emesh, /// Energies at which DOS weights are to be calculated
+                       array_view<long, 2> itt /// Tetrahedra defined by k-point indices
+);
 //array<double, 2> 
 //dos_tetra_weights_3d(array<double, 1> eigk, /// Band energies for each k-point
 //                     double e, /// Energy at which DOS weights are to be calculated
@@ -19,8 +19,94 @@
 # TRIQS. If not, see <http://www.gnu.org/licenses/>.
 #
 ##########################################################################
+import string
+import numpy
 import pytriqs.utility.mpi as mpi
 
+
+class FortranNumbers(object):
+    r"""
+    Numbers of a Fortran-produced file, stored in a flat float array.
+
+    The numbers are read in file order, either one by one with ``R.next()`` (like a generator)
+    or as whole blocks with ``R.read(shape)``, which returns the next numbers reshaped to shape.
+    Reading past the end of the file raises StopIteration. If the file contains a token that is
+    not a number, ValueError is raised when this token is reached.
+
+    Parameters
+    ----------
+    data : numpy array
+           All numbers of the file.
+    bad_token : string, optional
+                Token following the numbers in data, which could not be converted.
+    """
+
+    def __init__(self, data, bad_token=None):
+
+        self.data = data
+        self.bad_token = bad_token
+        self.pos = 0
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        Converts all whitespace-separated numbers in text.
+        """
+        data = numpy.fromstring(text, dtype=numpy.float_, sep=' ')
+        # fromstring silently stops at the first token that is not a number (after
+        # converting its leading digits, if any), so compare with the number of tokens
+        # and check the last one
+        chars = numpy.frombuffer(text, dtype=numpy.uint8)
+        space = numpy.in1d(chars, numpy.frombuffer(string.whitespace, dtype=numpy.uint8))
+        n_tokens = numpy.count_nonzero(~space[1:] & space[:-1]) + int(len(chars) > 0 and not space[0])
+        # (fromstring returns [-1.] for a whitespace-only text)
+        if n_tokens == 0:
+            return cls(numpy.zeros(0, dtype=numpy.float_))
+        if len(data) == n_tokens:
+            try:
+                float(text.rsplit(None, 1)[-1])
+                return cls(data)
+            except ValueError:
+                pass
+        # Keep the numbers up to the first bad token
+        tokens = text.split()
+        for i, x in enumerate(tokens):
+            try:
+                float(x)
+            except ValueError:
+                return cls(numpy.array(tokens[:i], dtype=numpy.float_), bad_token=x)
+        return cls(numpy.array(tokens, dtype=numpy.float_))
+
+    def __iter__(self):
+        return self
+
+    def _check(self, n):
+        if self.pos + n > len(self.data):
+            if self.bad_token is not None:
+                raise ValueError, "invalid literal for float(): %s" % self.bad_token
+            raise StopIteration
+
+    def next(self):
+        """
+        Returns the next number as float.
+        """
+        self._check(1)
+        self.pos += 1
+        return float(self.data[self.pos - 1])
+
+    def read(self, shape):
+        """
+        Returns the next numbers as float array of the given shape (integer or tuple).
+        """
+        n = int(numpy.prod(shape))
+        self._check(n)
+        self.pos += n
+        return self.data[self.pos - n:self.pos].reshape(shape)
+
+    def close(self):
+        pass
+
+
 class ConverterTools:
 
     def __init__(self):
@@ -28,7 +114,7 @@ class ConverterTools:
 
     def read_fortran_file(self, filename, to_replace):
         """
-        Returns a generator that yields all numbers in the Fortran file as float, with possible replacements.
+        Reads all numbers in the Fortran file at once, with possible replacements.
 
         Parameters
         ----------
@@ -37,21 +123,20 @@ class ConverterTools:
         to_replace : dict of str:str
                      Dictionary defining old_char:new_char.
 
-        Yields
-        ------
-        string
-            The next number in file.
+        Returns
+        -------
+        FortranNumbers
+            Reader returning the numbers one by one (``R.next()``) or in blocks (``R.read(shape)``).
 
         """
         import os.path
-        import string
         if not(os.path.exists(filename)):
             raise IOError, "File %s does not exist." % filename
-        for line in open(filename, 'r'):
-            for old, new in to_replace.iteritems():
-                line = line.replace(old, new)
-            for x in line.split():
-                yield string.atof(x)
+        with open(filename, 'r') as f:
+            text = f.read()
+        for old, new in to_replace.iteritems():
+            text = text.replace(old, new)
+        return FortranNumbers.from_text(text)
 
     def repack(self):
         """
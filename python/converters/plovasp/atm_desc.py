@@ -17,4 +17,6 @@ module.add_preamble("""
 
 module.add_function ("array_view<double,2> dos_tetra_weights_3d (array_view<double,1> eigk, double en, array_view<long,2> itt)", doc = """DOS of a band by analytical tetrahedron method\n\n   Returns corner weights for all tetrahedra for a given band and real energy.""")
 
+module.add_function ("array<double,3> dos_tetra_k_weights_3d (array_view<double,2> eigk, array_view<double,1> emesh, array_view<long,2> itt)", doc = """DOS of a set of bands by analytical tetrahedron method\n\n   Returns DOS weights of all k-points and bands for all energies of a mesh.""")
+
 module.generate_code()
@@ -37,11 +37,14 @@ import sys
 import vaspio
 from inpconf import ConfigParameters
 from elstruct import ElectronicStructure
-from plotools import generate_plo, output_as_text
+from plotools import generate_plo, output_as_text, plo_header, plo_arrays
 
-def generate_and_output_as_text(conf_filename, vasp_dir):
+def generate_plo_data(conf_filename, vasp_dir):
     """
-    Parse config file, process VASP data, and store as text.
+    Parse config file, process VASP data, and generate PLOs.
+
+    Returns the parameters, the electronic structure, and the projector
+    shells and groups.
     """
 # Prepare input-file parameters
     pars = ConfigParameters(conf_filename, verbosity=0)
@@ -52,16 +55,37 @@ def generate_and_output_as_text(conf_filename, vasp_dir):
         efermi_required = False
     else:
         efermi_required = True
-    vasp_data = vaspio.VaspData(vasp_dir, efermi_required=efermi_required)
+# Only the projectors of the sites used in the shells are needed
+    sites = sorted(set([ion + 1 for sh in pars.shells for ion in sh['ion_list']]))
+    vasp_data = vaspio.VaspData(vasp_dir, efermi_required=efermi_required, sites=sites)
     el_struct = ElectronicStructure(vasp_data)
     el_struct.debug_density_matrix()
     if 'efermi' in pars.general:
         el_struct.efermi = pars.general['efermi']
 
-# Generate and store PLOs
+# Generate PLOs
     pshells, pgroups = generate_plo(pars, el_struct)
+
+    return pars, el_struct, pshells, pgroups
+
+def generate_and_output_as_text(conf_filename, vasp_dir):
+    """
+    Parse config file, process VASP data, and store as text.
+    """
+    pars, el_struct, pshells, pgroups = generate_plo_data(conf_filename, vasp_dir)
     output_as_text(pars, el_struct, pshells, pgroups)
 
+def generate_plo_arrays(conf_filename, vasp_dir):
+    """
+    Parse config file, process VASP data, and return the PLO groups in memory.
+
+    Returns a list with a tuple (header, arrays) for each group, containing
+    the same data as the files '<basename>.pg<Ng>' and '<basename>.pg<Ng>.npz'
+    written with the 'binary' option.
+    """
+    pars, el_struct, pshells, pgroups = generate_plo_data(conf_filename, vasp_dir)
+    return [(plo_header(el_struct, pgroup), plo_arrays(el_struct, pgroup)) for pgroup in pgroups]
+
 def main():
     """
     This function should not be called directly but via a bash script
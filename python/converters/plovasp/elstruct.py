@@ -144,19 +144,13 @@ class ElectronicStructure:
 # Spin factor
         sp_fac = 2.0 if ns == 1 and not self.nc_flag else 1.0
 
-        den_mat = np.zeros((ns, nproj, nproj), dtype=np.float64)
-        overlap = np.zeros((ns, nproj, nproj), dtype=np.float64)
-#        ov_min = np.ones((ns, nproj, nproj), dtype=np.float64) * 100.0
-#        ov_max = np.zeros((ns, nproj, nproj), dtype=np.float64)
-        for ispin in xrange(ns):
-            for ik in xrange(nk):
-                kweight = self.kmesh['kweights'][ik]
-                occ = self.ferw[ispin, ik, :]
-                den_mat[ispin, :, :] += np.dot(plo[:, ispin, ik, :] * occ, plo[:, ispin, ik, :].T.conj()).real * kweight * sp_fac
-                ov = np.dot(plo[:, ispin, ik, :], plo[:, ispin, ik, :].T.conj()).real
-                overlap[ispin, :, :] += ov * kweight
-#                ov_max = np.maximum(ov, ov_max)
-#                ov_min = np.minimum(ov, ov_min)
+# Sum over k-points and bands at once: plo_s[ispin, iproj, ik * nb + ib]
+        plo_s = plo.reshape((nproj, ns, nk * nb)).transpose((1, 0, 2))
+        plo_h = plo_s.conj().transpose((0, 2, 1))
+        kweights = np.repeat(self.kmesh['kweights'], nb)
+        occ = self.ferw[:ns, :, :].reshape((ns, 1, nk * nb))
+        den_mat = np.matmul(plo_s * (occ * kweights * sp_fac), plo_h).real
+        overlap = np.matmul(plo_s * kweights, plo_h).real
 
 # Output only the site-diagonal parts of the matrices
         for ispin in xrange(ns):
@@ -164,14 +158,13 @@ class ElectronicStructure:
             print "  Spin:", ispin + 1
             for io, ion in enumerate(ions):
                 print "  Site:", ion
-                iorb_inds = [(ip, param['m']) for ip, param in enumerate(self.proj_params) if param['isite'] == ion]
-                norb = len(iorb_inds)
+                inds = [ip for ip, param in enumerate(self.proj_params) if param['isite'] == ion]
+                iorbs = [self.proj_params[ip]['m'] for ip in inds]
+                norb = len(inds)
                 dm = np.zeros((norb, norb))
                 ov = np.zeros((norb, norb))
-                for ind, iorb in iorb_inds:
-                    for ind2, iorb2 in iorb_inds:
-                        dm[iorb, iorb2] = den_mat[ispin, ind, ind2]
-                        ov[iorb, iorb2] = overlap[ispin, ind, ind2]
+                dm[np.ix_(iorbs, iorbs)] = den_mat[ispin][np.ix_(inds, inds)]
+                ov[np.ix_(iorbs, iorbs)] = overlap[ispin][np.ix_(inds, inds)]
 
                 print "  Density matrix" + (12*norb - 12)*" " + "Overlap"
                 for drow, dov in zip(dm, ov):
@@ -97,7 +97,9 @@ class ConfigParameters:
         self.gen_optional = {
             'basename' : ('basename', str, 'vasp'),
             'efermi' : ('efermi', float),
-            'dosmesh': ('dosmesh', self.parse_string_dosmesh)}
+            'dosmesh': ('dosmesh', self.parse_string_dosmesh),
+            'binary': ('binary', self.parse_string_logical),
+            'nprocs': ('nprocs', int)}
 
 #
 # Special parsers
@@ -35,6 +35,7 @@ r"""
     required by DFTTools.
 """
 import itertools as it
+import os
 import numpy as np
 from proj_group import ProjectorGroup
 from proj_shell import ProjectorShell
@@ -120,7 +121,7 @@ def generate_plo(conf_pars, el_struct):
     pgroups = []
     for gr_par in conf_pars.groups:
         pgroup = ProjectorGroup(gr_par, pshells, eigvals)
-        pgroup.orthogonalize()
+        pgroup.orthogonalize(nprocs=conf_pars.general.get('nprocs', 1))
 # DEBUG output
         print "Density matrix:"
         dm_all, ov_all = pshells[pgroup.ishells[0]].density_matrix(el_struct)
@@ -181,6 +182,9 @@ def generate_plo(conf_pars, el_struct):
 def output_as_text(pars, el_struct, pshells, pgroups):
     """
     Output all information necessary for the converter as text files.
+
+    If 'binary' is set in the [General] section, the files contain only
+    the JSON headers, and the data are stored in binary .npz files.
     """
     ctrl_output(pars, el_struct, len(pgroups))
     plo_output(pars, el_struct, pshells, pgroups)
@@ -232,6 +236,7 @@ def ctrl_output(conf_pars, el_struct, ng):
     Outputs a ctrl-file.
     """
     ctrl_fname = conf_pars.general['basename'] + '.ctrl'
+    binary = conf_pars.general.get('binary', False)
     head_dict = {}
 
 # TODO: Add output of tetrahedra
@@ -241,6 +246,8 @@ def ctrl_output(conf_pars, el_struct, ng):
     head_dict['ns'] = el_struct.nspin
     head_dict['nc_flag'] = 1 if el_struct.nc_flag else 0
 #    head_dict['efermi'] = conf_pars.general['efermi']  # We probably don't need Efermi
+    if binary:
+        head_dict['data_file'] = os.path.basename(ctrl_fname) + '.npz'
 
     header = json.dumps(head_dict, indent=4, separators=(',', ': '))
 
@@ -249,6 +256,11 @@ def ctrl_output(conf_pars, el_struct, ng):
         f.write(header + "\n")
         f.write("#END OF HEADER\n")
 
+        if binary:
+            np.savez(ctrl_fname + '.npz', kpoints=el_struct.kmesh['kpoints'],
+                     kweights=el_struct.kmesh['kweights'])
+            return
+
         f.write("# k-points and weights\n")
         labels = ['kx', 'ky', 'kz', 'kweight']
         out = "".join(map(lambda s: s.center(15), labels))
@@ -259,6 +271,75 @@ def ctrl_output(conf_pars, el_struct, ng):
             f.write(out + "\n")
 
 
+################################################################################
+#
+# plo_header
+#
+################################################################################
+def plo_header(el_struct, pgroup):
+    """
+    Returns the header of a PLO group (energy window, number of bands,
+    number of electrons within the window, and the projected shells)
+    as a dictionary.
+    """
+    head_dict = {}
+
+    head_dict['ewindow'] = (pgroup.emin, pgroup.emax)
+    head_dict['nb_max'] = pgroup.nb_max
+
+# Number of electrons within the window
+    head_dict['nelect'] = pgroup.nelect_window(el_struct)
+
+    head_shells = []
+    for ish in pgroup.ishells:
+        shell = pgroup.shells[ish]
+        sh_dict = {}
+        sh_dict['shell_index'] = ish
+        sh_dict['lorb'] = shell.lorb
+        sh_dict['ndim'] = shell.ndim
+# Convert ion indices from the internal representation (starting from 0)
+# to conventional VASP representation (starting from 1)
+        ion_output = [io + 1 for io in shell.ion_list]
+        sh_dict['ion_list'] = ion_output
+        sh_dict['ion_sort'] = el_struct.type_of_ion[shell.ion_list[0]]
+
+# TODO: add the output of transformation matrices
+
+        head_shells.append(sh_dict)
+
+    head_dict['shells'] = head_shells
+
+    return head_dict
+
+################################################################################
+#
+# plo_arrays
+#
+################################################################################
+def plo_arrays(el_struct, pgroup):
+    """
+    Returns the band windows, eigenvalues, Fermi weights and projectors of
+    a PLO group as a dictionary of arrays (see plo_output()).
+    """
+    nk, nband, ns_band = el_struct.eigvals.shape
+    ib_win = pgroup.ib_win.transpose((1, 0, 2))[:ns_band]
+    nb_max = pgroup.nb_max
+
+# Gather the eigenvalues and Fermi weights within the windows
+    ib = ib_win[:, :, 0, None] + np.arange(nb_max)
+    in_win = ib <= ib_win[:, :, 1, None]
+    ib = np.where(in_win, ib, 0)
+    isp = np.arange(ns_band)[:, None, None]
+    ik = np.arange(nk)[None, :, None]
+    eigvals = np.where(in_win, el_struct.eigvals[ik, ib, isp] - el_struct.efermi, 0.0)
+    ferw = np.where(in_win, el_struct.ferw[isp, ik, ib], 0.0)
+
+    arrays = {'ib_win': ib_win + 1, 'eigvals': eigvals, 'ferw': ferw}
+    for ish in pgroup.ishells:
+        arrays['proj_%i'%(ish)] = pgroup.shells[ish].proj_win
+
+    return arrays
+
 ################################################################################
 #
 # plo_output
@@ -271,7 +352,7 @@ def plo_output(conf_pars, el_struct, pshells, pgroups):
     Filenames are defined by <basename> that is passed from config-file.
     All necessary general parameters are stored in a file '<basename>.ctrl'.
 
-    Each group is stored in a '<basename>.plog<Ng>' file. The format is the
+    Each group is stored in a '<basename>.pg<Ng>' file. The format is the
     following:
 
     # Energy window: emin, emax
@@ -300,43 +381,34 @@ def plo_output(conf_pars, el_struct, pshells, pgroups):
     Shell 2
     ...
 
+    If 'binary' is set in the [General] section, only the header is written
+    to '<basename>.pg<Ng>' and the data are stored in '<basename>.pg<Ng>.npz'
+    with arrays
+      - 'ib_win' (ns, nk, 2): band windows (Fortran convention)
+      - 'eigvals', 'ferw' (ns, nk, nb_max): eigenvalues (relative to Efermi)
+        and Fermi weights within the windows
+      - 'proj_<ish>' (nion, ns, nk, ndim, nb_max): projectors of shell <ish>
+
     """
+    binary = conf_pars.general.get('binary', False)
     for ig, pgroup in enumerate(pgroups):
         plo_fname = conf_pars.general['basename'] + '.pg%i'%(ig + 1)
         print "  Storing PLO-group file '%s'..."%(plo_fname)
-        head_dict = {}
-
-        head_dict['ewindow'] = (pgroup.emin, pgroup.emax)
-        head_dict['nb_max'] = pgroup.nb_max
-
-# Number of electrons within the window
-        head_dict['nelect'] = pgroup.nelect_window(el_struct)
+        head_dict = plo_header(el_struct, pgroup)
         print "  Density within window:", head_dict['nelect']
 
-        head_shells = []
-        for ish in pgroup.ishells:
-            shell = pgroup.shells[ish]
-            sh_dict = {}
-            sh_dict['shell_index'] = ish
-            sh_dict['lorb'] = shell.lorb
-            sh_dict['ndim'] = shell.ndim
-# Convert ion indices from the internal representation (starting from 0)
-# to conventional VASP representation (starting from 1)
-            ion_output = [io + 1 for io in shell.ion_list]
-            sh_dict['ion_list'] = ion_output
-            sh_dict['ion_sort'] = el_struct.type_of_ion[shell.ion_list[0]]
-
-# TODO: add the output of transformation matrices
-
-            head_shells.append(sh_dict)
-
-        head_dict['shells'] = head_shells
+        if binary:
+            head_dict['data_file'] = os.path.basename(plo_fname) + '.npz'
 
         header = json.dumps(head_dict, indent=4, separators=(',', ': '))
 
         with open(plo_fname, 'wt') as f:
             f.write(header + "\n")
             f.write("#END OF HEADER\n")
+
+            if binary:
+                np.savez(plo_fname + '.npz', **plo_arrays(el_struct, pgroup))
+                continue
             
 # Eigenvalues within the window
             f.write("# Eigenvalues within the energy window: %s, %s\n"%(pgroup.emin, pgroup.emax))
@@ -30,9 +30,41 @@ r"""
     Storage and manipulation of projector groups.
 """
 import numpy as np
+import multiprocessing
 
 np.set_printoptions(suppress=True)
 
+################################################################################
+#
+# orthogonalize_projector_matrices()
+#
+################################################################################
+def orthogonalize_projector_matrices(p_matrices):
+    """
+    Orthogonalizes a stack of projectors defined by rectangular matrices
+    `p_matrices[i]` (see ProjectorGroup.orthogonalize_projector_matrix()).
+
+    Parameters
+    ----------
+
+    p_matrices (numpy.array[complex]) : array `N x Nm x Nb`, where `Nm` is
+      the number of orbitals, `Nb` number of bands
+
+    Returns
+    -------
+
+    Orthogonalized projector matrices.
+    """
+# Overlap matrices O_{m m'} = \sum_{v} P_{m v} P^{*}_{v m'}
+    overlap = np.matmul(p_matrices, p_matrices.conj().transpose((0, 2, 1)))
+# Calculate [O^{-1/2}]_{m m'}
+    eig, eigv = np.linalg.eigh(overlap)
+    assert np.all(eig > 0.0), ("Negative eigenvalues of the overlap matrix:"
+       "projectors are ill-defined")
+    shalf = np.matmul(eigv / np.sqrt(eig)[:, None, :], eigv.conj().transpose((0, 2, 1)))
+# Apply \tilde{P}_{m v} = \sum_{m'} [O^{-1/2}]_{m m'} P_{m' v}
+    return np.matmul(shalf, p_matrices)
+
 ################################################################################
 ################################################################################
 #
@@ -106,7 +138,7 @@ class ProjectorGroup:
 # orthogonalize
 #
 ################################################################################
-    def orthogonalize(self):
+    def orthogonalize(self, nprocs=1):
         """
         Orthogonalize a group of projectors.
 
@@ -123,6 +155,10 @@ class ProjectorGroup:
         contained in different projector shells.
 
         The construction of block maps is performed in 'self.get_block_matrix_map()'.
+
+        The block projectors of all k-points and spins are orthogonalized
+        at once. If 'nprocs' > 1, the k-points are split over a pool
+        of 'nprocs' processes.
         """
 # Quick exit if no normalization is requested
         if not self.ortho:
@@ -131,30 +167,45 @@ class ProjectorGroup:
         block_maps, ndim = self.get_block_matrix_map()
 
         _, ns, nk, _, _ = self.shells[0].proj_win.shape
-        p_mat = np.zeros((ndim, self.nb_max), dtype=np.complex128)
 # Note that 'ns' and 'nk' are the same for all shells
-        for isp in xrange(ns):
-            for ik in xrange(nk):
-                nb = self.ib_win[ik, isp, 1] - self.ib_win[ik, isp, 0] + 1
-# Combine all projectors of the group to one block projector
-                for bl_map in block_maps:
-                    p_mat[:, :] = 0.0j  # !!! Clean-up from the last k-point and block!
-                    for ibl, block in enumerate(bl_map):
-                        i1, i2 = block['bmat_range']
-                        ish, ion = block['shell_ion']
-                        nlm = i2 - i1 + 1
-                        shell = self.shells[ish]
-                        p_mat[i1:i2, :nb] = shell.proj_win[ion, isp, ik, :nlm, :nb]
-# Now orthogonalize the obtained block projector
-                    ibl_max = i2
-                    p_orth, overl, eig = self.orthogonalize_projector_matrix(p_mat[:ibl_max, :nb])
+# Bands outside the window of each k-point are masked out
+        nb = self.ib_win[:, :ns, 1] - self.ib_win[:, :ns, 0] + 1
+        in_win = np.arange(self.nb_max) < nb.T[:, :, None]
+
+        pool = multiprocessing.Pool(nprocs) if nprocs > 1 else None
+        try:
+            for bl_map in block_maps:
+# Combine all projectors of the group to one block projector for all k-points
+                ibl_max = bl_map[-1]['bmat_range'][1]
+                p_mat = np.zeros((ns, nk, ibl_max, self.nb_max), dtype=np.complex128)
+                for block in bl_map:
+                    i1, i2 = block['bmat_range']
+                    ish, ion = block['shell_ion']
+                    nlm = i2 - i1
+                    shell = self.shells[ish]
+                    p_mat[:, :, i1:i2, :] = shell.proj_win[ion, :, :, :nlm, :]
+                p_mat *= in_win[:, :, None, :]
+                p_mat = p_mat.reshape((ns * nk, ibl_max, self.nb_max))
+
+# Now orthogonalize the obtained block projectors
+                if pool is None:
+                    p_orth = orthogonalize_projector_matrices(p_mat)
+                else:
+                    chunks = np.array_split(p_mat, nprocs)
+                    p_orth = np.concatenate(pool.map(orthogonalize_projector_matrices, chunks))
+                p_orth = p_orth.reshape((ns, nk, ibl_max, self.nb_max))
+
 # Distribute projectors back using the same mapping
-                    for ibl, block in enumerate(bl_map):
-                        i1, i2 = block['bmat_range']
-                        ish, ion = block['shell_ion']
-                        nlm = i2 - i1 + 1
-                        shell = self.shells[ish]
-                        shell.proj_win[ion, isp, ik, :nlm, :nb] = p_orth[i1:i2, :nb]
+                for block in bl_map:
+                    i1, i2 = block['bmat_range']
+                    ish, ion = block['shell_ion']
+                    nlm = i2 - i1
+                    shell = self.shells[ish]
+                    shell.proj_win[ion, :, :, :nlm, :] = p_orth[:, :, i1:i2, :]
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
 ################################################################################
 #
@@ -308,31 +359,21 @@ class ProjectorGroup:
         nk, nband, ns_band = eigvals.shape
         ib_win = np.zeros((nk, ns_band, 2), dtype=np.int32)
 
-        ib_min = 10000000
-        ib_max = 0
-        for isp in xrange(ns_band):
-            for ik in xrange(nk):
-                for ib in xrange(nband):
-                    en = eigvals[ik, ib, isp]
-                    if en >= self.emin:
-                        break
-                ib1 = ib
-                for ib in xrange(ib1, nband):
-                    en = eigvals[ik, ib, isp]
-                    if en > self.emax:
-                        break
-                else:
-# If we reached the last band add 1 to get the correct bound
-                    ib += 1
-                ib2 = ib - 1
+# Since the bands are sorted, the number of bands below 'emin' is the index
+# of the first band in the window (as given by a search in each k-point).
+# If all bands are below 'emin', the last band is taken.
+        ib1 = np.minimum((eigvals < self.emin).sum(axis=1), nband - 1)
+# The first band above 'emax' is searched for starting from 'ib1'
+        ib2 = np.maximum((eigvals <= self.emax).sum(axis=1), ib1) - 1
 
-                assert ib1 <= ib2, "No bands inside the window for ik = %s"%(ik)
+        empty = np.nonzero(ib1 > ib2)[0]
+        assert len(empty) == 0, "No bands inside the window for ik = %s"%(empty[0])
 
-                ib_win[ik, isp, 0] = ib1
-                ib_win[ik, isp, 1] = ib2
+        ib_win[:, :, 0] = ib1
+        ib_win[:, :, 1] = ib2
 
-                ib_min = min(ib_min, ib1)
-                ib_max = max(ib_max, ib2)
+        ib_min = ib1.min()
+        ib_max = ib2.max()
 
         return ib_win, ib_min, ib_max
 
@@ -39,6 +39,7 @@ def issue_warning(message):
 
 import itertools as it
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 try:
     import atm
     atmlib_present = True
@@ -217,43 +218,36 @@ class ProjectorShell:
         nlm = self.lm2 - self.lm1
         _, ns, nk, nb = proj_raw.shape
 
+# Lookup table (isite, l, m) -> index of the raw projector
+# (the first projector is taken if there are several with the same indices)
+        proj_index = {}
+        for ip, par in enumerate(proj_params):
+            proj_index.setdefault((par['isite'] - 1, par['l'], par['m']), ip)
+
         if self.do_transform:
 # TODO: implement a non-collinear case
 #       for a non-collinear case 'ndim' is 'ns * nm'
             ndim = self.tmatrices.shape[1]
             self.proj_arr = np.zeros((nion, ns, nk, ndim, nb), dtype=np.complex128)
-            for ik in xrange(nk):
-                kp = kmesh['kpoints'][ik]
-                for io, ion in enumerate(self.ion_list):
-                    proj_k = np.zeros((ns, nlm, nb), dtype=np.complex128)
-                    qcoord = structure['qcoords'][ion]
-#                    kphase = np.exp(-2.0j * np.pi * np.dot(kp, qcoord))
-#                    kphase = 1.0
-                    for m in xrange(nlm):
-# Here we search for the index of the projector with the given isite/l/m indices
-                        for ip, par in enumerate(proj_params):
-                            if par['isite'] - 1 == ion and par['l'] == self.lorb and par['m'] == m:
-                                proj_k[:, m, :] = proj_raw[ip, :, ik, :]  #* kphase
-                                break
-                    for isp in xrange(ns):
-                        self.proj_arr[io, isp, ik, :, :] = np.dot(self.tmatrices[io, :, :], proj_k[isp, :, :])
+            proj_ion = np.zeros((nlm, ns, nk, nb), dtype=np.complex128)
+            for io, ion in enumerate(self.ion_list):
+                proj_ion[...] = 0.0
+                for m in xrange(nlm):
+                    ip = proj_index.get((ion, self.lorb, m))
+                    if ip is not None:
+                        proj_ion[m, :, :, :] = proj_raw[ip, :, :, :]
+# Transform the projectors of all spins and k-points at once
+                self.proj_arr[io, :, :, :, :] = np.einsum('dm,mskb->skdb', self.tmatrices[io, :, :], proj_ion,
+                                                          optimize=True)
 
         else:
 # No transformation: just copy the projectors as they are
             self.proj_arr = np.zeros((nion, ns, nk, nlm, nb), dtype=np.complex128)
             for io, ion in enumerate(self.ion_list):
-                qcoord = structure['qcoords'][ion]
                 for m in xrange(nlm):
-# Here we search for the index of the projector with the given isite/l/m indices
-                    for ip, par in enumerate(proj_params):
-                        if par['isite'] - 1 == ion and par['l'] == self.lorb and par['m'] == m:
-                            self.proj_arr[io, :, :, m, :] = proj_raw[ip, :, :, :]
-#                            for ik in xrange(nk):
-#                                kp = kmesh['kpoints'][ik]
-##                                kphase = np.exp(-2.0j * np.pi * np.dot(kp, qcoord))
-#                                kphase = 1.0
-#                                self.proj_arr[io, :, :, m, :] = proj_raw[ip, :, :, :] # * kphase
-                            break
+                    ip = proj_index.get((ion, self.lorb, m))
+                    if ip is not None:
+                        self.proj_arr[io, :, :, m, :] = proj_raw[ip, :, :, :]
 
 
 ################################################################################
@@ -277,14 +271,56 @@ class ProjectorShell:
 
 # Select projectors for a given energy window
         ns_band = self.ib_win.shape[1]
-        for isp in xrange(ns):
-            for ik in xrange(nk):
 # TODO: for non-collinear case something else should be done here
-                is_b = min(isp, ns_band)
-                ib1 = self.ib_win[ik, is_b, 0]
-                ib2 = self.ib_win[ik, is_b, 1] + 1
-                ib_win = ib2 - ib1
-                self.proj_win[:, isp, ik, :, :ib_win] = self.proj_arr[:, isp, ik, :, ib1:ib2]
+        is_b = np.minimum(np.arange(ns), ns_band)
+        ib1 = self.ib_win[:, is_b, 0].T
+        ib2 = self.ib_win[:, is_b, 1].T
+        in_win = ib1[:, :, None] + np.arange(nb_max) <= ib2[:, :, None]
+
+# View of all windows of 'nb_max' consecutive bands, win[..., ib, :] = proj_arr[..., ib:ib + nb_max],
+# from which the windows of all k-points are gathered at once
+        win = as_strided(self.proj_arr, shape=(nion, ns, nk, nlm, nbtot - nb_max + 1, nb_max),
+                         strides=self.proj_arr.strides + self.proj_arr.strides[-1:])
+        ib_start = np.minimum(ib1, nbtot - nb_max)
+        fits = ib_start == ib1
+        isp = np.arange(ns)[:, None]
+        ik = np.arange(nk)[None, :]
+# Advanced indices come first: proj[isp, ik, ion, ilm, ib]
+        proj = win[:, isp, ik, :, ib_start]
+# Bands beyond the window of each k-point are left zero
+        in_win &= fits[:, :, None]
+        np.copyto(self.proj_win, proj.transpose((2, 0, 1, 3, 4)), where=in_win[None, :, :, None, :])
+
+# Windows reaching beyond the last 'nb_max' bands are copied separately
+        for isp, ik in zip(*np.nonzero(~fits)):
+            ib1_k, ib2_k = ib1[isp, ik], ib2[isp, ik] + 1
+            self.proj_win[:, isp, ik, :, :ib2_k - ib1_k] = self.proj_arr[:, isp, ik, :, ib1_k:ib2_k]
+
+################################################################################
+#
+# band_sum
+#
+################################################################################
+    def band_sum(self, band_weights, site_diag=True):
+        """
+        Returns the real part of sum_{k, b} P_{m b}(k) w_b(k) P^{*}_{m' b}(k)
+        for all spins, where 'band_weights' w_b(k) is an array [ns, nk, nb_max]
+        of weights of the bands within the window.
+
+        The matrices are calculated for each ion, or for the block matrix
+        of all ions if 'site_diag' is False.
+        """
+        nion, ns, nk, nlm, nbtot = self.proj_win.shape
+
+# Combine k-points and bands to one index: proj[isp, io, m, ik * nb + ib]
+        proj = self.proj_win.transpose((1, 0, 3, 2, 4))
+        if site_diag:
+            proj = proj.reshape((ns, nion, nlm, nk * nbtot))
+        else:
+            proj = proj.reshape((ns, 1, nion * nlm, nk * nbtot))
+        weights = band_weights.reshape((ns, 1, 1, nk * nbtot))
+
+        return np.matmul(proj * weights, proj.conj().transpose((0, 1, 3, 2))).real
 
 ################################################################################
 #
@@ -300,40 +336,14 @@ class ProjectorShell:
 #        assert site_diag, "site_diag = False is not implemented"
         assert spin_diag, "spin_diag = False is not implemented"
 
-        if site_diag:
-            occ_mats = np.zeros((ns, nion, nlm, nlm), dtype=np.float64)
-            overlaps = np.zeros((ns, nion, nlm, nlm), dtype=np.float64)
-        else:
-            ndim = nion * nlm
-            occ_mats = np.zeros((ns, 1, ndim, ndim), dtype=np.float64)
-            overlaps = np.zeros((ns, 1, ndim, ndim), dtype=np.float64)
-
 #        self.proj_win = np.zeros((nion, ns, nk, nlm, nb_max), dtype=np.complex128)
         kweights = el_struct.kmesh['kweights']
         occnums = el_struct.ferw
         ib1 = self.ib_min
         ib2 = self.ib_max + 1
-        if site_diag:
-            for isp in xrange(ns):
-                for ik, weight, occ in it.izip(it.count(), kweights, occnums[isp, :, :]):
-                    for io in xrange(nion):
-                        proj_k = self.proj_win[io, isp, ik, ...]
-                        occ_mats[isp, io, :, :] += np.dot(proj_k * occ[ib1:ib2],
-                                                     proj_k.conj().T).real * weight
-                        overlaps[isp, io, :, :] += np.dot(proj_k,
-                                                     proj_k.conj().T).real * weight
-        else:
-            proj_k = np.zeros((ndim, nbtot), dtype=np.complex128)
-            for isp in xrange(ns):
-                for ik, weight, occ in it.izip(it.count(), kweights, occnums[isp, :, :]):
-                    for io in xrange(nion):
-                        i1 = io * nlm
-                        i2 = (io + 1) * nlm
-                        proj_k[i1:i2, :] = self.proj_win[io, isp, ik, ...]
-                    occ_mats[isp, 0, :, :] += np.dot(proj_k * occ[ib1:ib2],
-                                                 proj_k.conj().T).real * weight
-                    overlaps[isp, 0, :, :] += np.dot(proj_k,
-                                                 proj_k.conj().T).real * weight
+        weights = np.ones((ns, nk, nbtot)) * kweights[None, :, None]
+        occ_mats = self.band_sum(occnums[:ns, :, ib1:ib2] * weights, site_diag)
+        overlaps = self.band_sum(weights, site_diag)
 
 #        if not symops is None:
 #            occ_mats = symmetrize_matrix_set(occ_mats, symops, ions, perm_map)
@@ -351,23 +361,14 @@ class ProjectorShell:
         """
         nion, ns, nk, nlm, nbtot = self.proj_win.shape
 
-        assert site_diag, "site_diag = False is not implemented"
         assert spin_diag, "spin_diag = False is not implemented"
 
-        loc_ham = np.zeros((ns, nion, nlm, nlm), dtype=np.float64)
-
 #        self.proj_win = np.zeros((nion, ns, nk, nlm, nb_max), dtype=np.complex128)
         kweights = el_struct.kmesh['kweights']
-        occnums = el_struct.ferw
         ib1 = self.ib_min
         ib2 = self.ib_max + 1
-        for isp in xrange(ns):
-            for ik, weight, occ, eigk in it.izip(it.count(), kweights, occnums[isp, :, :],
-                                          el_struct.eigvals[:, ib1:ib2, isp]):
-                for io in xrange(nion):
-                    proj_k = self.proj_win[io, isp, ik, ...]
-                    loc_ham[isp, io, :, :] += np.dot(proj_k * (eigk - el_struct.efermi),
-                                                 proj_k.conj().T).real * weight
+        eigk = el_struct.eigvals[:, ib1:ib2, :ns].transpose((2, 0, 1)) - el_struct.efermi
+        loc_ham = self.band_sum(eigk * kweights[None, :, None], site_diag)
 
 #        if not symops is None:
 #            occ_mats = symmetrize_matrix_set(occ_mats, symops, ions, perm_map)
@@ -391,38 +392,24 @@ class ProjectorShell:
 # for different k-points do not match because we store 'nb_max' values starting
 # from 0.
         nb_max = self.ib_max - self.ib_min + 1
-        ns_band = self.ib_win.shape[1]
 
         ne = len(emesh)
         dos = np.zeros((ne, ns, nion, nlm))
-        w_k = np.zeros((nk, nb_max, ns, nion, nlm), dtype=np.complex128)
-        for isp in xrange(ns):
-            for ik in xrange(nk):
-                is_b = min(isp, ns_band)
-                ib1 = self.ib_win[ik, is_b, 0]
-                ib2 = self.ib_win[ik, is_b, 1] + 1
-                for ib_g in xrange(ib1, ib2):
-                    for io in xrange(nion):
-# Note the difference between 'ib' and 'ibn':
-#  'ib'  counts from 0 to 'nb_k - 1'
-#  'ibn' counts from 'ib1 - ib_min' to 'ib2 - ib_min'
-                        ib = ib_g - ib1
-                        ibn = ib_g - self.ib_min
-                        proj_k = self.proj_win[io, isp, ik, :, ib]
-                        w_k[ik, ib, isp, io, :] = proj_k * proj_k.conj()
-
-#        eigv_ef = el_struct.eigvals[ik, ib, isp] - el_struct.efermi
-        itt = el_struct.kmesh['itet'].T
+# Band weights of the projectors w_k[ik, ib, isp, io, im], with 'ib' counting
+# from 0 to 'nb_k - 1' (the projectors beyond the window of a k-point are zero)
+        w_k = (self.proj_win.real**2 + self.proj_win.imag**2).transpose((2, 4, 1, 0, 3))
+
+        itt = el_struct.kmesh['itet'].T.copy()
 # k-indices are starting from 0 in Python
         itt[1:, :] -= 1
+# The weights of all k-points and bands are calculated for a chunk of energies at once
+        ne_chunk = max(1, 10**7 / (nk * nb_max))
         for isp in xrange(ns):
-            for ib, eigk in enumerate(el_struct.eigvals[:, self.ib_min:self.ib_max+1, isp].T):
-                for ie, e in enumerate(emesh):
-                    eigk_ef = eigk - el_struct.efermi
-                    cti = atm.dos_tetra_weights_3d(eigk_ef, e, itt)
-                    for im in xrange(nlm):
-                        for io in xrange(nion):
-                            dos[ie, isp, io, im] += np.sum((cti * w_k[itt[1:, :], ib, isp, io, im].real).sum(0) * itt[0, :])
+            eigk_ef = el_struct.eigvals[:, self.ib_min:self.ib_max+1, isp] - el_struct.efermi
+            for ie1 in xrange(0, ne, ne_chunk):
+                ie2 = min(ie1 + ne_chunk, ne)
+                wk_e = atm.dos_tetra_k_weights_3d(eigk_ef, emesh[ie1:ie2], itt)
+                dos[ie1:ie2, isp, :, :] = np.tensordot(wk_e, w_k[:, :, isp, :, :], axes=([1, 2], [0, 1]))
 
         dos *= 2 * el_struct.kmesh['volt']
 #        for isp in xrange(ns):
@@ -32,6 +32,7 @@ import signal
 import sys
 import pytriqs.utility.mpi as mpi
 import converter
+from triqs_dft_tools.converters.vasp_converter import dft_input_from_plo
 
 xch = sys.excepthook
 def excepthook(typ, value, traceback):
@@ -89,6 +90,23 @@ def get_dft_energy():
 
     return dft_energy
 
+def update_sum_k(sum_k, cfg_file, vasp_dir='./'):
+    """
+    Generates PLOs and replaces the DFT input of 'sum_k' in memory,
+    without writing the text files and the hdf5 archive.
+
+    Returns the names of the replaced values.
+    """
+    dft_input = None
+    if mpi.is_master_node():
+        pgroups = converter.generate_plo_arrays(cfg_file, vasp_dir=vasp_dir)
+        assert len(pgroups) == 1, "Only one group is allowed at the moment"
+        gr_head, data = pgroups[0]
+        dft_input = dft_input_from_plo(gr_head, data, sum_k.SP + 1 - sum_k.SO)
+    changed = sum_k.update_dft_input(dft_input)
+    mpi.report("  Updated DFT input: %s"%(", ".join(changed)))
+    return changed
+
 class bcolors:
     MAGENTA = '\033[95m'
     BLUE = '\033[94m'
@@ -99,9 +117,17 @@ class bcolors:
 #
 # Main self-consistent cycle
 #
-def run_all(vasp_pid, dmft_cycle, cfg_file, n_iter):
+def run_all(vasp_pid, dmft_cycle, cfg_file, n_iter, get_sum_k=None):
     """
+    If 'get_sum_k' is given, it is called in each iteration and may return
+    the SumkDFT object used by 'dmft_cycle'. If it does, the DFT input of
+    this object is updated in memory (see update_sum_k()) instead of storing
+    the PLOs as text files.
     """
+    if get_sum_k is None:
+        mpi.report("  PLOs are stored as text files in each iteration")
+    else:
+        mpi.report("  DFT input of 'sum_k' is updated in memory (PLOs are stored as text files until 'sum_k' is set)")
     mpi.report("  Waiting for VASP lock to appear...")
     while not is_vasp_lock_present():
         time.sleep(1)
@@ -134,8 +160,12 @@ def run_all(vasp_pid, dmft_cycle, cfg_file, n_iter):
         err = 0
         exc = None
         if debug: print bcolors.BLUE + "plovasp: rank %s"%(mpi.rank) + bcolors.ENDC
-        if mpi.is_master_node():
+        sum_k = get_sum_k() if get_sum_k is not None else None
+        if sum_k is not None:
+            update_sum_k(sum_k, cfg_file)
+        elif mpi.is_master_node():
             converter.generate_and_output_as_text(cfg_file, vasp_dir='./')
+        if mpi.is_master_node():
             # Read energy from OSZICAR
             dft_energy = get_dft_energy()
         mpi.barrier()
@@ -211,7 +241,14 @@ def main():
 
     dmft_mod = importlib.import_module(dmft_script)
 
-    run_all(vasp_pid, dmft_mod.dmft_cycle, cfg_file, n_iter)
+# If the DMFT script sets 'update_sum_k_in_memory = True' and keeps its SumkDFT
+# object in a global variable 'sum_k', it is updated in memory in the following iterations
+    if getattr(dmft_mod, 'update_sum_k_in_memory', False):
+        get_sum_k = lambda: getattr(dmft_mod, 'sum_k', None)
+    else:
+        get_sum_k = None
+
+    run_all(vasp_pid, dmft_mod.dmft_cycle, cfg_file, n_iter, get_sum_k)
 
 if __name__ == '__main__':
     main()
@@ -39,6 +39,7 @@ r"""
 """
 import numpy as np
 import re
+import time
 #import plocar_io.c_plocar_io as c_plocar_io
 
 def read_lines(filename):
@@ -65,7 +66,7 @@ class VaspData:
     """
     Container class for all VASP data.
     """
-    def __init__(self, vasp_dir, read_all=True, efermi_required=True):
+    def __init__(self, vasp_dir, read_all=True, efermi_required=True, sites=None):
         self.vasp_dir = vasp_dir
 
         self.plocar = Plocar()
@@ -75,7 +76,7 @@ class VaspData:
         self.doscar = Doscar()
 
         if read_all:
-            self.plocar.from_file(vasp_dir)
+            self.plocar.from_file(vasp_dir, sites=sites)
             self.poscar.from_file(vasp_dir)
             self.kpoints.from_file(vasp_dir)
             try:
@@ -114,7 +115,7 @@ class Plocar:
     - *ferw* (array(nion, ns, nk, nb)) : Fermi weights from VASP
     """
 
-    def from_file(self, vasp_dir='./', plocar_filename='PLOCAR'):
+    def from_file(self, vasp_dir='./', plocar_filename='PLOCAR', sites=None):
         r"""
         Reads non-normalized projectors from a binary file (`PLOCAR' by default)
         generated by VASP PLO interface.
@@ -124,6 +125,7 @@ class Plocar:
 
         vasp_dir (str) : path to the VASP working directory [default = `./']
         plocar_filename (str) : filename [default = `PLOCAR']
+        sites (list of int) : if given, only projectors of these sites (starting with 1) are read
 
         """
 # Add a slash to the path name if necessary
@@ -132,7 +134,7 @@ class Plocar:
 
 #        self.params, self.plo, self.ferw = c_plocar_io.read_plocar(vasp_dir + plocar_filename)
 #        self.proj_params, self.plo = self.temp_parser(projcar_filename=vasp_dir + "PROJCAR", locproj_filename=vasp_dir + "LOCPROJ")
-        self.proj_params, self.plo = self.locproj_parser(locproj_filename=vasp_dir + "LOCPROJ")
+        self.proj_params, self.plo = self.locproj_parser(locproj_filename=vasp_dir + "LOCPROJ", sites=sites)
 
     def temp_parser(self, projcar_filename='PROJCAR', locproj_filename='LOCPROJ'):
         r"""
@@ -213,15 +215,27 @@ class Plocar:
 
         return proj_params, plo
 
-    def locproj_parser(self, locproj_filename='LOCPROJ'):
+    def locproj_parser(self, locproj_filename='LOCPROJ', sites=None, chunk_size=64):
         r"""
         Parses LOCPROJ (for VASP >= 5.4.2) to get VASP projectors.
 
-        This is a prototype parser that should eventually be written in C for
-        better performance on large files.
+        The data part of the file is read in chunks of `chunk_size` MB, each of
+        which is converted to numbers in one go. Each record of the file
+        (one band at a given k-point and spin) consists of the line
+        'orbital <ispin> <ik> <ib> <eig> <ferw>' followed by `nproj` lines
+        '<ip> <Re> <Im>', so that a chunk of complete records is parsed into
+        an array of shape (nrec, 5 + 3 * nproj).
 
         Returns projector parameters (site/orbital indices etc.) and an array
         with projectors.
+
+        Parameters
+        ----------
+
+        locproj_filename (str) : filename [default = `LOCPROJ']
+        sites (list of int) : if given, only projectors of these sites (ISITE
+                              indices, starting with 1) are stored
+        chunk_size (float) : size of the chunks in MB [default = 64]
         """
         orb_labels = ["s", "py", "pz", "px", "dxy", "dyz", "dz2", "dxz", "dx2-y2",
                       "fy(3x2-y2)", "fxyz", "fyz2", "fz3", "fxz2", "fz(x2-y2)", "fx(x2-3y2)"]
@@ -231,6 +245,7 @@ class Plocar:
             m = lm - l*l
             return l, m
 
+        t_start = time.time()
 # Read the first line of LOCPROJ to get the dimensions
         with open(locproj_filename, 'rt') as f:
             line = f.readline()
@@ -242,12 +257,8 @@ class Plocar:
 
             self.efermi = float(sline[4])
 
-            plo = np.zeros((nproj, self.nspin, nk, self.nband), dtype=np.complex128)
             proj_params = [{} for i in xrange(nproj)]
 
-            iproj_site = 0
-            is_first_read = True
-
 # First read the header block with orbital labels
             line = self.search_for(f, "^ *ISITE")
             ip = 0
@@ -257,8 +268,6 @@ class Plocar:
                 label = sline[-1].strip()
                 lm = orb_labels.index(label)
                 l, m = lm_to_l_m(lm)
-#                    ip_new = iproj_site * norb + il
-#                    ip_prev = (iproj_site - 1) * norb + il
                 proj_params[ip]['label'] = label
                 proj_params[ip]['isite'] = isite
                 proj_params[ip]['l'] = l
@@ -269,29 +278,63 @@ class Plocar:
 
             assert ip == nproj, "Number of projectors in the header is wrong in LOCPROJ"
 
+# Select the projectors of the requested sites
+            if sites is None:
+                proj_inds = np.arange(nproj)
+            else:
+                proj_inds = np.array([ip for ip, par in enumerate(proj_params) if par['isite'] in sites], dtype=int)
+                assert len(proj_inds) > 0, "No projectors for sites %s in LOCPROJ"%(sites)
+                proj_params = [proj_params[ip] for ip in proj_inds]
+
+            plo = np.zeros((len(proj_inds), self.nspin, nk, self.nband), dtype=np.complex128)
             self.eigs = np.zeros((nk, self.nband, self.nspin_band))
             self.ferw = np.zeros((nk, self.nband, self.nspin_band))
 
-            patt = re.compile("^orbital")
 # FIXME: fix spin indices for NCDIJ = 4 (non-collinear)
             assert self.ncdij < 4, "Non-collinear case is not implemented"
-            for ispin in xrange(self.nspin):
-                for ik in xrange(nk):
-                    for ib in xrange(self.nband):
-                        line = ""
-                        while not line:
-                            line = f.readline().strip()
-                        sline = line.split()
-                        isp_, ik_, ib_ = map(int, sline[1:4])
-                        assert isp_ == ispin + 1 and ik_ == ik + 1 and ib_ == ib + 1, "Inconsistency in reading LOCPROJ"
-                        self.eigs[ik, ib, ispin] = float(sline[4])
-                        self.ferw[ik, ib, ispin] = float(sline[5])
-                        for ip in xrange(nproj):
-                            line = f.readline()
-                            sline = line.split()
-                            ctmp = complex(float(sline[1]), float(sline[2]))
-                            plo[ip, ispin, ik, ib] = ctmp
 
+# Columns of the real and imaginary parts of the selected projectors
+            nrec_tot = self.nspin * nk * self.nband
+            rec_len = 5 + 3 * nproj
+            cols = np.column_stack((5 + 3 * proj_inds + 1, 5 + 3 * proj_inds + 2)).flatten()
+            irec = 0
+            rest = ''
+            while True:
+                chunk = f.read(int(chunk_size * 1024**2))
+# Only complete records (up to the last 'orbital' keyword) are parsed
+                if chunk:
+                    buf = rest + chunk
+                    ilast = buf.rfind('orbital')
+                    if ilast <= 0:
+                        rest = buf
+                        continue
+                    buf, rest = buf[:ilast], buf[ilast:]
+                else:
+                    buf, rest = rest, ''
+                data = np.fromstring(buf.replace('orbital', ' '), sep=' ')
+                if data.size > 0:
+                    assert data.size % rec_len == 0, "Inconsistency in reading LOCPROJ"
+                    data = data.reshape(-1, rec_len)
+                    nrec = data.shape[0]
+                    assert irec + nrec <= nrec_tot, "Inconsistency in reading LOCPROJ"
+
+# Records are ordered by spin, k-point and band
+                    ispin, ik, ib = np.unravel_index(np.arange(irec, irec + nrec), (self.nspin, nk, self.nband))
+                    inds = data[:, :3].astype(int) - 1
+                    assert (np.all(inds[:, 0] == ispin) and np.all(inds[:, 1] == ik) and
+                            np.all(inds[:, 2] == ib)), "Inconsistency in reading LOCPROJ"
+                    self.eigs[ik, ib, ispin] = data[:, 3]
+                    self.ferw[ik, ib, ispin] = data[:, 4]
+                    plo[:, ispin, ik, ib] = np.ascontiguousarray(data[:, cols]).view(np.complex128).T
+                    irec += nrec
+                if not chunk:
+                    break
+
+            assert irec == nrec_tot, "Inconsistency in reading LOCPROJ"
+            nbytes = f.tell()
+
+        t_read = max(time.time() - t_start, 1e-10)
+        print "Read LOCPROJ: %.1f MB in %.2f s (%.1f MB/s)"%(nbytes / 1024.0**2, t_read, nbytes / 1024.0**2 / t_read)
         print "Read parameters:"
         for il, par in enumerate(proj_params):
             print il, " -> ", par
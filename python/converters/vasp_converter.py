@@ -34,6 +34,42 @@ try:
 except ImportError:
     import json
 
+def dft_input_from_plo(gr_head, data, n_spin_blocs):
+    """
+    Converts the arrays of a PLO group generated by plovasp (see
+    plotools.plo_arrays()) to the DftTools format.
+
+    Returns a dictionary with 'n_orbitals', 'hopping', 'proj_mat' and
+    'density_required' of the DFT input, as well as 'dft_fermi_weights'
+    and 'band_window' of the miscellaneous input.
+    """
+    p_shells = gr_head['shells']
+    nb_max = gr_head['nb_max']
+    ib_win = data['ib_win'][:n_spin_blocs]
+    n_k = ib_win.shape[1]
+
+    band_window = [ib_win[isp].copy() for isp in xrange(n_spin_blocs)]
+    n_orbitals = (ib_win[:, :, 1] - ib_win[:, :, 0] + 1).T.copy()
+    hopping = numpy.zeros([n_k, n_spin_blocs, nb_max, nb_max], numpy.complex_)
+    ib = numpy.arange(nb_max)
+    hopping[:, :, ib, ib] = data['eigvals'][:n_spin_blocs].transpose((1, 0, 2))
+    f_weights = data['ferw'][:n_spin_blocs].transpose((1, 0, 2)).astype(numpy.complex_)
+
+# Each site of a projected shell gives a separate correlated shell (see VaspConverter.convert_dft_input())
+# Projectors are stored as [ion, isp, ik, ilm, ib], bands beyond the window are zero
+    n_corr_shells = sum([len(sh['ion_list']) for sh in p_shells])
+    nb = numpy.max(n_orbitals)
+    proj_mat = numpy.zeros([n_k, n_spin_blocs, n_corr_shells, max([sh['ndim'] for sh in p_shells]), nb], numpy.complex_)
+    for sh in p_shells:
+        proj = data['proj_%i'%(sh['shell_index'])]
+        for icsh in xrange(len(sh['ion_list'])):
+            proj_mat[:, :, icsh, :sh['ndim'], :] = proj[icsh, :n_spin_blocs, :, :, :nb].transpose((1, 0, 2, 3))
+
+    return {'n_orbitals': n_orbitals, 'hopping': hopping, 'proj_mat': proj_mat,
+            'density_required': gr_head['nelect'],
+            'dft_fermi_weights': f_weights, 'band_window': band_window}
+
+
 class VaspConverter(ConverterTools):
     """
     Conversion from VASP output to an hdf5 file that can be used as input for the SumkDFT class.
@@ -95,6 +131,14 @@ class VaspConverter(ConverterTools):
 
         return header, f_gen
 
+    def load_data_file(self, filename, head):
+        """
+        Loads the binary data file (.npz) given in the JSON-header of a file written by plovasp.
+        """
+        data_file = os.path.join(os.path.dirname(filename), head['data_file'])
+        data = numpy.load(data_file)
+        return dict((key, data[key]) for key in data.files)
+
     def convert_dft_input(self):
         """
         Reads the input files, and stores the data in the HDFfile
@@ -122,13 +166,19 @@ class VaspConverter(ConverterTools):
 
         kpts = numpy.zeros((n_k, 3))
         bz_weights = numpy.zeros(n_k)
-        try:
-            for ik in xrange(n_k):
-                kx, ky, kz = rf.next(), rf.next(), rf.next()
-                kpts[ik, :] = kx, ky, kz
-                bz_weights[ik] = rf.next()
-        except StopIteration:
-            raise "VaspConverter: error reading %s"%self.ctrl_file
+        if 'data_file' in ctrl_head:
+# Binary output of plovasp: the data are stored in a .npz file
+            data = self.load_data_file(self.ctrl_file, ctrl_head)
+            kpts[:, :] = data['kpoints']
+            bz_weights[:] = data['kweights']
+        else:
+            try:
+                for ik in xrange(n_k):
+                    kx, ky, kz = rf.next(), rf.next(), rf.next()
+                    kpts[ik, :] = kx, ky, kz
+                    bz_weights[ik] = rf.next()
+            except StopIteration:
+                raise "VaspConverter: error reading %s"%self.ctrl_file
 
 #        if nc_flag:
 ## TODO: check this
@@ -213,25 +263,35 @@ class VaspConverter(ConverterTools):
 ## TODO: implement the noncollinear part
 #                raise NotImplementedError("Noncollinear calculations are not implemented")
 #            else:
-            hopping = numpy.zeros([n_k, n_spin_blocs, nb_max, nb_max], numpy.complex_)
-            f_weights = numpy.zeros([n_k, n_spin_blocs, nb_max], numpy.complex_)
-            band_window = [numpy.zeros((n_k, 2), dtype=int) for isp in xrange(n_spin_blocs)]
-            n_orbitals = numpy.zeros([n_k, n_spin_blocs], numpy.int)
+            if 'data_file' in gr_head:
+# Binary output of plovasp: the data are stored in a .npz file
+                data = self.load_data_file(gr_file, gr_head)
+                plo_input = dft_input_from_plo(gr_head, data, n_spin_blocs)
+                hopping = plo_input['hopping']
+                f_weights = plo_input['dft_fermi_weights']
+                band_window = plo_input['band_window']
+                n_orbitals = plo_input['n_orbitals']
+                proj_mat = plo_input['proj_mat']
+            else:
+                hopping = numpy.zeros([n_k, n_spin_blocs, nb_max, nb_max], numpy.complex_)
+                f_weights = numpy.zeros([n_k, n_spin_blocs, nb_max], numpy.complex_)
+                band_window = [numpy.zeros((n_k, 2), dtype=int) for isp in xrange(n_spin_blocs)]
+                n_orbitals = numpy.zeros([n_k, n_spin_blocs], numpy.int)
 
-            for isp in xrange(n_spin_blocs):
-                for ik in xrange(n_k):
-                    ib1, ib2 = int(rf.next()), int(rf.next())
-                    band_window[isp][ik, :2] = ib1, ib2
-                    nb = ib2 - ib1 + 1
-                    n_orbitals[ik, isp] = nb
-                    for ib in xrange(nb):
-                        hopping[ik, isp, ib, ib] = rf.next()
-                        f_weights[ik, isp, ib] = rf.next()
+                for isp in xrange(n_spin_blocs):
+                    for ik in xrange(n_k):
+                        ib1, ib2 = int(rf.next()), int(rf.next())
+                        band_window[isp][ik, :2] = ib1, ib2
+                        nb = ib2 - ib1 + 1
+                        n_orbitals[ik, isp] = nb
+                        for ib in xrange(nb):
+                            hopping[ik, isp, ib, ib] = rf.next()
+                            f_weights[ik, isp, ib] = rf.next()
 
 # Projectors
-#            print n_orbitals
-#            print [crsh['dim'] for crsh in corr_shells]
-            proj_mat = numpy.zeros([n_k, n_spin_blocs, n_corr_shells, max([crsh['dim'] for crsh in corr_shells]), numpy.max(n_orbitals)], numpy.complex_)
+#                print n_orbitals
+#                print [crsh['dim'] for crsh in corr_shells]
+                proj_mat = numpy.zeros([n_k, n_spin_blocs, n_corr_shells, max([crsh['dim'] for crsh in corr_shells]), numpy.max(n_orbitals)], numpy.complex_)
 
 # TODO: implement reading from more than one projector group
 # In 'dmftproj' each ion represents a separate correlated shell.
@@ -246,17 +306,17 @@ class VaspConverter(ConverterTools):
 # At the moment I choose i.2 for its simplicity. But one should consider possible
 # use cases and decide which solution is to be made permanent.
 #
-            for ish, sh in enumerate(p_shells):
-                for isp in xrange(n_spin_blocs):
-                    for ik in xrange(n_k):
-                        for ion in xrange(len(sh['ion_list'])):
-                            icsh = shion_to_corr_shell[ish][ion]
-                            for ilm in xrange(sh['ndim']):
-                                for ib in xrange(n_orbitals[ik, isp]):
-                                    # This is to avoid confusion with the order of arguments
-                                    pr = rf.next()
-                                    pi = rf.next()
-                                    proj_mat[ik, isp, icsh, ilm, ib] = complex(pr, pi)
+                for ish, sh in enumerate(p_shells):
+                    for isp in xrange(n_spin_blocs):
+                        for ik in xrange(n_k):
+                            for ion in xrange(len(sh['ion_list'])):
+                                icsh = shion_to_corr_shell[ish][ion]
+                                for ilm in xrange(sh['ndim']):
+                                    for ib in xrange(n_orbitals[ik, isp]):
+                                        # This is to avoid confusion with the order of arguments
+                                        pr = rf.next()
+                                        pi = rf.next()
+                                        proj_mat[ik, isp, icsh, ilm, ib] = complex(pr, pi)
 
             things_to_set = ['n_shells','shells','n_corr_shells','corr_shells','n_spin_blocs','n_orbitals','n_k','SO','SP','energy_unit'] 
             for it in things_to_set:
@@ -37,8 +37,7 @@
 #   rot_mat_time_inv also if symm_op = 0?)
 # - the calculation of rot_mat in find_rot_mat() relies on the eigenvalues of H(0);
 #   this might fail in presence of degenerate eigenvalues (now just prints warning)
-# - the FFT is always done in serial mode (because all converters run serially);
-#   this can become very slow with a large number of R-vectors/k-points
+# - the FFT is always done in serial mode (because all converters run serially)
 # - make the code more MPI safe (error handling): if we run with more than one process
 #   and an error occurs on the masternode, the calculation does not abort
 ###
@@ -46,7 +45,6 @@
 
 from types import *
 import numpy
-import math
 from pytriqs.archive import *
 from converter_tools import *
 from itertools import product
@@ -321,12 +319,9 @@ class Wannier90Converter(ConverterTools):
         for isp in range(n_spin):
             # make Fourier transform H(R) -> H(k) : it can be done one spin at
             # a time
-            hamk = self.fourier_ham(self.nwfs, hamr_full[isp])
-            # copy the H(k) in the right place of hoppings... is there a better
-            # way to do this??
-            for ik in range(self.n_k):
-                #hopping[ik,isp,:,:] = deepcopy(hamk[ik][:,:])*energy_unit
-                hopping[ik, isp, :, :] = hamk[ik][:, :] * energy_unit
+            # (the k-point mesh is always the full mesh built by kmesh_build)
+            hamk = self.fourier_ham(self.nwfs, hamr_full[isp], nki)
+            hopping[:, isp, :, :] = hamk * energy_unit
 
         # Then, initialise the projectors
         k_dep_projection = 0   # we always have the same number of WFs at each k-point
@@ -580,17 +575,24 @@ class Wannier90Converter(ConverterTools):
 
         return nkpt, kmesh, wk
 
-    def fourier_ham(self, norb, h_of_r):
+    def fourier_ham(self, norb, h_of_r, nki=None):
         """
         Method for obtaining H(k) from H(R) via Fourier transform
         The R vectors and k-point mesh are read from global module variables
 
+        H(k) is obtained as the matrix product of the phase factors exp(2 pi i k.R) [n_k, nrpt]
+        with H(R)/deg(R) stacked as [nrpt, norb*norb], in chunks of k-points to bound memory.
+        If the dimensions of the mesh are given, the k-points are assumed to be the regular mesh
+        containing k=0,0,0 built by kmesh_build and a fast Fourier transform is used instead.
+
         Parameters
         ----------
         norb : integer
             number of orbitals
         h_of_r : list of numpy.array[norb,norb]
             Hamiltonian H(R) in Wannier basis
+        nki : list of 3 integers, optional
+            the dimensions of the k-point mesh, if it was built by kmesh_build
 
         Returns
         -------
@@ -600,13 +602,23 @@ class Wannier90Converter(ConverterTools):
         """
 
         twopi = 2 * numpy.pi
-        h_of_k = [numpy.zeros((norb, norb), dtype=numpy.complex_)
-                  for ik in range(self.n_k)]
-        ridx = numpy.array(range(self.nrpt))
-        for ik, ir in product(range(self.n_k), ridx):
-            rdotk = twopi * numpy.dot(self.k_mesh[ik], self.rvec[ir])
-            factor = (math.cos(rdotk) + 1j * math.sin(rdotk)) / \
-                float(self.rdeg[ir])
-            h_of_k[ik][:, :] += factor * h_of_r[ir][:, :]
-
-        return h_of_k
+        h_r = numpy.array(h_of_r, dtype=numpy.complex_).reshape(self.nrpt, norb * norb)
+        h_r /= numpy.asarray(self.rdeg, dtype=float)[:, numpy.newaxis]
+
+        if nki is not None:
+            # exp(2 pi i k.R) only depends on R modulo the mesh dimensions
+            h_fold = numpy.zeros(tuple(nki) + (norb * norb,), dtype=numpy.complex_)
+            rfold = numpy.mod(self.rvec, nki)
+            numpy.add.at(h_fold, (rfold[:, 0], rfold[:, 1], rfold[:, 2]), h_r)
+            h_of_k = numpy.fft.ifftn(h_fold, axes=(0, 1, 2)) * (nki[0] * nki[1] * nki[2])
+            return list(h_of_k.reshape(self.n_k, norb, norb))
+
+        h_of_k = numpy.zeros((self.n_k, norb * norb), dtype=numpy.complex_)
+        # phase factors of at most ~64 MB at a time
+        k_chunk = max(1, 2**22 / self.nrpt)
+        for ik1 in range(0, self.n_k, k_chunk):
+            ik2 = min(ik1 + k_chunk, self.n_k)
+            rdotk = twopi * numpy.dot(self.k_mesh[ik1:ik2], numpy.transpose(self.rvec))
+            h_of_k[ik1:ik2, :] = numpy.dot(numpy.exp(1j * rdotk), h_r)
+
+        return list(h_of_k.reshape(self.n_k, norb, norb))
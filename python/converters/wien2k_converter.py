@@ -109,8 +109,8 @@ class Wien2kConverter(ConverterTools):
             return
         mpi.report("Reading input from %s..." % self.dft_file)
 
-        # R is a generator : each R.Next() will return the next number in the
-        # file
+        # R holds all numbers of the file: each R.next() returns the next number,
+        # R.read(shape) the next block of numbers as array
         R = ConverterTools.read_fortran_file(
             self, self.dft_file, self.fortran_to_replace)
         try:
@@ -159,13 +159,9 @@ class Wien2kConverter(ConverterTools):
             rot_mat_time_inv = [0 for i in range(n_corr_shells)]
 
             for icrsh in range(n_corr_shells):
-                for i in range(corr_shells[icrsh]['dim']):    # read real part:
-                    for j in range(corr_shells[icrsh]['dim']):
-                        rot_mat[icrsh][i, j] = R.next()
-                # read imaginary part:
-                for i in range(corr_shells[icrsh]['dim']):
-                    for j in range(corr_shells[icrsh]['dim']):
-                        rot_mat[icrsh][i, j] += 1j * R.next()
+                dim = corr_shells[icrsh]['dim']
+                rot_mat[icrsh][:, :] = R.read((dim, dim))          # read real part
+                rot_mat[icrsh][:, :] += 1j * R.read((dim, dim))    # read imaginary part
 
                 if (SP == 1):             # read time inversion flag:
                     rot_mat_time_inv[icrsh] = int(R.next())
@@ -187,12 +183,8 @@ class Wien2kConverter(ConverterTools):
                 T.append(numpy.zeros([lmax, lmax], numpy.complex_))
 
                 # now read it from file:
-                for i in range(lmax):
-                    for j in range(lmax):
-                        T[ish][i, j] = R.next()
-                for i in range(lmax):
-                    for j in range(lmax):
-                        T[ish][i, j] += 1j * R.next()
+                T[ish][:, :] = R.read((lmax, lmax))
+                T[ish][:, :] += 1j * R.read((lmax, lmax))
 
             # Spin blocks to be read:
             n_spin_blocs = SP + 1 - SO
@@ -200,8 +192,7 @@ class Wien2kConverter(ConverterTools):
             # read the list of n_orbitals for all k points
             n_orbitals = numpy.zeros([n_k, n_spin_blocs], numpy.int)
             for isp in range(n_spin_blocs):
-                for ik in range(n_k):
-                    n_orbitals[ik, isp] = int(R.next())
+                n_orbitals[:, isp] = R.read(n_k)
 
             # Initialise the projectors:
             proj_mat = numpy.zeros([n_k, n_spin_blocs, n_corr_shells, max(
@@ -214,14 +205,12 @@ class Wien2kConverter(ConverterTools):
                     # first Real part for BOTH spins, due to conventions in
                     # dmftproj:
                     for isp in range(n_spin_blocs):
-                        for i in range(n_orb):
-                            for j in range(n_orbitals[ik][isp]):
-                                proj_mat[ik, isp, icrsh, i, j] = R.next()
+                        n_bands = n_orbitals[ik, isp]
+                        proj_mat[ik, isp, icrsh, :n_orb, :n_bands] = R.read((n_orb, n_bands))
                     # now Imag part:
                     for isp in range(n_spin_blocs):
-                        for i in range(n_orb):
-                            for j in range(n_orbitals[ik][isp]):
-                                proj_mat[ik, isp, icrsh, i, j] += 1j * R.next()
+                        n_bands = n_orbitals[ik, isp]
+                        proj_mat[ik, isp, icrsh, :n_orb, :n_bands] += 1j * R.read((n_orb, n_bands))
 
             # now define the arrays for weights and hopping ...
             # w(k_index),  default normalisation
@@ -230,8 +219,7 @@ class Wien2kConverter(ConverterTools):
                 n_orbitals), numpy.max(n_orbitals)], numpy.complex_)
 
             # weights in the file
-            for ik in range(n_k):
-                bz_weights[ik] = R.next()
+            bz_weights[:] = R.read(n_k)
 
             # if the sum over spins is in the weights, take it out again!!
             sm = sum(bz_weights)
@@ -242,9 +230,8 @@ class Wien2kConverter(ConverterTools):
             # for Wien2K.
             for isp in range(n_spin_blocs):
                 for ik in range(n_k):
-                    n_orb = n_orbitals[ik, isp]
-                    for i in range(n_orb):
-                        hopping[ik, isp, i, i] = R.next() * energy_unit
+                    diag = numpy.arange(n_orbitals[ik, isp])
+                    hopping[ik, isp, diag, diag] = R.read(len(diag)) * energy_unit
 
             # keep some things that we need for reading parproj:
             things_to_set = ['n_shells', 'shells', 'n_corr_shells', 'corr_shells',
@@ -322,44 +309,34 @@ class Wien2kConverter(ConverterTools):
         rot_mat_all_time_inv = [0 for i in range(self.n_shells)]
 
         for ish in range(self.n_shells):
+            dim = self.shells[ish]['dim']
             # read first the projectors for this orbital:
             for ik in range(self.n_k):
                 for ir in range(n_parproj[ish]):
 
                     for isp in range(self.n_spin_blocs):
                         # read real part:
-                        for i in range(self.shells[ish]['dim']):
-                            for j in range(self.n_orbitals[ik][isp]):
-                                proj_mat_all[ik, isp, ish, ir, i, j] = R.next()
+                        n_bands = self.n_orbitals[ik][isp]
+                        proj_mat_all[ik, isp, ish, ir, :dim, :n_bands] = R.read((dim, n_bands))
 
                     for isp in range(self.n_spin_blocs):
                         # read imaginary part:
-                        for i in range(self.shells[ish]['dim']):
-                            for j in range(self.n_orbitals[ik][isp]):
-                                proj_mat_all[ik, isp, ish,
-                                             ir, i, j] += 1j * R.next()
+                        n_bands = self.n_orbitals[ik][isp]
+                        proj_mat_all[ik, isp, ish, ir, :dim, :n_bands] += 1j * R.read((dim, n_bands))
 
             # now read the Density Matrix for this orbital below the energy
             # window:
-            for isp in range(self.n_spin_blocs):
-                for i in range(self.shells[ish]['dim']):    # read real part:
-                    for j in range(self.shells[ish]['dim']):
-                        dens_mat_below[isp][ish][i, j] = R.next()
+            for isp in range(self.n_spin_blocs):    # read real part:
+                dens_mat_below[isp][ish][:, :] = R.read((dim, dim))
             for isp in range(self.n_spin_blocs):
                 # read imaginary part:
-                for i in range(self.shells[ish]['dim']):
-                    for j in range(self.shells[ish]['dim']):
-                        dens_mat_below[isp][ish][i, j] += 1j * R.next()
+                dens_mat_below[isp][ish][:, :] += 1j * R.read((dim, dim))
                 if (self.SP == 0):
                     dens_mat_below[isp][ish] /= 2.0
 
             # Global -> local rotation matrix for this shell:
-            for i in range(self.shells[ish]['dim']):    # read real part:
-                for j in range(self.shells[ish]['dim']):
-                    rot_mat_all[ish][i, j] = R.next()
-            for i in range(self.shells[ish]['dim']):    # read imaginary part:
-                for j in range(self.shells[ish]['dim']):
-                    rot_mat_all[ish][i, j] += 1j * R.next()
+            rot_mat_all[ish][:, :] = R.read((dim, dim))          # read real part
+            rot_mat_all[ish][:, :] += 1j * R.read((dim, dim))    # read imaginary part
 
             if (self.SP):
                 rot_mat_all_time_inv[ish] = int(R.next())
@@ -413,8 +390,7 @@ class Wien2kConverter(ConverterTools):
             # read the list of n_orbitals for all k points
             n_orbitals = numpy.zeros([n_k, self.n_spin_blocs], numpy.int)
             for isp in range(self.n_spin_blocs):
-                for ik in range(n_k):
-                    n_orbitals[ik, isp] = int(R.next())
+                n_orbitals[:, isp] = R.read(n_k)
 
             # Initialise the projectors:
             proj_mat = numpy.zeros([n_k, self.n_spin_blocs, self.n_corr_shells, max(
@@ -427,14 +403,12 @@ class Wien2kConverter(ConverterTools):
                     # first Real part for BOTH spins, due to conventions in
                     # dmftproj:
                     for isp in range(self.n_spin_blocs):
-                        for i in range(n_orb):
-                            for j in range(n_orbitals[ik, isp]):
-                                proj_mat[ik, isp, icrsh, i, j] = R.next()
+                        n_bands = n_orbitals[ik, isp]
+                        proj_mat[ik, isp, icrsh, :n_orb, :n_bands] = R.read((n_orb, n_bands))
                     # now Imag part:
                     for isp in range(self.n_spin_blocs):
-                        for i in range(n_orb):
-                            for j in range(n_orbitals[ik, isp]):
-                                proj_mat[ik, isp, icrsh, i, j] += 1j * R.next()
+                        n_bands = n_orbitals[ik, isp]
+                        proj_mat[ik, isp, icrsh, :n_orb, :n_bands] += 1j * R.read((n_orb, n_bands))
 
             hopping = numpy.zeros([n_k, self.n_spin_blocs, numpy.max(
                 n_orbitals), numpy.max(n_orbitals)], numpy.complex_)
@@ -443,9 +417,8 @@ class Wien2kConverter(ConverterTools):
             # we use now the convention of a DIAGONAL Hamiltonian!!!!
             for isp in range(self.n_spin_blocs):
                 for ik in range(n_k):
-                    n_orb = n_orbitals[ik, isp]
-                    for i in range(n_orb):
-                        hopping[ik, isp, i, i] = R.next() * self.energy_unit
+                    diag = numpy.arange(n_orbitals[ik, isp])
+                    hopping[ik, isp, diag, diag] = R.read(len(diag)) * self.energy_unit
 
             # now read the partial projectors:
             n_parproj = [int(R.next()) for i in range(self.n_shells)]
@@ -456,21 +429,17 @@ class Wien2kConverter(ConverterTools):
                 [sh['dim'] for sh in self.shells]), numpy.max(n_orbitals)], numpy.complex_)
 
             for ish in range(self.n_shells):
+                dim = self.shells[ish]['dim']
                 for ik in range(n_k):
                     for ir in range(n_parproj[ish]):
                         for isp in range(self.n_spin_blocs):
+                            n_bands = n_orbitals[ik, isp]
 
                             # read real part:
-                            for i in range(self.shells[ish]['dim']):
-                                for j in range(n_orbitals[ik, isp]):
-                                    proj_mat_all[ik, isp, ish,
-                                                 ir, i, j] = R.next()
+                            proj_mat_all[ik, isp, ish, ir, :dim, :n_bands] = R.read((dim, n_bands))
 
                             # read imaginary part:
-                            for i in range(self.shells[ish]['dim']):
-                                for j in range(n_orbitals[ik, isp]):
-                                    proj_mat_all[ik, isp, ish,
-                                                 ir, i, j] += 1j * R.next()
+                            proj_mat_all[ik, isp, ish, ir, :dim, :n_bands] += 1j * R.read((dim, n_bands))
 
             R.close()
 
@@ -546,11 +515,9 @@ class Wien2kConverter(ConverterTools):
                     R.next()) == SO, "convert_misc_input: SO is inconsistent in oubwin file!"
 
                 band_window[isp] = numpy.zeros((n_k_oubwin, 2), dtype=int)
-                for ik in xrange(n_k_oubwin):
-                    R.next()
-                    band_window[isp][ik, 0] = R.next()  # lowest band
-                    band_window[isp][ik, 1] = R.next()  # highest band
-                    R.next()
+                # each line holds the k index, the lowest and the highest band
+                # and the number of bands
+                band_window[isp][:, :] = R.read((n_k_oubwin, 4))[:, 1:3]
                 things_to_save.append('band_window')
 
                 R.close()  # Reading done!
@@ -646,7 +613,9 @@ class Wien2kConverter(ConverterTools):
         # band_window_optics: Contains the index of the lowest and highest band within the
         #                     band window (used by optics) for each k-point.
         # velocities_k: velocity (momentum) matrix elements between all bands in band_window_optics
-        #               and each k-point.
+        #               and each k-point, velocities_k[isp, ik, :n_bands, :n_bands, :] for
+        #               n_bands = band_window_optics[isp][ik, 1] - band_window_optics[isp][ik, 0] + 1.
+        #               The remaining elements are zero.
 
         if (SP == 0 or SO == 1):
             files = [self.pmat_file]
@@ -655,7 +624,7 @@ class Wien2kConverter(ConverterTools):
         else:  # SO and SP can't both be 1
             assert 0, "convert_transport_input: Reading velocity file error! Check SP and SO!"
 
-        velocities_k = [[] for f in files]
+        velocities = [[] for f in files]
         band_window_optics = []
         for isp, f in enumerate(files):
             if not os.path.exists(f):
@@ -673,23 +642,24 @@ class Wien2kConverter(ConverterTools):
                 n_bands = nu2 - nu1 + 1
                 for _ in range(4):
                     R.next()
-                if n_bands <= 0:
-                    velocity_xyz = numpy.zeros((1, 1, 3), dtype=complex)
-                else:
-                    velocity_xyz = numpy.zeros(
-                        (n_bands, n_bands, 3), dtype=complex)
-                    for nu_i in range(n_bands):
-                        for nu_j in range(nu_i, n_bands):
-                            for i in range(3):
-                                velocity_xyz[nu_i][nu_j][
-                                    i] = R.next() + R.next() * 1j
-                                if (nu_i != nu_j):
-                                    velocity_xyz[nu_j][nu_i][i] = velocity_xyz[
-                                        nu_i][nu_j][i].conjugate()
-                velocities_k[isp].append(velocity_xyz)
+                # (real, imag) pairs of the upper triangle nu_i <= nu_j, row by row
+                v = R.read((n_bands * (n_bands + 1) / 2, 3, 2)) if n_bands > 0 else numpy.zeros((0, 3, 2))
+                velocities[isp].append(v[:, :, 0] + 1j * v[:, :, 1])
             band_window_optics.append(numpy.array(band_window_optics_isp))
             R.close()  # Reading done!
 
+        # Store the velocities of all k-points in one array, padded to the largest band window
+        n_bands_max = max([1] + [nu2 - nu1 + 1 for bwo in band_window_optics for nu1, nu2 in bwo])
+        velocities_k = numpy.zeros((len(files), n_k, n_bands_max, n_bands_max, 3), dtype=complex)
+        for isp in range(len(files)):
+            for ik in xrange(n_k):
+                n_bands = band_window_optics[isp][ik, 1] - band_window_optics[isp][ik, 0] + 1
+                if n_bands <= 0:
+                    continue
+                nu_i, nu_j = numpy.triu_indices(n_bands)
+                velocities_k[isp, ik, nu_j, nu_i, :] = velocities[isp][ik].conjugate()
+                velocities_k[isp, ik, nu_i, nu_j, :] = velocities[isp][ik]
+
         # Put data to HDF5 file
         ar = HDFArchive(self.hdf_file, 'a')
         if not (self.transp_subgrp in ar):
@@ -749,14 +719,9 @@ class Wien2kConverter(ConverterTools):
                 mat.append([numpy.zeros([orbits[orb]['dim'], orbits[orb][
                            'dim']], numpy.complex_) for orb in range(n_orbits)])
                 for orb in range(n_orbits):
-                    for i in range(orbits[orb]['dim']):
-                        for j in range(orbits[orb]['dim']):
-                            # real part
-                            mat[i_symm][orb][i, j] = R.next()
-                    for i in range(orbits[orb]['dim']):
-                        for j in range(orbits[orb]['dim']):
-                            mat[i_symm][orb][i, j] += 1j * \
-                                R.next()      # imaginary part
+                    dim = orbits[orb]['dim']
+                    mat[i_symm][orb][:, :] = R.read((dim, dim))          # real part
+                    mat[i_symm][orb][:, :] += 1j * R.read((dim, dim))    # imaginary part
 
             mat_tinv = [numpy.identity(orbits[orb]['dim'], numpy.complex_)
                         for orb in range(n_orbits)]
@@ -765,14 +730,9 @@ class Wien2kConverter(ConverterTools):
                 # here we need an additional time inversion operation, so read
                 # it:
                 for orb in range(n_orbits):
-                    for i in range(orbits[orb]['dim']):
-                        for j in range(orbits[orb]['dim']):
-                            # real part
-                            mat_tinv[orb][i, j] = R.next()
-                    for i in range(orbits[orb]['dim']):
-                        for j in range(orbits[orb]['dim']):
-                            mat_tinv[orb][i, j] += 1j * \
-                                R.next()      # imaginary part
+                    dim = orbits[orb]['dim']
+                    mat_tinv[orb][:, :] = R.read((dim, dim))          # real part
+                    mat_tinv[orb][:, :] += 1j * R.read((dim, dim))    # imaginary part
 
         except StopIteration:  # a more explicit error if the file is corrupted.
             raise IOError, "Wien2k_converter : reading file %s failed!" %symm_file
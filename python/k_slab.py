@@ -0,0 +1,129 @@
+
+##########################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+##########################################################################
+
+import numpy
+
+
+class KSlab(object):
+    r"""
+    Part of a k-dependent array (k index first) for a contiguous range of k-points.
+
+    It is indexed with the global k index, like the full array, e.g. ``slab[ik, isp, :n, :n]``,
+    but only holds the k-points k_start <= ik < k_stop. This is used by SumkDFT to keep only
+    the k-points of the own MPI process of the hopping and projector matrices in memory.
+
+    Parameters
+    ----------
+    data : numpy array or numpy memmap
+           Array of the k-points k_start, ..., k_stop-1.
+    k_start : integer
+              Global index of the first k-point in data.
+    n_k : integer
+          Total number of k-points.
+    """
+
+    def __init__(self, data, k_start, n_k):
+
+        self.data = data
+        self.k_start = k_start
+        self.k_stop = k_start + data.shape[0]
+        self.n_k = n_k
+
+    @property
+    def k_range(self):
+        """Global indices of the k-points held."""
+        return range(self.k_start, self.k_stop)
+
+    @property
+    def shape(self):
+        return (self.n_k,) + self.data.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def _local(self, ik):
+        if not isinstance(ik, (int, long, numpy.integer)):
+            raise IndexError, "KSlab: only single k-points can be accessed."
+        if not self.k_start <= ik < self.k_stop:
+            raise IndexError, "KSlab: k-point %s is not held by this process (k-points %s to %s)." % (
+                ik, self.k_start, self.k_stop - 1)
+        return ik - self.k_start
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.data[(self._local(key[0]),) + key[1:]]
+        return self.data[self._local(key)]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, tuple):
+            self.data[(self._local(key[0]),) + key[1:]] = value
+        else:
+            self.data[self._local(key)] = value
+
+    @classmethod
+    def from_hdf(cls, filename, path, k_start, k_stop, mmap=False):
+        r"""
+        Reads the k-points k_start, ..., k_stop-1 of an array stored by HDFArchive.
+
+        Only the hyperslab of these k-points is read from the file. With mmap=True, a contiguous
+        dataset is not read at all, but mapped into memory, so that its pages are only read when
+        they are accessed. Chunked or compressed datasets are always read.
+
+        Parameters
+        ----------
+        filename : string
+                   Name of the hdf5 file.
+        path : string
+               Path of the dataset in the hdf5 file, e.g. 'dft_input/hopping'.
+        k_start, k_stop : integer
+                          Range of k-points to read.
+        mmap : boolean, optional
+               Memory-map the dataset if possible.
+
+        Returns
+        -------
+        slab : KSlab
+        """
+        import h5py
+
+        f = h5py.File(filename, 'r')
+        try:
+            dset = f[path]
+            # HDFArchive stores complex arrays as real arrays with a last dimension of size 2
+            is_complex = '__complex__' in dset.attrs
+            shape = dset.shape[:-1] if is_complex else dset.shape
+            n_k = shape[0]
+            offset = dset.id.get_offset() if mmap else None
+            if offset is not None:
+                dtype = numpy.dtype(numpy.complex_ if is_complex else dset.dtype).newbyteorder(
+                    dset.dtype.byteorder)
+                row_size = dtype.itemsize * int(numpy.prod(shape[1:]))
+                data = numpy.memmap(filename, dtype=dtype, mode='r', offset=offset + k_start * row_size,
+                                    shape=(k_stop - k_start,) + shape[1:])
+            else:
+                data = dset[k_start:k_stop]
+                if is_complex:
+                    data = numpy.ascontiguousarray(data).view(numpy.complex_)[..., 0]
+        finally:
+            f.close()
+        return cls(data, k_start, n_k)
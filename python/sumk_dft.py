@@ -21,6 +21,10 @@
 ##########################################################################
 
 from types import *
+import os
+import glob
+import hashlib
+import time
 import numpy
 import pytriqs.utility.dichotomy as dichotomy
 from pytriqs.gf import *
@@ -29,11 +33,77 @@ from pytriqs.utility.comparison_tests import assert_arrays_are_close
 from pytriqs.archive import *
 from symmetry import *
 from block_structure import BlockStructure
+from upfold_cache import UpfoldCache
+from k_slab import KSlab
 from sets import Set
 from itertools import product
+from multiprocessing.pool import ThreadPool
 from warnings import warn
 from scipy import compress
-from scipy.optimize import minimize
+from scipy.optimize import minimize, brentq
+from scipy.special import polygamma
+
+
+def add_k_sums(a, b):
+    """Adds two (possibly nested) partial k sums, treating None as zero."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if isinstance(a, dict):
+        return {key: add_k_sums(a[key], b[key]) for key in a}
+    if isinstance(a, (list, tuple)):
+        return type(a)(add_k_sums(x, y) for x, y in zip(a, b))
+    return a + b
+
+
+def pack_k_sum(obj):
+    """
+    Packs all numbers and numpy arrays of a (possibly nested) k sum into one contiguous buffer,
+    which is complex if any of them is complex. Returns None if there are none.
+    """
+    leaves = []
+
+    def pack(o):
+        if isinstance(o, dict):
+            for key in sorted(o):
+                pack(o[key])
+        elif isinstance(o, (list, tuple)):
+            for x in o:
+                pack(x)
+        elif o is not None:
+            leaves.append(numpy.asarray(o))
+
+    pack(obj)
+    if not leaves:
+        return None
+    is_complex = any(numpy.iscomplexobj(leaf) for leaf in leaves)
+    return numpy.concatenate([leaf.ravel() for leaf in leaves]).astype(
+        numpy.complex_ if is_complex else numpy.float_)
+
+
+def unpack_k_sum(obj, buf):
+    """Returns the values of buf (see pack_k_sum) in the structure of obj."""
+    offset = [0]
+
+    def unpack(o):
+        if isinstance(o, dict):
+            return dict((key, unpack(o[key])) for key in sorted(o))
+        elif isinstance(o, (list, tuple)):
+            return type(o)(unpack(x) for x in o)
+        elif o is None:
+            return None
+        leaf = numpy.asarray(o)
+        value = buf[offset[0]:offset[0] + leaf.size].reshape(leaf.shape)
+        offset[0] += leaf.size
+        if not numpy.iscomplexobj(leaf):
+            value = value.real
+        value = value.astype(leaf.dtype)
+        if not isinstance(o, numpy.ndarray):
+            return value.item()
+        return value
+
+    return unpack(obj)
 
 
 class SumkDFT(object):
@@ -42,7 +112,7 @@ class SumkDFT(object):
     def __init__(self, hdf_file, h_field=0.0, use_dft_blocks=False,
                  dft_data='dft_input', symmcorr_data='dft_symmcorr_input', parproj_data='dft_parproj_input',
                  symmpar_data='dft_symmpar_input', bands_data='dft_bands_input', transp_data='dft_transp_input',
-                 misc_data='dft_misc_input'):
+                 misc_data='dft_misc_input', n_threads=1, k_distribution='cost', k_data='bcast'):
         r"""
         Initialises the class from data previously stored into an hdf5 archive.
 
@@ -79,8 +149,35 @@ class SumkDFT(object):
                       Name of hdf5 subgroup in which DFT data necessary for transport calculations are stored.
         misc_data : string, optional
                     Name of hdf5 subgroup in which miscellaneous DFT data are stored.
+        n_threads : integer, optional
+                    Number of threads per MPI process used in the k sums. The k-points of each process
+                    are distributed over the threads, so that e.g. one process per socket can be used.
+                    Set the number of BLAS threads (e.g. OMP_NUM_THREADS) accordingly.
+        k_distribution : string, optional
+                         How the k-points are distributed over the MPI processes and threads:
+
+                         - 'equal': equal number of k-points per process
+                         - 'cost': balanced according to the estimated cost n_orbitals^3 of each k-point
+                         - 'timings': balanced according to the timings of the previous k sum
+                           (the estimated cost is used for the first one)
+        k_data : string, optional
+                 How the hopping and projector matrices are loaded:
+
+                 - 'bcast': read by the master node and broadcast to all MPI processes
+                 - 'slab': each process reads only the k-points it owns from the hdf5 file
+                 - 'mmap': as 'slab', but the k-points are memory-mapped from the hdf5 file if possible
+
+                 With 'slab' and 'mmap', the memory needed per process decreases with the number of
+                 processes, but the distribution of the k-points over the processes is fixed
+                 at initialisation (it still adapts over the threads of each process).
+                 These options require h5py.
         """
 
+        self.n_threads = n_threads
+        self.k_distribution = k_distribution
+        if k_data not in ('bcast', 'slab', 'mmap'):
+            raise ValueError, "k_data: the method '%s' is not supported." % k_data
+        self.k_data = k_data
         if not type(hdf_file) == StringType:
             mpi.report("Give a string for the hdf5 filename to read the input!")
         else:
@@ -99,8 +196,13 @@ class SumkDFT(object):
                               'symm_op', 'n_shells', 'shells', 'n_corr_shells', 'corr_shells', 'use_rotations', 'rot_mat',
                               'rot_mat_time_inv', 'n_reps', 'dim_reps', 'T', 'n_orbitals', 'proj_mat', 'bz_weights', 'hopping',
                               'n_inequiv_shells', 'corr_to_inequiv', 'inequiv_to_corr']
+            if self.k_data != 'bcast':
+                things_to_read.remove('proj_mat')
+                things_to_read.remove('hopping')
             self.subgroup_present, self.value_read = self.read_input_from_hdf(
                 subgrp=self.dft_data, things_to_read=things_to_read)
+            if self.k_data != 'bcast' and self.value_read:
+                self.read_k_slabs(subgrp=self.dft_data, things_to_read=['proj_mat', 'hopping'])
             if self.symm_op:
                 self.symmcorr = Symmetry(hdf_file, subgroup=self.symmcorr_data)
 
@@ -148,6 +250,10 @@ class SumkDFT(object):
             self.deg_shells = [[] for ish in range(self.n_inequiv_shells)]
 
             self.chemical_potential = 0.0  # initialise mu
+            # cache for the self-energies upfolded to the Bloch basis
+            self.upfold_cache = UpfoldCache()
+            self.set_matsubara_sum()
+            self.set_checkpoint()
             self.init_dc()  # initialise the double counting
 
             # Analyse the block structure and determine the smallest gf_struct
@@ -212,6 +318,111 @@ class SumkDFT(object):
 
         return subgroup_present, value_read
 
+    def read_k_slabs(self, subgrp, things_to_read):
+        r"""
+        Reads the k-points owned by this MPI process of k-dependent datasets from the HDF file.
+
+        The k-points are distributed over the processes according to self.k_distribution, and
+        the datasets are stored as :class:`KSlab <dft.k_slab.KSlab>`, which can be indexed with the
+        global k index. With self.k_data = 'mmap', the datasets are memory-mapped if possible.
+
+        Parameters
+        ----------
+        subgrp : string
+                 Name of hdf5 file subgroup from which the data are to be read.
+        things_to_read : list of strings
+                         List of k-dependent datasets (k index first) to be read from the hdf5 file.
+        """
+
+        # k-points of all processes, (k_start, k_stop) for each rank
+        self.k_slab_ranges = []
+        for ikarray in self._partition_k(numpy.arange(self.n_k), self._k_costs(), mpi.size):
+            k_start = ikarray[0] if len(ikarray) > 0 else 0
+            self.k_slab_ranges.append((k_start, k_start + len(ikarray)))
+        k_start, k_stop = self.k_slab_ranges[mpi.rank]
+        for it in things_to_read:
+            setattr(self, it, KSlab.from_hdf(self.hdf_file, subgrp + '/' + it, k_start, k_stop,
+                                             mmap=(self.k_data == 'mmap')))
+        # fingerprints of the full arrays, kept on the master node by update_dft_input
+        self._k_slab_digests = {}
+
+    def update_dft_input(self, dft_input=None):
+        r"""
+        Replaces DFT data by new values in memory, without reading the hdf5 file.
+
+        This is used in charge self-consistent calculations, where the hopping and projector matrices
+        change in each DFT iteration (see :mod:`plovasp.sc_dmft`). The new values are given on the
+        master node, and only those that differ from the current ones are broadcast to the other
+        MPI processes. With k_data = 'slab' or 'mmap', each process keeps only its own k-points of
+        hopping and proj_mat, and receives only these k-points. As the master node does not hold the
+        full arrays in this case, they are compared with the values of the previous update (they are
+        always sent in the first update after reading the hdf5 file). The hdf5 file is not changed.
+
+        Parameters
+        ----------
+        dft_input : dict, optional
+                    New values on the master node, with the same names as in the dft_data subgroup
+                    (e.g. 'hopping', 'proj_mat', 'n_orbitals', 'density_required'). The entries
+                    'dft_fermi_weights' and 'band_window' of the misc_data subgroup are used by
+                    :meth:`calc_density_correction <dft.sumk_dft.SumkDFT.calc_density_correction>`.
+                    Ignored on the other nodes.
+
+        Returns
+        -------
+        changed : list of strings
+                  Names of the values that were replaced.
+        """
+
+        def equal(x, y):
+            if isinstance(x, (list, tuple)):
+                return isinstance(y, (list, tuple)) and len(x) == len(y) and all(equal(a, b) for a, b in zip(x, y))
+            if isinstance(x, numpy.ndarray) or isinstance(y, numpy.ndarray):
+                return numpy.shape(x) == numpy.shape(y) and numpy.array_equal(x, y)
+            return x == y
+
+        def digest(x):
+            x = numpy.ascontiguousarray(x)
+            return x.shape, x.dtype.str, hashlib.sha1(x.data).hexdigest()
+
+        changed = []
+        error = None
+        if mpi.is_master_node():
+            for it in sorted(dft_input):
+                old = getattr(self, it, None)
+                if not isinstance(old, KSlab):
+                    if not equal(dft_input[it], old):
+                        changed.append(it)
+                elif numpy.shape(dft_input[it])[0] != self.n_k:
+                    error = "update_dft_input: the number of k-points of %s cannot be changed." % it
+                elif digest(dft_input[it]) != self._k_slab_digests.get(it):
+                    changed.append(it)
+        changed, error = mpi.bcast((changed, error))
+        if error is not None:
+            raise ValueError, error
+
+        for it in changed:
+            old = getattr(self, it, None)
+            if isinstance(old, KSlab):
+                # send each process only its own k-points
+                if mpi.is_master_node():
+                    value = dft_input[it]
+                    for rank in range(1, mpi.size):
+                        k_start, k_stop = self.k_slab_ranges[rank]
+                        mpi.send(value[k_start:k_stop], rank)
+                    self._k_slab_digests[it] = digest(value)
+                    value = value[old.k_start:old.k_stop].copy()
+                else:
+                    value = mpi.recv(0)
+                value = KSlab(value, old.k_start, self.n_k)
+            else:
+                value = mpi.bcast(dft_input[it] if mpi.is_master_node() else None)
+            setattr(self, it, value)
+
+        # the caches of the eigensystems and of the hopping width are invalidated by the new arrays
+        if 'proj_mat' in changed or 'n_orbitals' in changed:
+            self.upfold_cache.clear()
+        return changed
+
     def save(self, things_to_save, subgrp='user_data'):
         r"""
         Saves data from a list into the HDF file. Prints a warning if a requested data is not found in SumkDFT object.
@@ -511,7 +722,7 @@ class SumkDFT(object):
                 if beta is None:
                     raise ValueError, "lattice_gf: Give the beta for the lattice GfReFreq."
                 # Default number of Matsubara frequencies
-                mesh = MeshImFreq(beta=beta, S='Fermion', n_max=1025)
+                mesh = MeshImFreq(beta=beta, S='Fermion', n_max=self.matsubara_sum['n_iw'])
             elif iw_or_w == "w":
                 if mesh is None:
                     raise ValueError, "lattice_gf: Give the mesh=(om_min,om_max,n_points) for the lattice GfReFreq."
@@ -575,6 +786,830 @@ class SumkDFT(object):
 
         return G_latt
 
+    def _sum_over_k(self, kernel, k_sum=None, threaded=True, reduce=False, checkpoint=None):
+        r"""
+        Sums kernel(ik) over the k-points of this MPI process.
+
+        If self.n_threads > 1, the k-points are split into contiguous chunks, which are processed
+        by a pool of threads with separate accumulators. numpy releases the GIL in the linear algebra
+        routines, so the kernels must only use numpy (not lattice_gf) and must not modify shared data,
+        except for writing results of different k-points into different elements of an array.
+
+        Parameters
+        ----------
+        kernel : function
+                 kernel(ik) returns the contribution of k-point ik: None, a number, a numpy array,
+                 or (nested) lists, tuples or dicts of those.
+        k_sum : optional
+                Initial value of the sum, e.g. zeros with the structure of the kernel result.
+                Its values are not changed. Arrays that the kernel fills in place can be
+                included here (with the kernel returning None for them) to be reduced as well.
+        threaded : boolean, optional
+                   If False, all k-points are done in the calling thread.
+        reduce : boolean, optional
+                 If True, the sum is reduced over the MPI processes in a single packed
+                 reduction (see :meth:`_all_reduce_packed <dft.sumk_dft.SumkDFT._all_reduce_packed>`).
+        checkpoint : string, optional
+                     Label of the k sum (including its parameters) in the checkpoint files set up with
+                     :meth:`set_checkpoint <dft.sumk_dft.SumkDFT.set_checkpoint>`. If given and checkpointing
+                     is enabled, a previously interrupted k sum with the same label is resumed and the partial
+                     sums are written regularly. This requires k_sum with the structure of the kernel result,
+                     and kernels that do not fill arrays in place.
+
+        Returns
+        -------
+        k_sum :
+                Sum of the contributions of the k-points of this process, or of all k-points if reduce=True.
+                With a checkpoint, the k-points read from the checkpoint files are included in the sum of
+                the master node.
+        """
+        costs = self._k_costs()
+        if isinstance(self.hopping, KSlab):
+            # only the k-points read by this process are available
+            ikarray = numpy.array(self.hopping.k_range, dtype=int)
+        else:
+            ikarray = self._partition_k(numpy.arange(self.n_k), costs, mpi.size)[mpi.rank]
+        k_times = numpy.zeros(self.n_k)
+
+        def partial_sum(iks):
+            partial = None
+            for ik in iks:
+                t_start = time.time()
+                partial = add_k_sums(partial, kernel(ik))
+                k_times[ik] = time.time() - t_start
+            return partial
+
+        use_checkpoint = checkpoint is not None and self.checkpoint['filename'] is not None
+        if use_checkpoint:
+            # skip the k-points done before and continue with their sum
+            checkpoint_sum, k_own, k_done = self._read_checkpoint(checkpoint, k_sum)
+            ikarray = ikarray[~k_done[ikarray]]
+            self._write_checkpoint(checkpoint, checkpoint_sum, k_own)
+            every = self.checkpoint['every']
+            blocks = [ikarray[i:i + every] for i in range(0, len(ikarray), every)]
+        else:
+            blocks = [ikarray]
+
+        t_start = time.time()
+        n_threads = min(self.n_threads, len(ikarray)) if threaded else 1
+        pool = ThreadPool(n_threads) if n_threads > 1 else None
+        try:
+            for iks in blocks:
+                if pool is not None and len(iks) > 1:
+                    partials = pool.map(partial_sum, self._partition_k(iks, costs[iks], min(n_threads, len(iks))))
+                else:
+                    partials = [partial_sum(iks)]
+                for partial in partials:
+                    if use_checkpoint:
+                        checkpoint_sum = add_k_sums(checkpoint_sum, partial)
+                    else:
+                        k_sum = add_k_sums(k_sum, partial)
+                if use_checkpoint:
+                    k_own[iks] = True
+                    self._write_checkpoint(checkpoint, checkpoint_sum, k_own)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        if use_checkpoint:
+            k_sum = add_k_sums(k_sum, checkpoint_sum)
+        rank_times = numpy.zeros(mpi.size)
+        rank_times[mpi.rank] = time.time() - t_start
+
+        # timings of all k-points and processes, for the next distribution and the balance report
+        timings = numpy.concatenate((k_times, rank_times))
+        if reduce:
+            k_sum, timings = self._all_reduce_packed((k_sum, timings))
+        else:
+            timings = self._all_reduce_packed(timings)
+        self.k_timings = timings[:self.n_k]
+        self.k_balance = {'rank_times': timings[self.n_k:],
+                          'imbalance': timings[self.n_k:].max() / max(timings[self.n_k:].mean(), 1e-300)}
+        if use_checkpoint:
+            # all processes are done (after the reduction of the timings)
+            self._remove_checkpoint(checkpoint)
+        return k_sum
+
+    def _checkpoint_files(self, label):
+        r"""
+        Returns the checkpoint files of all processes which belong to the k sum with the given label.
+        """
+        files = []
+        for filename in glob.glob(self.checkpoint['filename'] + '.*.h5'):
+            ar = HDFArchive(filename, 'r')
+            if 'label' in ar and ar['label'] == label and ar['n_k'] == self.n_k:
+                files.append(filename)
+            del ar
+        return files
+
+    def _read_checkpoint(self, label, k_sum):
+        r"""
+        Reads the checkpoint files of a k sum on the master node, written by any number of processes.
+
+        The files of one k sum contain disjoint sets of k-points. A file whose k-points are all contained
+        in another one is left over from a previous resumption (its sum was taken over by the master
+        node) and is ignored.
+
+        Returns
+        -------
+        checkpoint_sum :
+                         Sum over the k-points in the checkpoint files on the master node, zero on the other nodes.
+        k_own : numpy array of booleans
+                k-points included in checkpoint_sum.
+        k_done : numpy array of booleans
+                 k-points in the checkpoint files.
+        """
+        assert k_sum is not None, "_sum_over_k: Give k_sum to use a checkpoint!"
+        buf = pack_k_sum(k_sum)
+        checkpoint_sum = unpack_k_sum(k_sum, numpy.zeros_like(buf))
+        k_done = numpy.zeros(self.n_k, dtype=bool)
+        if mpi.is_master_node():
+            checkpoints = []
+            for filename in self._checkpoint_files(label):
+                ar = HDFArchive(filename, 'r')
+                checkpoints.append((numpy.array(ar['k_done'], dtype=bool), ar['partial_sum']))
+                del ar
+            checkpoints.sort(key=lambda c: -numpy.count_nonzero(c[0]))
+            for k_file, partial in checkpoints:
+                if not numpy.any(k_file & k_done):
+                    checkpoint_sum = add_k_sums(checkpoint_sum, unpack_k_sum(k_sum, partial))
+                    k_done |= k_file
+                elif numpy.any(k_file & ~k_done):
+                    raise IOError, "_sum_over_k: The checkpoint files %s.*.h5 are inconsistent!" % self.checkpoint['filename']
+            if numpy.any(k_done):
+                mpi.report("Resuming from checkpoint: %s of %s k-points done." % (numpy.count_nonzero(k_done), self.n_k))
+        k_done = mpi.bcast(k_done)
+        k_own = k_done.copy() if mpi.is_master_node() else numpy.zeros(self.n_k, dtype=bool)
+        return checkpoint_sum, k_own, k_done
+
+    def _write_checkpoint(self, label, checkpoint_sum, k_own):
+        r"""
+        Writes the partial sum of this process and its k-points to the checkpoint file of the process.
+        The file is replaced only when it is completely written.
+        """
+        filename = '%s.%s.h5' % (self.checkpoint['filename'], mpi.rank)
+        ar = HDFArchive(filename + '.tmp', 'w')
+        ar['label'] = label
+        ar['n_k'] = self.n_k
+        ar['k_done'] = k_own.astype(int)
+        ar['partial_sum'] = pack_k_sum(checkpoint_sum)
+        del ar
+        os.rename(filename + '.tmp', filename)
+
+    def _remove_checkpoint(self, label):
+        r"""
+        Removes the checkpoint files of a completed k sum.
+        """
+        if mpi.is_master_node():
+            for filename in self._checkpoint_files(label):
+                os.remove(filename)
+
+    def _all_reduce_packed(self, obj, master_only=False):
+        r"""
+        Sums numbers and numpy arrays over the MPI processes with a single reduction.
+
+        All entries of the (possibly nested) lists, tuples and dicts in obj are packed into one
+        contiguous buffer, which is reduced with a buffer-based MPI Allreduce (or Reduce to the
+        master node), and then unpacked into the same structure.
+
+        Parameters
+        ----------
+        obj :
+              Number, numpy array or nested lists, tuples and dicts of those (None entries are kept).
+        master_only : boolean, optional
+                      If True, the sum is only done on the master node; the other nodes get obj back.
+
+        Returns
+        -------
+        obj_sum :
+                  Sum of obj over all MPI processes, with the same structure.
+        """
+        buf = pack_k_sum(obj)
+        if mpi.size == 1 or buf is None:
+            return obj
+        if master_only:
+            if mpi.is_master_node():
+                mpi.world.Reduce(mpi.MPI.IN_PLACE, buf, op=mpi.MPI.SUM, root=0)
+            else:
+                mpi.world.Reduce(buf, None, op=mpi.MPI.SUM, root=0)
+                return obj
+        else:
+            mpi.world.Allreduce(mpi.MPI.IN_PLACE, buf, op=mpi.MPI.SUM)
+
+        return unpack_k_sum(obj, buf)
+
+    def _k_costs(self):
+        r"""
+        Returns the relative cost of each k-point used for the distribution of the k-points,
+        according to self.k_distribution.
+        """
+        if self.k_distribution == 'equal':
+            return numpy.ones(self.n_k)
+        elif self.k_distribution == 'timings' and len(getattr(self, 'k_timings', [])) == self.n_k \
+                and numpy.all(self.k_timings > 0.0):
+            return self.k_timings
+        elif self.k_distribution in ('cost', 'timings'):
+            # the inversion/diagonalisation at each frequency scales as n_orb^3
+            n_orb = numpy.array(self.n_orbitals[:self.n_k], dtype=numpy.float_).reshape(self.n_k, -1)
+            return numpy.sum(n_orb**3, axis=1) + 1.0
+        else:
+            raise ValueError, "k_distribution: the method '%s' is not supported." % self.k_distribution
+
+    def _partition_k(self, ikarray, costs, n_parts):
+        r"""
+        Splits ikarray into n_parts contiguous parts with approximately equal total cost.
+
+        Parameters
+        ----------
+        ikarray : numpy array
+                  k-point indices.
+        costs : numpy array
+                Cost of each k-point in ikarray.
+        n_parts : integer
+                  Number of parts.
+
+        Returns
+        -------
+        parts : list of numpy arrays
+                k-point indices of each part.
+        """
+        if len(ikarray) <= n_parts:
+            return [ikarray[i:i + 1] for i in range(n_parts)]
+        cumulative = numpy.cumsum(costs)
+        # each k-point goes to the part containing the middle of its cost interval
+        part = numpy.minimum(numpy.floor(n_parts * (cumulative - 0.5 * costs) / cumulative[-1]).astype(int), n_parts - 1)
+        bounds = numpy.searchsorted(part, numpy.arange(n_parts + 1))
+        return [ikarray[bounds[i]:bounds[i + 1]] for i in range(n_parts)]
+
+    def report_k_balance(self):
+        r"""
+        Reports the time spent by each MPI process in the last k sum and the load imbalance
+        (maximal time divided by the mean time).
+        """
+        if not hasattr(self, 'k_balance'):
+            mpi.report("report_k_balance: No k sum done yet.")
+            return
+        mpi.report("k-point distribution: %s" % self.k_distribution)
+        for rank, t in enumerate(self.k_balance['rank_times']):
+            mpi.report("  rank %4i: %10.4f s" % (rank, t))
+        mpi.report("  imbalance (max/mean): %.3f" % self.k_balance['imbalance'])
+
+    def _lattice_gf_setup(self, mu=None, iw_or_w="iw", beta=40, broadening=None, mesh=None, with_Sigma=True, with_dc=True,
+                          density_only=False):
+        r"""
+        Prepares the k-independent input of the batched lattice Green's function engine
+        (see :meth:`_lattice_gf_data <dft.sumk_dft.SumkDFT._lattice_gf_data>`).
+
+        The parameters have the same meaning as in :meth:`lattice_gf <dft.sumk_dft.SumkDFT.lattice_gf>`.
+        In addition, `mesh` can be given directly as a MeshImFreq or MeshReFreq object.
+        If `density_only` is True, the Green's function is only used for Matsubara sums, and
+        the frequencies are compressed according to :meth:`set_matsubara_sum <dft.sumk_dft.SumkDFT.set_matsubara_sum>`.
+
+        Returns
+        -------
+        gf_setup : dict
+                   Contains the chemical potential 'mu', the TRIQS 'mesh', the inverse temperature 'beta',
+                   the complex frequencies 'z' of the mesh (including the broadening for real frequencies),
+                   the flag 'with_Sigma' and, if the self-energy is included, the self-energy 'sigma'
+                   (numpy arrays of shape [n_w, dim, dim] in the global frame with the dc subtracted)
+                   and its high-frequency coefficients 'sigma_inf' and 'sigma_1'.
+                   For Matsubara frequencies, it also contains the 'weights' of the frequencies in the
+                   Matsubara sums and the correction 'tail_sum' used by
+                   :meth:`_density_from_gf_data <dft.sumk_dft.SumkDFT._density_from_gf_data>`.
+
+        """
+        if mu is None:
+            mu = self.chemical_potential
+        if (iw_or_w != "iw") and (iw_or_w != "w"):
+            raise ValueError, "lattice_gf: Implemented only for Re/Im frequency functions."
+        if not hasattr(self, "Sigma_imp_" + iw_or_w):
+            with_Sigma = False
+        if isinstance(mesh, (MeshImFreq, MeshReFreq)):
+            mesh_obj = mesh
+            mesh = (mesh_obj.omega_min, mesh_obj.omega_max, len(mesh_obj)) if iw_or_w == "w" else None
+        else:
+            mesh_obj = None
+        if broadening is None:
+            if mesh is None:
+                broadening = 0.01
+            else:  # broadening = 2 * \Delta omega, where \Delta omega is the spacing of omega points
+                broadening = 2.0 * ((mesh[1] - mesh[0]) / (mesh[2] - 1))
+
+        gf_setup = {'mu': mu, 'iw_or_w': iw_or_w, 'with_Sigma': with_Sigma, 'with_dc': with_dc}
+        if with_Sigma:
+            if getattr(self, '_upfold_cache_proj_mat', None) is not self.proj_mat:
+                # projectors were replaced (e.g. by reading the bands input)
+                self.upfold_cache.clear()
+                self._upfold_cache_proj_mat = self.proj_mat
+            Sigma_imp = getattr(self, "Sigma_imp_" + iw_or_w)
+            if with_dc:
+                sigma_minus_dc = self.add_dc(iw_or_w)
+            else:
+                sigma_minus_dc = [s.copy() for s in Sigma_imp]
+            mesh_obj = Sigma_imp[0].mesh
+            if iw_or_w == "iw":
+                # override beta if Sigma_iw is present
+                beta = mesh_obj.beta
+            elif broadening > 0 and mpi.is_master_node():
+                warn('lattice_gf called with Sigma and broadening > 0 (broadening = {}). You might want to explicitly set the broadening to 0.'.format(broadening))
+            gf_setup['sigma'] = [{bname: gf.data for bname, gf in sigma_minus_dc[icrsh]}
+                                 for icrsh in range(self.n_corr_shells)]
+        elif mesh_obj is None:
+            if iw_or_w == "iw":
+                if beta is None:
+                    raise ValueError, "lattice_gf: Give the beta for the lattice GfReFreq."
+                # Default number of Matsubara frequencies
+                mesh_obj = MeshImFreq(beta=beta, S='Fermion', n_max=self.matsubara_sum['n_iw'])
+            elif iw_or_w == "w":
+                if mesh is None:
+                    raise ValueError, "lattice_gf: Give the mesh=(om_min,om_max,n_points) for the lattice GfReFreq."
+                mesh_obj = MeshReFreq(mesh[0], mesh[1], mesh[2])
+
+        if iw_or_w == "iw":
+            beta = mesh_obj.beta
+            z = numpy.array([1j * x.imag for x in mesh_obj])
+            i_max = numpy.argmax(numpy.abs(z.imag))
+        else:
+            z = numpy.array([x.real for x in mesh_obj]) + 1j * broadening
+            i_max = numpy.argmax(numpy.abs(z.real))
+        gf_setup.update({'mesh': mesh_obj, 'beta': beta, 'z': z,
+                         'broadening': broadening if iw_or_w == "w" else 0.0})
+
+        if with_Sigma:
+            # Sigma(z) = sigma_inf + sigma_1 / z + ..., estimated from the largest frequency of the mesh
+            gf_setup['sigma_inf'] = [{} for icrsh in range(self.n_corr_shells)]
+            gf_setup['sigma_1'] = [{} for icrsh in range(self.n_corr_shells)]
+            for icrsh in range(self.n_corr_shells):
+                for bname, sig in gf_setup['sigma'][icrsh].iteritems():
+                    sig_max = sig[i_max]
+                    gf_setup['sigma_inf'][icrsh][bname] = 0.5 * (sig_max + sig_max.conjugate().transpose())
+                    if iw_or_w == "iw":
+                        gf_setup['sigma_1'][icrsh][bname] = 0.5 * z[i_max] * (sig_max - sig_max.conjugate().transpose())
+                    else:
+                        gf_setup['sigma_1'][icrsh][bname] = numpy.zeros_like(sig_max)
+
+        if iw_or_w == "iw":
+            # Matsubara sums are done either on the full mesh or, if only positive frequencies
+            # are stored, using G(-iw_n) = G(iw_n)^dagger.
+            gf_setup['positive_only'] = bool(numpy.all(z.imag > 0.0))
+            gf_setup['weights'] = numpy.ones(len(z))
+            if density_only and with_Sigma and self.matsubara_sum['method'] == 'compressed':
+                self._compress_matsubara(gf_setup)
+            w2_sum = numpy.sum(gf_setup['weights'] / gf_setup['z'].imag**2) / beta
+            if gf_setup['positive_only']:
+                w2_sum *= 2.0
+            # beta / 4 = 1/beta sum_n 1 / w_n^2 over all Matsubara frequencies
+            gf_setup['tail_sum'] = beta / 4.0 - w2_sum
+
+        # the frequencies identify the upfolded self-energies in self.upfold_cache; as a full
+        # cache does not evict arrays, only those of the last frequencies are kept
+        gf_setup['z_key'] = gf_setup['z'].tostring()
+        if with_Sigma and getattr(self, '_upfold_cache_z_key', None) != gf_setup['z_key']:
+            self.upfold_cache.clear()
+            self._upfold_cache_z_key = gf_setup['z_key']
+        return gf_setup
+
+    def _compress_matsubara(self, gf_setup):
+        r"""
+        Replaces the Matsubara frequencies in gf_setup by a compressed set for the Matsubara sums.
+
+        All frequencies :math:`\omega_n < \omega_c` are kept, above the cutoff :math:`\omega_c` the
+        positive frequencies are sampled on a geometric grid. After the subtraction of the
+        :math:`1/z` and :math:`t_2/z^2` terms of the tail, the summand decays as :math:`1/\omega_n^4`.
+        Each sampled frequency is therefore weighted with :math:`\sum_{n'} \omega_n^4/\omega_{n'}^4`
+        over the frequencies :math:`n'` it represents, where the last one represents all frequencies
+        up to infinity. With the spectral width W of the Green's function, the error of this
+        approximation is below :math:`W^5/(5\pi\omega_c^5)`, which determines the cutoff from the
+        accuracy set in :meth:`set_matsubara_sum <dft.sumk_dft.SumkDFT.set_matsubara_sum>`.
+
+        The width is estimated without the chemical potential, assuming that it lies within the spectrum.
+        The compressed frequencies therefore only change with the hopping, the self-energy and the
+        double counting, and the upfolded self-energies can be reused while searching for mu.
+
+        Parameters
+        ----------
+        gf_setup : dict
+                   Output of :meth:`_lattice_gf_setup <dft.sumk_dft.SumkDFT._lattice_gf_setup>`, which is changed in place.
+        """
+        beta = gf_setup['beta']
+        # estimate of the spectral width from the hopping and the high-frequency self-energy
+        sigma_width = 0.0
+        for icrsh in range(self.n_corr_shells):
+            for bname, sig_inf in gf_setup['sigma_inf'][icrsh].iteritems():
+                sigma_width = max(sigma_width, numpy.abs(sig_inf).sum(axis=1).max()
+                                  + numpy.sqrt(numpy.abs(gf_setup['sigma_1'][icrsh][bname]).sum(axis=1).max()))
+        # the eigenvalues lie in [-w, w] with w = |H(k)| + |h_field| + sigma_width, and so does mu
+        width = 2.0 * (self._hopping_width() + abs(self.h_field) + sigma_width)
+        w_cut = width * (5.0 * numpy.pi * self.matsubara_sum['accuracy'])**(-0.2)
+        n_dense = max(8, int(numpy.ceil(beta * w_cut / (2.0 * numpy.pi) - 0.5)))
+
+        # positive frequencies of the mesh, w_n = (2n+1) pi / beta
+        positive = numpy.nonzero(gf_setup['z'].imag > 0.0)[0]
+        positive = positive[numpy.argsort(gf_setup['z'][positive].imag)]
+        n_pos = len(positive)
+        if n_dense >= n_pos:
+            return
+        n_sample = [n_dense]
+        while True:
+            n_next = max(n_sample[-1] + 1, int(round(n_sample[-1] * self.matsubara_sum['ratio'])))
+            if n_next >= n_pos:
+                break
+            n_sample.append(n_next)
+        n_sample = numpy.array(n_sample)
+        # sum_{n >= m} 1/(n+1/2)^4 = psi'''(m+1/2) / 6
+        tail = polygamma(3, numpy.append(n_sample, numpy.inf) + 0.5) / 6.0
+        tail[-1] = 0.0
+        sparse_weights = (n_sample + 0.5)**4 * (tail[:-1] - tail[1:])
+
+        index = positive[numpy.append(numpy.arange(n_dense), n_sample)]
+        gf_setup['z'] = gf_setup['z'][index]
+        gf_setup['weights'] = numpy.append(numpy.ones(n_dense), sparse_weights)
+        gf_setup['positive_only'] = True
+        gf_setup['sigma'] = [{bname: sig[index] for bname, sig in gf_setup['sigma'][icrsh].iteritems()}
+                             for icrsh in range(self.n_corr_shells)]
+
+    def _hopping_width(self):
+        r"""
+        Returns an upper bound of the largest absolute eigenvalue of the hopping matrices
+        (Gershgorin circle theorem). The value is cached as long as self.hopping is not replaced.
+        """
+        if getattr(self, '_hopping_width_hopping', None) is not self.hopping:
+            hopping = self.hopping.data if isinstance(self.hopping, KSlab) else self.hopping
+            width = numpy.abs(hopping).sum(axis=-1).max() if hopping.size > 0 else 0.0
+            self._hopping_width_value = mpi.all_reduce(mpi.world, width, lambda x, y: max(x, y))
+            self._hopping_width_hopping = self.hopping
+        return self._hopping_width_value
+
+    def _upfolded_sigma(self, ik, bname, gf_setup):
+        r"""
+        Upfolds the self-energies of all correlated shells to the Bloch basis of k-point `ik`.
+        The result is kept in self.upfold_cache, which is cleared whenever the self-energy or
+        the double counting is changed through put_Sigma, set_dc or calc_dc.
+
+        Parameters
+        ----------
+        ik : integer
+             k-point index.
+        bname : string
+                Block name of the lattice Green's function.
+        gf_setup : dict
+                   Output of :meth:`_lattice_gf_setup <dft.sumk_dft.SumkDFT._lattice_gf_setup>`.
+
+        Returns
+        -------
+        sigma_k : numpy array
+                  :math:`\sum_{shells} P^{\dagger}(k) (\Sigma - dc) P(k)` with shape [n_w, n_orb, n_orb].
+        """
+        key = (gf_setup['iw_or_w'], gf_setup['with_dc'], ik, bname, gf_setup['z_key'])
+        sigma_k = self.upfold_cache.get(key)
+        if sigma_k is not None:
+            return sigma_k
+        isp = self.spin_names_to_ind[self.SO][bname]
+        n_orb = self.n_orbitals[ik, isp]
+        sigma_k = numpy.zeros((len(gf_setup['z']), n_orb, n_orb), numpy.complex_)
+        for icrsh in range(self.n_corr_shells):
+            dim = self.corr_shells[icrsh]['dim']
+            projmat = self.proj_mat[ik, isp, icrsh, 0:dim, 0:n_orb]
+            sigma_k += numpy.matmul(projmat.conjugate().transpose(),
+                                    numpy.matmul(gf_setup['sigma'][icrsh][bname], projmat))
+        self.upfold_cache.put(key, sigma_k)
+        return sigma_k
+
+    def _lattice_gf_data(self, ik, gf_setup):
+        r"""
+        Calculates the lattice Green's function for a given k-point as plain numpy arrays.
+
+        Instead of building a BlockGf, the matrix :math:`z + \mu - H(k) - P^{\dagger}(k)(\Sigma - dc)P(k)`
+        is set up as a stacked array [n_w, n_orb, n_orb] and all frequencies are inverted
+        in a single batched call.
+
+        Parameters
+        ----------
+        ik : integer
+             k-point index.
+        gf_setup : dict
+                   Output of :meth:`_lattice_gf_setup <dft.sumk_dft.SumkDFT._lattice_gf_setup>`.
+
+        Returns
+        -------
+        G_latt : dict of numpy arrays
+                 Lattice Green's function for each spin block, with shape [n_w, n_orb, n_orb].
+        """
+        ntoi = self.spin_names_to_ind[self.SO]
+        spn = self.spin_block_names[self.SO]
+        z = gf_setup['z']
+        G_latt = {}
+        for ibl, bname in enumerate(spn):
+            if not gf_setup['with_Sigma']:
+                # without self-energy G is diagonal in the eigenbasis of H(k)
+                G_latt[bname] = self._eigen_gf_data(ik, bname, gf_setup)
+                continue
+            ind = ntoi[bname]
+            n_orb = self.n_orbitals[ik, ind]
+            idmat = numpy.identity(n_orb, numpy.complex_)
+            M = self.hopping[ik, ind, 0:n_orb, 0:n_orb] - \
+                idmat * (gf_setup['mu'] + self.h_field * (1 - 2 * ibl))
+            G_inv = z[:, numpy.newaxis, numpy.newaxis] * idmat - M
+            G_inv -= self._upfolded_sigma(ik, bname, gf_setup)
+            G_latt[bname] = numpy.linalg.inv(G_inv)
+
+        return G_latt
+
+    def _get_eigensystem(self, ik, bname):
+        r"""
+        Returns the eigenvalues and eigenvectors of the hopping matrix H(k) for a given k-point and spin block.
+
+        The diagonalisation is done only once per k-point, the result is cached.
+        The cache is reset if self.hopping is replaced by a new array.
+
+        Parameters
+        ----------
+        ik : integer
+             k-point index.
+        bname : string
+                Block name of the lattice Green's function.
+
+        Returns
+        -------
+        eps : numpy array
+              Eigenvalues of H(k), without chemical potential and magnetic field.
+        U : numpy array
+            Eigenvectors of H(k) in the columns.
+        """
+        if getattr(self, '_eigensystem_hopping', None) is not self.hopping:
+            self._eigensystem = {}
+            self._eigensystem_hopping = self.hopping
+        if (ik, bname) not in self._eigensystem:
+            ind = self.spin_names_to_ind[self.SO][bname]
+            n_orb = self.n_orbitals[ik, ind]
+            self._eigensystem[(ik, bname)] = numpy.linalg.eigh(
+                self.hopping[ik, ind, 0:n_orb, 0:n_orb])
+        return self._eigensystem[(ik, bname)]
+
+    def _eigen_energies(self, ik, bname, mu):
+        r"""
+        Returns the eigenvalues of H(k) - mu, including the shift due to the magnetic field,
+        and the corresponding eigenvectors.
+        """
+        eps, U = self._get_eigensystem(ik, bname)
+        ibl = self.spin_block_names[self.SO].index(bname)
+        return eps - mu - self.h_field * (1 - 2 * ibl), U
+
+    def _eigen_gf_data(self, ik, bname, gf_setup, projmat=None):
+        r"""
+        Calculates the non-interacting lattice Green's function from the spectral representation
+
+        .. math:: G(k, z) = U(k) \frac{1}{z - \epsilon(k) + \mu} U^{\dagger}(k),
+
+        or, if `projmat` is given, directly its projection :math:`P(k) G(k, z) P^{\dagger}(k)`.
+
+        Parameters
+        ----------
+        ik : integer
+             k-point index.
+        bname : string
+                Block name of the lattice Green's function.
+        gf_setup : dict
+                   Output of :meth:`_lattice_gf_setup <dft.sumk_dft.SumkDFT._lattice_gf_setup>`.
+        projmat : numpy array, optional
+                  Projection matrix P(k) with shape [dim, n_orb].
+
+        Returns
+        -------
+        G : numpy array
+            Green's function with shape [n_w, n_orb, n_orb], or [n_w, dim, dim] if projmat is given.
+        """
+        eps, U = self._eigen_energies(ik, bname, gf_setup['mu'])
+        if projmat is not None:
+            U = numpy.dot(projmat, U)
+        g = 1.0 / (gf_setup['z'][:, numpy.newaxis] - eps[numpy.newaxis, :])
+        return numpy.matmul(U[numpy.newaxis, :, :] * g[:, numpy.newaxis, :], U.conjugate().transpose())
+
+    def _eigen_density(self, ik, bname, mu, beta):
+        r"""
+        Calculates the non-interacting density matrix :math:`U(k) f(\epsilon(k) - \mu) U^{\dagger}(k)`
+        in the Bloch basis using the Fermi function.
+        """
+        eps, U = self._eigen_energies(ik, bname, mu)
+        occ = 0.5 * (1.0 - numpy.tanh(0.5 * beta * eps))
+        return numpy.dot(U * occ[numpy.newaxis, :], U.conjugate().transpose())
+
+    def _downfold_gf_data(self, ik, bname, projmat, G_latt, gf_setup):
+        r"""
+        Downfolds a block of the lattice Green's function given as numpy array, :math:`P G P^{\dagger}`.
+        Without self-energy, G_latt is not used and the result is obtained from the eigenbasis of H(k).
+        """
+        if not gf_setup['with_Sigma']:
+            return self._eigen_gf_data(ik, bname, gf_setup, projmat=projmat)
+        return numpy.matmul(projmat, numpy.matmul(G_latt[bname], projmat.conjugate().transpose()))
+
+    def _bloch_dos(self, ik, bname, G_latt, gf_setup):
+        r"""
+        Returns the k-resolved spectral function :math:`-\frac{1}{\pi} Im Tr G(k, \omega)` in the Bloch basis.
+        Without self-energy, G_latt is not used and the result is obtained from the eigenvalues of H(k).
+        """
+        if not gf_setup['with_Sigma']:
+            eps = self._eigen_energies(ik, bname, gf_setup['mu'])[0]
+            return -numpy.sum(1.0 / (gf_setup['z'][:, numpy.newaxis] - eps[numpy.newaxis, :]), axis=1).imag / numpy.pi
+        return -numpy.trace(G_latt[bname], axis1=1, axis2=2).imag / numpy.pi
+
+    def _rotloc_data(self, ish, data, direction, shells='corr'):
+        r"""
+        Same as :meth:`rotloc <dft.sumk_dft.SumkDFT.rotloc>` for a block given as numpy array [..., dim, dim].
+        """
+        assert ((direction == 'toLocal') or (direction == 'toGlobal')
+                ), "rotloc: Give direction 'toLocal' or 'toGlobal'."
+        if shells == 'corr':
+            rot_mat_time_inv = self.rot_mat_time_inv
+            rot_mat = self.rot_mat
+        elif shells == 'all':
+            rot_mat_time_inv = self.rot_mat_all_time_inv
+            rot_mat = self.rot_mat_all
+
+        time_inv = (rot_mat_time_inv[ish] == 1) and self.SO
+        if time_inv:
+            data = numpy.swapaxes(data, -1, -2)
+        if direction == 'toGlobal':
+            if time_inv:
+                left, right = rot_mat[ish].conjugate(), rot_mat[ish].transpose()
+            else:
+                left, right = rot_mat[ish], rot_mat[ish].conjugate().transpose()
+        elif direction == 'toLocal':
+            if time_inv:
+                left, right = rot_mat[ish].transpose(), rot_mat[ish].conjugate()
+            else:
+                left, right = rot_mat[ish].conjugate().transpose(), rot_mat[ish]
+
+        return numpy.matmul(left, numpy.matmul(data, right))
+
+    def _downfold_moments(self, projmat, moments):
+        r"""
+        Downfolds the high-frequency moments (1, t_2, t_3) of a block of the lattice Green's function.
+        """
+        projmat_dag = projmat.conjugate().transpose()
+        return numpy.array([numpy.dot(projmat, projmat_dag)] +
+                           [numpy.dot(projmat, numpy.dot(mom, projmat_dag)) for mom in moments])
+
+    def _lattice_gf_moments(self, ik, gf_setup):
+        r"""
+        Calculates the high-frequency moments of the lattice Green's function,
+
+        .. math:: G(k, z) = 1/z + t_2(k)/z^2 + t_3(k)/z^3 + \ldots
+
+        Parameters
+        ----------
+        ik : integer
+             k-point index.
+        gf_setup : dict
+                   Output of :meth:`_lattice_gf_setup <dft.sumk_dft.SumkDFT._lattice_gf_setup>`.
+
+        Returns
+        -------
+        moments : dict of tuples
+                  The moments (t_2, t_3) for each spin block.
+        """
+        ntoi = self.spin_names_to_ind[self.SO]
+        spn = self.spin_block_names[self.SO]
+        moments = {}
+        for ibl, bname in enumerate(spn):
+            ind = ntoi[bname]
+            n_orb = self.n_orbitals[ik, ind]
+            idmat = numpy.identity(n_orb, numpy.complex_)
+            t2 = self.hopping[ik, ind, 0:n_orb, 0:n_orb] - \
+                idmat * (gf_setup['mu'] + self.h_field * (1 - 2 * ibl) + 1j * gf_setup['broadening'])
+            sigma_1 = numpy.zeros((n_orb, n_orb), numpy.complex_)
+            if gf_setup['with_Sigma']:
+                for icrsh in range(self.n_corr_shells):
+                    dim = self.corr_shells[icrsh]['dim']
+                    projmat = self.proj_mat[ik, ind, icrsh, 0:dim, 0:n_orb]
+                    t2 = t2 + numpy.dot(projmat.conjugate().transpose(),
+                                        numpy.dot(gf_setup['sigma_inf'][icrsh][bname], projmat))
+                    sigma_1 += numpy.dot(projmat.conjugate().transpose(),
+                                         numpy.dot(gf_setup['sigma_1'][icrsh][bname], projmat))
+            moments[bname] = (t2, numpy.dot(t2, t2) + sigma_1)
+
+        return moments
+
+    def _density_from_gf_data(self, G, t2, gf_setup):
+        r"""
+        Calculates the density matrix from a Matsubara Green's function given as a numpy array.
+
+        The sum over the frequency mesh is corrected by the analytic contribution of the
+        high-frequency tail beyond the mesh,
+
+        .. math:: n = \frac{1}{\beta}\sum_{n} G(i\omega_n) + \frac{1}{2} - t_2 \Big(\frac{\beta}{4} - \frac{1}{\beta}\sum_{n} \frac{1}{\omega_n^2}\Big).
+
+        The frequencies are weighted with gf_setup['weights'] in the sums.
+
+        Parameters
+        ----------
+        G : numpy array
+            Green's function with shape [n_w, n_orb, n_orb].
+        t2 : numpy array
+             Second moment of the high-frequency expansion of G.
+        gf_setup : dict
+                   Output of :meth:`_lattice_gf_setup <dft.sumk_dft.SumkDFT._lattice_gf_setup>`.
+
+        Returns
+        -------
+        dens_mat : numpy array
+                   Density matrix.
+        """
+        G_sum = numpy.einsum('w,wij->ij', gf_setup['weights'], G)
+        if gf_setup['positive_only']:
+            G_sum = G_sum + G_sum.conjugate().transpose()
+        return G_sum / gf_setup['beta'] + 0.5 * numpy.identity(G.shape[-1]) - t2 * gf_setup['tail_sum']
+
+    def _set_gf_tail(self, gf, moments):
+        r"""
+        Sets the high-frequency tail of a Green's function block to the given moments.
+
+        Parameters
+        ----------
+        gf : Gf
+             Green's function block whose tail is to be set.
+        moments : dict
+                  {order: matrix} of the known moments.
+        """
+        gf.tail.zero()
+        for order, mom in moments.iteritems():
+            gf.tail[order] = mom
+
+    def set_upfold_cache(self, max_memory=1000.0, spill_dir=None, max_spill=10000.0):
+        r"""
+        Sets up the cache for the self-energies upfolded to the Bloch basis, which are reused
+        by successive k sums with the same self-energy (e.g. in calc_mu).
+
+        Parameters
+        ----------
+        max_memory : float, optional
+                     Memory budget in MB per MPI process. Once it is reached, the k-points stored
+                     first are kept and the following ones are not cached (or spilled, see below).
+                     No limit if None; set to 0 to disable the cache.
+        spill_dir : string, optional
+                    If given, the arrays beyond the memory budget are stored as memory-mapped files
+                    in this directory instead of being discarded.
+        max_spill : float, optional
+                    Budget in MB per MPI process for the memory-mapped files. No limit if None.
+        """
+        self.upfold_cache.clear()
+        self.upfold_cache = UpfoldCache(max_memory=max_memory, spill_dir=spill_dir, max_spill=max_spill)
+
+    def set_checkpoint(self, filename=None, every=100):
+        r"""
+        Sets up checkpoints for long k sums, e.g. in
+        :meth:`transport_distribution <dft.sumk_dft_tools.SumkDFTTools.transport_distribution>`.
+
+        Each MPI process writes the sum over its k-points done so far to the file `filename.<rank>.h5`
+        every `every` k-points. If a k sum is interrupted (e.g. by the wall-time limit of a job), it is
+        resumed from these files when it is started again with the same parameters, possibly with a
+        different number of processes, and only the remaining k-points are calculated. The files are
+        removed when the k sum is complete. Note that only the parameters of the k sum are checked, the
+        files have to be removed by hand if the input (e.g. the self-energy) is changed in between.
+
+        Parameters
+        ----------
+        filename : string, optional
+                   Prefix of the checkpoint files. No checkpoints are written if None.
+        every : integer, optional
+                Number of k-points per process between two checkpoints.
+        """
+        self.checkpoint = {'filename': filename, 'every': every}
+
+    def set_matsubara_sum(self, method='full', accuracy=1.e-6, n_iw=1025, ratio=1.2):
+        r"""
+        Sets how the Matsubara sums for the densities in the k sums are done, i.e. in
+        :meth:`total_density <dft.sumk_dft.SumkDFT.total_density>` (and hence
+        :meth:`calc_mu <dft.sumk_dft.SumkDFT.calc_mu>`) and
+        :meth:`density_matrix <dft.sumk_dft.SumkDFT.density_matrix>`.
+
+        In all cases, the analytic contribution of the high-frequency tail is added to the sums.
+        Without self-energy, the sums are done analytically and these settings only determine the
+        default mesh.
+
+        Parameters
+        ----------
+        method : string, optional
+
+                 - 'full': sum over all frequencies of the mesh of the self-energy.
+                 - 'compressed': all frequencies below a cutoff determined by `accuracy`, and a sparse
+                   geometric grid above, with weights accounting for the omitted frequencies and the
+                   :math:`1/\omega^4` tail beyond the mesh. At low temperatures, this uses a small
+                   fraction of the frequencies.
+
+        accuracy : float, optional
+                   Target accuracy of the density per orbital for method='compressed'.
+        n_iw : integer, optional
+               Number of Matsubara frequencies of the mesh used without self-energy.
+        ratio : float, optional
+                Ratio of successive frequency indices on the sparse grid of method='compressed'.
+        """
+        if method not in ('full', 'compressed'):
+            raise ValueError, "set_matsubara_sum: the method '%s' is not supported." % method
+        self.matsubara_sum = {'method': method, 'accuracy': accuracy, 'n_iw': n_iw, 'ratio': ratio}
+        # the upfolded self-energies depend on the frequencies
+        self.upfold_cache.clear()
+
     def set_Sigma(self, Sigma_imp):
         self.put_Sigma(Sigma_imp)
 
@@ -592,6 +1627,7 @@ class SumkDFT(object):
 
         assert isinstance(
             Sigma_imp, list), "put_Sigma: Sigma_imp has to be a list of Sigmas for the correlated shells, even if it is of length 1!"
+        self.upfold_cache.clear()
         assert len(
             Sigma_imp) == self.n_inequiv_shells, "put_Sigma: give exactly one Sigma for each inequivalent corr. shell!"
 
@@ -675,35 +1711,49 @@ class SumkDFT(object):
         for icrsh in range(self.n_corr_shells):
             G_loc[icrsh].zero()                          # initialize to zero
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-            if iw_or_w == 'iw':
-                G_latt = self.lattice_gf(
-                    ik=ik, mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma, with_dc=with_dc, beta=beta)
-            elif iw_or_w == 'w':
-                mesh_parameters = (G_loc[0].mesh.omega_min,G_loc[0].mesh.omega_max,len(G_loc[0].mesh))
-                G_latt = self.lattice_gf(
-                    ik=ik, mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma, with_dc=with_dc, broadening=broadening, mesh=mesh_parameters)
-            G_latt *= self.bz_weights[ik]
-
+        if with_Sigma:
+            gf_setup = self._lattice_gf_setup(mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma,
+                                              with_dc=with_dc, broadening=broadening)
+        else:
+            gf_setup = self._lattice_gf_setup(mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma,
+                                              with_dc=with_dc, broadening=broadening, mesh=G_loc[0].mesh)
+        with_Sigma = gf_setup['with_Sigma']
+
+        # The sum over k is done with numpy arrays for the data and the tails
+        G_loc_data = [{bname: numpy.zeros(gf.data.shape, numpy.complex_) for bname, gf in G_loc[icrsh]}
+                      for icrsh in range(self.n_corr_shells)]
+        G_loc_tail = [{bname: numpy.zeros((3,) + gf.data.shape[1:], numpy.complex_) for bname, gf in G_loc[icrsh]}
+                      for icrsh in range(self.n_corr_shells)]
+
+        def G_loc_k(ik):
+            G_latt = self._lattice_gf_data(ik, gf_setup) if with_Sigma else None
+            moments = self._lattice_gf_moments(ik, gf_setup)
+            data = [{} for icrsh in range(self.n_corr_shells)]
+            tail = [{} for icrsh in range(self.n_corr_shells)]
             for icrsh in range(self.n_corr_shells):
-                # init temporary storage
-                tmp = G_loc[icrsh].copy()
-                for bname, gf in tmp:
-                    tmp[bname] << self.downfold(
-                        ik, icrsh, bname, G_latt[bname], gf)
-                G_loc[icrsh] += tmp
-
-        # Collect data from mpi
-        for icrsh in range(self.n_corr_shells):
-            G_loc[icrsh] << mpi.all_reduce(
-                mpi.world, G_loc[icrsh], lambda x, y: x + y)
-        mpi.barrier()
-
-        # G_loc[:] is now the sum over k projected to the local orbitals.
+                dim = self.corr_shells[icrsh]['dim']
+                for bname in G_loc_data[icrsh]:
+                    isp = self.spin_names_to_ind[self.SO][bname]
+                    n_orb = self.n_orbitals[ik, isp]
+                    projmat = self.proj_mat[ik, isp, icrsh, 0:dim, 0:n_orb]
+                    data[icrsh][bname] = self.bz_weights[ik] * self._downfold_gf_data(
+                        ik, bname, projmat, G_latt, gf_setup)
+                    tail[icrsh][bname] = self.bz_weights[ik] * self._downfold_moments(projmat, moments[bname])
+            return data, tail
+
+        # sum over k and collect data from mpi
+        G_loc_data, G_loc_tail = self._sum_over_k(G_loc_k, (G_loc_data, G_loc_tail), reduce=True)
+
+        # G_loc is now the sum over k projected to the local orbitals.
         # here comes the symmetrisation, if needed:
         if self.symm_op != 0:
-            G_loc = self.symmcorr.symmetrize(G_loc)
+            G_loc_data = self.symmcorr.symmetrize(G_loc_data, gf_data=True)
+            G_loc_tail = self.symmcorr.symmetrize(G_loc_tail, gf_data=True)
+        for icrsh in range(self.n_corr_shells):
+            for bname, gf in G_loc[icrsh]:
+                gf.data[:, :, :] = G_loc_data[icrsh][bname]
+                tail = G_loc_tail[icrsh][bname]
+                self._set_gf_tail(gf, {1: tail[0], 2: tail[1], 3: tail[2]})
 
         # G_loc is rotated to the local coordinate system:
         if self.use_rotations:
@@ -1283,16 +2333,23 @@ class SumkDFT(object):
                 dens_mat[icrsh][sp] = numpy.zeros(
                     [self.corr_shells[icrsh]['dim'], self.corr_shells[icrsh]['dim']], numpy.complex_)
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
+        if method == "using_gf":
+            gf_setup = self._lattice_gf_setup(mu=self.chemical_potential, iw_or_w="iw", beta=beta,
+                                              density_only=True)
+
+        def dens_mat_k(ik):
 
-            if method == "using_gf":
+            if method == "using_gf" and not gf_setup['with_Sigma']:
 
-                G_latt_iw = self.lattice_gf(
-                    ik=ik, mu=self.chemical_potential, iw_or_w="iw", beta=beta)
-                G_latt_iw *= self.bz_weights[ik]
-                dm = G_latt_iw.density()
-                MMat = [dm[sp] for sp in self.spin_block_names[self.SO]]
+                MMat = [self._eigen_density(ik, sp, gf_setup['mu'], gf_setup['beta'])
+                        for sp in self.spin_block_names[self.SO]]
+
+            elif method == "using_gf":
+
+                G_latt_iw = self._lattice_gf_data(ik, gf_setup)
+                moments = self._lattice_gf_moments(ik, gf_setup)
+                MMat = [self._density_from_gf_data(G_latt_iw[sp], moments[sp][0], gf_setup)
+                        for sp in self.spin_block_names[self.SO]]
 
             elif method == "using_point_integration":
 
@@ -1314,6 +2371,7 @@ class SumkDFT(object):
             else:
                 raise ValueError, "density_matrix: the method '%s' is not supported." % method
 
+            dens_mat_ik = [{} for icrsh in range(self.n_corr_shells)]
             for icrsh in range(self.n_corr_shells):
                 for isp, sp in enumerate(self.spin_block_names[self.corr_shells[icrsh]['SO']]):
                     ind = self.spin_names_to_ind[
@@ -1321,19 +2379,12 @@ class SumkDFT(object):
                     dim = self.corr_shells[icrsh]['dim']
                     n_orb = self.n_orbitals[ik, ind]
                     projmat = self.proj_mat[ik, ind, icrsh, 0:dim, 0:n_orb]
-                    if method == "using_gf":
-                        dens_mat[icrsh][sp] += numpy.dot(numpy.dot(projmat, MMat[isp]),
-                                                         projmat.transpose().conjugate())
-                    elif method == "using_point_integration":
-                        dens_mat[icrsh][sp] += self.bz_weights[ik] * numpy.dot(numpy.dot(projmat, MMat[isp]),
-                                                                               projmat.transpose().conjugate())
-
-        # get data from nodes:
-        for icrsh in range(self.n_corr_shells):
-            for sp in dens_mat[icrsh]:
-                dens_mat[icrsh][sp] = mpi.all_reduce(
-                    mpi.world, dens_mat[icrsh][sp], lambda x, y: x + y)
-        mpi.barrier()
+                    dens_mat_ik[icrsh][sp] = self.bz_weights[ik] * numpy.dot(numpy.dot(projmat, MMat[isp]),
+                                                                             projmat.transpose().conjugate())
+            return dens_mat_ik
+
+        # sum over k and get data from nodes:
+        dens_mat = self._sum_over_k(dens_mat_k, dens_mat, reduce=True)
 
         if self.symm_op != 0:
             dens_mat = self.symmcorr.symmetrize(dens_mat)
@@ -1395,17 +2446,24 @@ class SumkDFT(object):
                 for sp in self.spin_block_names[self.corr_shells[icrsh]['SO']]:
                     self.Hsumk[icrsh][sp] = numpy.zeros(
                         [dim, dim], numpy.complex_)
-                for isp, sp in enumerate(self.spin_block_names[self.corr_shells[icrsh]['SO']]):
-                    ind = self.spin_names_to_ind[
-                        self.corr_shells[icrsh]['SO']][sp]
-                    for ik in range(self.n_k):
+
+            def Hsumk_k(ik):
+                Hsumk_ik = [{} for icrsh in range(self.n_corr_shells)]
+                for icrsh in range(self.n_corr_shells):
+                    dim = self.corr_shells[icrsh]['dim']
+                    for isp, sp in enumerate(self.spin_block_names[self.corr_shells[icrsh]['SO']]):
+                        ind = self.spin_names_to_ind[
+                            self.corr_shells[icrsh]['SO']][sp]
                         n_orb = self.n_orbitals[ik, ind]
                         MMat = numpy.identity(n_orb, numpy.complex_)
                         MMat = self.hopping[
                             ik, ind, 0:n_orb, 0:n_orb] - (1 - 2 * isp) * self.h_field * MMat
                         projmat = self.proj_mat[ik, ind, icrsh, 0:dim, 0:n_orb]
-                        self.Hsumk[icrsh][sp] += self.bz_weights[ik] * numpy.dot(numpy.dot(projmat, MMat),
-                                                                                 projmat.conjugate().transpose())
+                        Hsumk_ik[icrsh][sp] = self.bz_weights[ik] * numpy.dot(numpy.dot(projmat, MMat),
+                                                                              projmat.conjugate().transpose())
+                return Hsumk_ik
+
+            self.Hsumk = self._sum_over_k(Hsumk_k, self.Hsumk, reduce=True)
             # symmetrisation:
             if self.symm_op != 0:
                 self.Hsumk = self.symmcorr.symmetrize(self.Hsumk)
@@ -1580,6 +2638,9 @@ class SumkDFT(object):
                     "DC for shell %(icrsh)i = %(use_dc_value)f" % locals())
                 mpi.report("DC energy = %s" % self.dc_energ[icrsh])
 
+        # dc_imp was changed in place
+        self.upfold_cache.clear()
+
     def add_dc(self, iw_or_w="iw"):
         r"""
         Subtracts the double counting term from the impurity self energy.
@@ -1668,7 +2729,7 @@ class SumkDFT(object):
                 else:
                     gf_to_symm[key].from_L_G_R(v, ss, v.conjugate().transpose())
 
-    def total_density(self, mu=None, iw_or_w="iw", with_Sigma=True, with_dc=True, broadening=None):
+    def total_density(self, mu=None, iw_or_w="iw", with_Sigma=True, with_dc=True, broadening=None, with_derivative=False):
         r"""
         Calculates the total charge within the energy window for a given chemical potential. 
         The chemical potential is either given by parameter `mu` or, if it is not specified,
@@ -1707,26 +2768,61 @@ class SumkDFT(object):
                      Imaginary shift for the axis along which the real-axis GF is calculated.
                      If not provided, broadening will be set to double of the distance between mesh points in 'mesh'.
                      Only relevant for real-frequency GF.
+        with_derivative : boolean, optional
+             If `True`, the derivative :math:`dn_{tot}/d\mu = -\frac{1}{\beta}\sum_{k,n} Tr G^2(k, i\omega_{n})`
+             is calculated from the same lattice GF and returned as well. Only implemented for `iw_or_w` = 'iw'.
 
         Returns
         -------
         dens : float
                Total charge :math:`n_{tot}`.
+        ddens : float
+                Derivative :math:`dn_{tot}/d\mu`, only returned if `with_derivative` = True.
 
         """
 
+        if with_derivative and iw_or_w != "iw":
+            raise ValueError, "total_density: The derivative is only implemented for Matsubara frequencies."
         if mu is None:
             mu = self.chemical_potential
-        dens = 0.0
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-            G_latt = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma, with_dc=with_dc, broadening=broadening)
-            dens += self.bz_weights[ik] * G_latt.total_density()
-        # collect data from mpi:
-        dens = mpi.all_reduce(mpi.world, dens, lambda x, y: x + y)
-        mpi.barrier()
+        if iw_or_w == "iw":
+            gf_setup = self._lattice_gf_setup(mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma,
+                                              with_dc=with_dc, broadening=broadening, density_only=True)
+
+        def dens_k(ik):
+            dens = 0.0
+            ddens = 0.0
+            if iw_or_w == "iw" and not gf_setup['with_Sigma']:
+                # the Matsubara sum of the non-interacting GF is the Fermi function
+                for bname in self.spin_block_names[self.SO]:
+                    eps = self._eigen_energies(ik, bname, mu)[0]
+                    occ = 0.5 * (1.0 - numpy.tanh(0.5 * gf_setup['beta'] * eps))
+                    dens += self.bz_weights[ik] * numpy.sum(occ)
+                    ddens += self.bz_weights[ik] * gf_setup['beta'] * numpy.sum(occ * (1.0 - occ))
+            elif iw_or_w == "iw":
+                G_latt = self._lattice_gf_data(ik, gf_setup)
+                moments = self._lattice_gf_moments(ik, gf_setup)
+                for bname, G in G_latt.iteritems():
+                    dens += self.bz_weights[ik] * numpy.trace(
+                        self._density_from_gf_data(G, moments[bname][0], gf_setup)).real
+                    if with_derivative:
+                        # dG/dmu = -G^2 and dt_2/dmu = -1
+                        G2_sum = numpy.einsum('w,wij,wji->', gf_setup['weights'], G, G)
+                        if gf_setup['positive_only']:
+                            G2_sum = 2.0 * G2_sum.real
+                        ddens += self.bz_weights[ik] * (-G2_sum.real / gf_setup['beta']
+                                                        + G.shape[-1] * gf_setup['tail_sum'])
+            else:
+                G_latt = self.lattice_gf(
+                    ik=ik, mu=mu, iw_or_w=iw_or_w, with_Sigma=with_Sigma, with_dc=with_dc, broadening=broadening)
+                dens += self.bz_weights[ik] * G_latt.total_density()
+            return dens, ddens
+
+        # lattice_gf (real frequencies) is not thread safe; the sum is collected from mpi
+        dens, ddens = self._sum_over_k(dens_k, (0.0, 0.0), threaded=(iw_or_w == "iw"), reduce=True)
 
+        if with_derivative:
+            return dens, ddens
         return dens
 
     def set_mu(self, mu):
@@ -1741,10 +2837,19 @@ class SumkDFT(object):
         """
         self.chemical_potential = mu
 
-    def calc_mu(self, precision=0.01, iw_or_w='iw', broadening=None, delta=0.5):
+    def calc_mu(self, precision=0.01, iw_or_w='iw', broadening=None, delta=0.5, method='dichotomy', max_loops=100):
         r"""
         Searches for the chemical potential that gives the DFT total charge.
-        A simple bisection method is used.
+
+        By default a simple bisection method is used. With method='newton', a safeguarded Newton
+        iteration is done using the derivative :math:`dn/d\mu` calculated together with the total
+        charge (for real frequencies the derivative is estimated from the previous steps).
+        With method='brent', the chemical potential is bracketed first and then found with
+        Brent's method. Both usually need far fewer k sums than the bisection.
+
+        Information on the search is stored in the member `calc_mu_info`, a dict with the entries
+        'method', 'n_k_sums' (number of evaluations of the total charge), 'converged' and 'trace'
+        (list of (mu, density, dn/dmu) for all k sums, dn/dmu is None if not calculated).
 
         Parameters
         ----------
@@ -1757,6 +2862,14 @@ class SumkDFT(object):
                      Imaginary shift for the axis along which the real-axis GF is calculated.
                      If not provided, broadening will be set to double of the distance between mesh points in 'mesh'.
                      Only relevant for real-frequency GF.
+        delta : float, optional
+                Initial step in mu when bracketing the solution.
+        method : string, optional
+                 - `method` = 'dichotomy' for the bisection
+                 - `method` = 'newton' for the safeguarded Newton iteration
+                 - `method` = 'brent' for Brent's method
+        max_loops : integer, optional
+                    Maximal number of k sums.
 
         Returns
         -------
@@ -1765,18 +2878,152 @@ class SumkDFT(object):
              within specified precision.
 
         """
-        F = lambda mu: self.total_density(
-            mu=mu, iw_or_w=iw_or_w, broadening=broadening)
         density = self.density_required - self.charge_below
+        self.calc_mu_info = {'method': method, 'n_k_sums': 0, 'converged': False, 'trace': []}
+        trace = self.calc_mu_info['trace']
+        hits, misses = self.upfold_cache.hits, self.upfold_cache.misses
+
+        # the total charge for each mu is only calculated once (e.g. at the ends of the bracket in Brent's method)
+        known = {}
+
+        # (with_derivative=True returns the pair (density, dn/dmu) of the same mu)
+        def F(mu, with_derivative=False):
+            if not (mu in known and (known[mu][1] is not None or not with_derivative)):
+                if with_derivative:
+                    dens, ddens = self.total_density(mu=mu, iw_or_w=iw_or_w, broadening=broadening,
+                                                     with_derivative=True)
+                else:
+                    dens, ddens = self.total_density(mu=mu, iw_or_w=iw_or_w, broadening=broadening), None
+                trace.append((mu, dens, ddens))
+                known[mu] = (dens, ddens)
+                self.calc_mu_info['n_k_sums'] += 1
+            if with_derivative:
+                return known[mu]
+            return known[mu][0]
+
+        if method == 'dichotomy':
+            mu = dichotomy.dichotomy(function=F,
+                                     x_init=self.chemical_potential, y_value=density,
+                                     precision_on_y=precision, delta_x=delta, max_loops=max_loops,
+                                     x_name="Chemical Potential", y_name="Total Density",
+                                     verbosity=3)[0]
+        elif method == 'newton':
+            mu = self._calc_mu_newton(F, density, precision, iw_or_w == 'iw', delta, max_loops)
+        elif method == 'brent':
+            mu = self._calc_mu_brent(F, density, precision, delta, max_loops)
+        else:
+            raise ValueError, "calc_mu: the method '%s' is not supported." % method
 
-        self.chemical_potential = dichotomy.dichotomy(function=F,
-                                                      x_init=self.chemical_potential, y_value=density,
-                                                      precision_on_y=precision, delta_x=delta, max_loops=100,
-                                                      x_name="Chemical Potential", y_name="Total Density",
-                                                      verbosity=3)[0]
+        if mu is None:
+            mpi.report("calc_mu: No convergence after %s k sums!" % self.calc_mu_info['n_k_sums'])
+            mu = trace[-1][0]
+        else:
+            self.calc_mu_info['converged'] = any(m == mu and abs(dens - density) < precision
+                                                 for m, dens, ddens in trace)
+        mpi.report("calc_mu: mu = %s after %s k sums" % (mu, self.calc_mu_info['n_k_sums']))
+        hits, misses = self.upfold_cache.hits - hits, self.upfold_cache.misses - misses
+        if hits + misses > 0:
+            mpi.report("calc_mu: %s of %s upfolded self-energies taken from the cache" % (hits, hits + misses))
 
+        self.chemical_potential = mu
         return self.chemical_potential
 
+    def _bracket_mu(self, F, density, mu, dens, delta, max_loops):
+        r"""
+        Steps mu with increasing step size until the total charge crosses the required density.
+        Returns the bracket (mu_low, dens_low, mu_high, dens_high), or None if max_loops is exceeded.
+        """
+        step = delta if dens < density else -delta
+        while len(self.calc_mu_info['trace']) < max_loops:
+            mu_new = mu + step
+            dens_new = F(mu_new)
+            if (dens_new - density) * (dens - density) <= 0.0:
+                if mu_new > mu:
+                    return mu, dens, mu_new, dens_new
+                return mu_new, dens_new, mu, dens
+            mu, dens = mu_new, dens_new
+            step *= 2.0
+        return None
+
+    def _calc_mu_newton(self, F, density, precision, analytic, delta, max_loops):
+        r"""
+        Safeguarded Newton iteration for the chemical potential. Newton steps are limited to
+        the current bracket (if known) and to a maximal step size, otherwise a bisection step is done.
+        Returns None after max_loops iterations, or if the bracket cannot be reduced any further
+        (e.g. for a density that jumps across the required value).
+        """
+        mu_low, mu_high = None, None
+        mu = self.chemical_potential
+        mu_prev, dens_prev = None, None
+        for n_loop in xrange(max_loops):
+            if analytic:
+                dens, ddens = F(mu, with_derivative=True)
+            else:
+                dens = F(mu)
+                # secant estimate of the derivative from the previous iteration
+                if mu_prev is not None and mu_prev != mu:
+                    ddens = (dens - dens_prev) / (mu - mu_prev)
+                else:
+                    ddens = 0.0
+            mpi.report("Chemical Potential = %s, Total Density = %s" % (mu, dens))
+            if abs(dens - density) < precision:
+                return mu
+            if dens < density:
+                mu_low = mu
+            else:
+                mu_high = mu
+            if mu_low is not None and mu_high is not None and \
+               mu_high - mu_low <= 2.0 * numpy.finfo(float).eps * max(abs(mu_low), abs(mu_high), 1.0):
+                return None
+            # Newton step, limited to a maximal step size in case of a small derivative (e.g. in a gap)
+            if ddens > 0.0:
+                step = (density - dens) / ddens
+            else:
+                step = numpy.sign(density - dens) * delta
+            max_step = 4.0 * delta if (mu_low is None or mu_high is None) else mu_high - mu_low
+            step = numpy.sign(step) * min(abs(step), max_step)
+            mu_new = mu + step
+            if mu_low is not None and mu_high is not None and not (mu_low < mu_new < mu_high):
+                mu_new = 0.5 * (mu_low + mu_high)
+            if mu_new == mu:
+                return None
+            mu_prev, dens_prev = mu, dens
+            mu = mu_new
+        return None
+
+    def _calc_mu_brent(self, F, density, precision, delta, max_loops):
+        r"""
+        Finds the chemical potential with Brent's method after bracketing the solution.
+        The iteration stops as soon as the total charge is within the given precision.
+        """
+        class Converged(Exception):
+            pass
+
+        def G(mu):
+            n_k_sums = self.calc_mu_info['n_k_sums']
+            dens = F(mu)
+            if self.calc_mu_info['n_k_sums'] > n_k_sums:
+                mpi.report("Chemical Potential = %s, Total Density = %s" % (mu, dens))
+            if abs(dens - density) < precision:
+                raise Converged(mu)
+            if len(self.calc_mu_info['trace']) >= max_loops:
+                raise RuntimeError
+            return dens - density
+
+        try:
+            mu = self.chemical_potential
+            dens = G(mu) + density
+            bracket = self._bracket_mu(lambda x: G(x) + density, density, mu, dens, delta, max_loops)
+            if bracket is None:
+                return None
+            brentq(G, bracket[0], bracket[2], xtol=1e-12, maxiter=max_loops)
+        except Converged as conv:
+            return conv.args[0]
+        except RuntimeError:
+            return None
+        # brentq converged in mu but not within the precision on the density
+        return self.calc_mu_info['trace'][-1][0]
+
     def calc_density_correction(self, filename=None, dm_type='wien2k'):
         r"""
         Calculates the charge density correction and stores it into a file.
@@ -1798,7 +3045,9 @@ class SumkDFT(object):
         -------
         (deltaN, dens) : tuple
                          Returns a tuple containing the density matrix `deltaN` and
-                         the corresponing total charge `dens`.
+                         the corresponing total charge `dens`. To avoid reducing it to all
+                         MPI processes, `deltaN` is only returned on the master node (None otherwise).
+                         For dm_type='vasp', the band energy correction is returned as third element.
 
         """
         assert dm_type in ('vasp', 'wien2k'), "'dm_type' must be either 'vasp' or 'wienk'"
@@ -1819,15 +3068,20 @@ class SumkDFT(object):
 
 # Fetch Fermi weights and energy window band indices
         if dm_type == 'vasp':
-            fermi_weights = 0
-            band_window = 0
-            if mpi.is_master_node():
-                ar = HDFArchive(self.hdf_file,'r')
-                fermi_weights = ar['dft_misc_input']['dft_fermi_weights']
-                band_window = ar['dft_misc_input']['band_window']
-                del ar
-            fermi_weights = mpi.bcast(fermi_weights)
-            band_window = mpi.bcast(band_window)
+            if hasattr(self, 'dft_fermi_weights'):
+                # set by update_dft_input
+                fermi_weights = self.dft_fermi_weights
+                band_window = self.band_window
+            else:
+                fermi_weights = 0
+                band_window = 0
+                if mpi.is_master_node():
+                    ar = HDFArchive(self.hdf_file,'r')
+                    fermi_weights = ar['dft_misc_input']['dft_fermi_weights']
+                    band_window = ar['dft_misc_input']['band_window']
+                    del ar
+                fermi_weights = mpi.bcast(fermi_weights)
+                band_window = mpi.bcast(band_window)
 
 # Convert Fermi weights to a density matrix
             dens_mat_dft = {}
@@ -1841,35 +3095,43 @@ class SumkDFT(object):
             deltaN[sp] = [numpy.zeros([self.n_orbitals[ik, ntoi[sp]], self.n_orbitals[
                                       ik, ntoi[sp]]], numpy.complex_) for ik in range(self.n_k)]
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-            G_latt_iw = self.lattice_gf(
-                ik=ik, mu=self.chemical_potential, iw_or_w="iw")
-            for bname, gf in G_latt_iw:
-                deltaN[bname][ik] = G_latt_iw[bname].density()
+        gf_setup = self._lattice_gf_setup(mu=self.chemical_potential, iw_or_w="iw")
+
+        def dens_k(ik):
+            # deltaN is written for each k separately, the other quantities are summed
+            dens_ik = {sp: 0.0 for sp in spn}
+            band_en_correction_ik = 0.0
+            if gf_setup['with_Sigma']:
+                G_latt_iw = self._lattice_gf_data(ik, gf_setup)
+                moments = self._lattice_gf_moments(ik, gf_setup)
+            for bname in spn:
+                if gf_setup['with_Sigma']:
+                    deltaN[bname][ik] = self._density_from_gf_data(G_latt_iw[bname], moments[bname][0], gf_setup)
+                else:
+                    deltaN[bname][ik] = self._eigen_density(ik, bname, gf_setup['mu'], gf_setup['beta'])
 
-                dens[bname] += self.bz_weights[ik] * G_latt_iw[bname].total_density()
+                dens_ik[bname] += self.bz_weights[ik] * deltaN[bname][ik].trace().real
                 if dm_type == 'vasp':
 # In 'vasp'-mode subtract the DFT density matrix
                     nb = self.n_orbitals[ik, ntoi[bname]]
                     diag_inds = numpy.diag_indices(nb)
                     deltaN[bname][ik][diag_inds] -= dens_mat_dft[bname][ik][:nb]
-                    dens[bname] -= self.bz_weights[ik] * dens_mat_dft[bname][ik].sum().real
+                    dens_ik[bname] -= self.bz_weights[ik] * dens_mat_dft[bname][ik].sum().real
                     isp = ntoi[bname]
                     b1, b2 = band_window[isp][ik, :2]
                     nb = b2 - b1 + 1
                     assert nb == self.n_orbitals[ik, ntoi[bname]], "Number of bands is inconsistent at ik = %s"%(ik)
-                    band_en_correction += numpy.dot(deltaN[bname][ik], self.hopping[ik, isp, :nb, :nb]).trace().real * self.bz_weights[ik]
-
-        # mpi reduce:
-        for bname in deltaN:
-            for ik in range(self.n_k):
-                deltaN[bname][ik] = mpi.all_reduce(
-                    mpi.world, deltaN[bname][ik], lambda x, y: x + y)
-            dens[bname] = mpi.all_reduce(
-                mpi.world, dens[bname], lambda x, y: x + y)
-        mpi.barrier()
-        band_en_correction = mpi.all_reduce(mpi.world, band_en_correction, lambda x,y : x+y)
+                    band_en_correction_ik += numpy.dot(deltaN[bname][ik], self.hopping[ik, isp, :nb, :nb]).trace().real * self.bz_weights[ik]
+            return dens_ik, band_en_correction_ik, None
+
+        # sum over k, deltaN is filled in place:
+        dens, band_en_correction, deltaN = self._sum_over_k(
+            dens_k, (dens, band_en_correction, deltaN))
+        # deltaN is only written by the master node and is not reduced to the other nodes
+        dens, band_en_correction = self._all_reduce_packed((dens, band_en_correction))
+        deltaN = self._all_reduce_packed(deltaN, master_only=True)
+        if not mpi.is_master_node():
+            deltaN = None
 
         # now save to file:
         if dm_type == 'wien2k':
@@ -1885,9 +3147,9 @@ class SumkDFT(object):
                     f1.write("%.14f\n" %
                              (self.chemical_potential / self.energy_unit))
                 # write beta in rydberg-1
-                f.write("%.14f\n" % (G_latt_iw.mesh.beta * self.energy_unit))
+                f.write("%.14f\n" % (gf_setup['beta'] * self.energy_unit))
                 if self.SP != 0:
-                    f1.write("%.14f\n" % (G_latt_iw.mesh.beta * self.energy_unit))
+                    f1.write("%.14f\n" % (gf_setup['beta'] * self.energy_unit))
 
                 if self.SP == 0:  # no spin-polarization
 
@@ -1983,13 +3245,16 @@ class SumkDFT(object):
         dens_mat = [numpy.zeros([self.corr_shells[icrsh]['dim'], self.corr_shells[icrsh]['dim']], numpy.complex_)
                     for icrsh in range(self.n_corr_shells)]
 
-        for ik in range(self.n_k):
+        def dens_mat_k(ik):
+            dens_mat_ik = []
             for icrsh in range(self.n_corr_shells):
                 dim = self.corr_shells[icrsh]['dim']
                 n_orb = self.n_orbitals[ik, 0]
                 projmat = self.proj_mat[ik, 0, icrsh, 0:dim, 0:n_orb]
-                dens_mat[icrsh][
-                    :, :] += numpy.dot(projmat, projmat.transpose().conjugate()) * self.bz_weights[ik]
+                dens_mat_ik.append(numpy.dot(projmat, projmat.transpose().conjugate()) * self.bz_weights[ik])
+            return dens_mat_ik
+
+        dens_mat = self._sum_over_k(dens_mat_k, dens_mat, reduce=True)
 
         if self.symm_op != 0:
             dens_mat = self.symmcorr.symmetrize(dens_mat)
@@ -2057,3 +3322,11 @@ class SumkDFT(object):
     def __set_deg_shells(self,value):
         self.block_structure.deg_shells = value
     deg_shells = property(__get_deg_shells,__set_deg_shells)
+
+    def __get_dc_imp(self):
+        return self._dc_imp
+    def __set_dc_imp(self,value):
+        self._dc_imp = value
+        if hasattr(self, 'upfold_cache'):
+            self.upfold_cache.clear()
+    dc_imp = property(__get_dc_imp,__set_dc_imp)
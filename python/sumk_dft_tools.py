@@ -19,12 +19,14 @@
 #
 ##########################################################################
 import sys
+import os
 from types import *
 import numpy
 from pytriqs.gf import *
 import pytriqs.utility.mpi as mpi
 from symmetry import *
 from sumk_dft import SumkDFT
+from k_slab import KSlab
 from scipy.integrate import *
 from scipy.interpolate import *
 
@@ -39,7 +41,8 @@ class SumkDFTTools(SumkDFT):
 
     def __init__(self, hdf_file, h_field=0.0, use_dft_blocks=False, dft_data='dft_input', symmcorr_data='dft_symmcorr_input',
                  parproj_data='dft_parproj_input', symmpar_data='dft_symmpar_input', bands_data='dft_bands_input',
-                 transp_data='dft_transp_input', misc_data='dft_misc_input'):
+                 transp_data='dft_transp_input', misc_data='dft_misc_input', n_threads=1, k_distribution='cost',
+                 k_data='bcast'):
         """
         Initialisation of the class. Parameters are exactly as for SumKDFT.
         """
@@ -47,7 +50,8 @@ class SumkDFTTools(SumkDFT):
         SumkDFT.__init__(self, hdf_file=hdf_file, h_field=h_field, use_dft_blocks=use_dft_blocks,
                          dft_data=dft_data, symmcorr_data=symmcorr_data, parproj_data=parproj_data,
                          symmpar_data=symmpar_data, bands_data=bands_data, transp_data=transp_data,
-                         misc_data=misc_data)
+                         misc_data=misc_data, n_threads=n_threads, k_distribution=k_distribution,
+                         k_data=k_data)
 
     # Uses .data of only GfReFreq objects.
     def dos_wannier_basis(self, mu=None, broadening=None, mesh=None, with_Sigma=True, with_dc=True, save_to_file=True):
@@ -112,39 +116,40 @@ class SumkDFTTools(SumkDFT):
                 DOSproj_orb[ish][sp] = numpy.zeros(
                     [n_om, dim, dim], numpy.complex_)
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-
-            G_latt_w = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w="w", broadening=broadening, mesh=mesh, with_Sigma=with_Sigma, with_dc=with_dc)
-            G_latt_w *= self.bz_weights[ik]
+        gf_setup = self._lattice_gf_setup(mu=mu, iw_or_w="w", broadening=broadening, mesh=mesh,
+                                          with_Sigma=with_Sigma, with_dc=with_dc)
+        G_loc_data = [{bname: numpy.zeros(gf.data.shape, numpy.complex_) for bname, gf in G_loc[icrsh]}
+                      for icrsh in range(self.n_corr_shells)]
 
+        def dos_k(ik):
+            G_latt_w = self._lattice_gf_data(ik, gf_setup) if gf_setup['with_Sigma'] else None
             # Non-projected DOS
-            for iom in range(n_om):
-                for bname, gf in G_latt_w:
-                    DOS[bname][iom] -= gf.data[iom, :, :].imag.trace() / \
-                        numpy.pi
+            DOS_ik = {bname: self.bz_weights[ik] * self._bloch_dos(ik, bname, G_latt_w, gf_setup)
+                      for bname in DOS}
 
             # Projected DOS:
+            G_loc_ik = [{} for icrsh in range(self.n_corr_shells)]
             for icrsh in range(self.n_corr_shells):
-                tmp = G_loc[icrsh].copy()
-                for bname, gf in tmp:
-                    tmp[bname] << self.downfold(ik, icrsh, bname, G_latt_w[
-                                                bname], gf)  # downfolding G
-                G_loc[icrsh] += tmp
-
-        # Collect data from mpi:
-        for bname in DOS:
-            DOS[bname] = mpi.all_reduce(
-                mpi.world, DOS[bname], lambda x, y: x + y)
-        for icrsh in range(self.n_corr_shells):
-            G_loc[icrsh] << mpi.all_reduce(
-                mpi.world, G_loc[icrsh], lambda x, y: x + y)
-        mpi.barrier()
+                dim = self.corr_shells[icrsh]['dim']
+                for bname in G_loc_data[icrsh]:
+                    isp = self.spin_names_to_ind[self.SO][bname]
+                    n_orb = self.n_orbitals[ik, isp]
+                    projmat = self.proj_mat[ik, isp, icrsh, 0:dim, 0:n_orb]
+                    G_loc_ik[icrsh][bname] = self.bz_weights[ik] * self._downfold_gf_data(
+                        ik, bname, projmat, G_latt_w, gf_setup)  # downfolding G
+            return DOS_ik, G_loc_ik
+
+        # Sum over k and collect data from mpi:
+        DOS, G_loc_data = self._sum_over_k(dos_k, (DOS, G_loc_data), reduce=True,
+                                           checkpoint='dos_wannier_basis %r' % ((gf_setup['mu'], gf_setup['broadening'],
+                                                                                 mesh, gf_setup['with_Sigma'], with_dc),))
 
         # Symmetrize and rotate to local coord. system if needed:
         if self.symm_op != 0:
-            G_loc = self.symmcorr.symmetrize(G_loc)
+            G_loc_data = self.symmcorr.symmetrize(G_loc_data, gf_data=True)
+        for icrsh in range(self.n_corr_shells):
+            for bname, gf in G_loc[icrsh]:
+                gf.data[:, :, :] = G_loc_data[icrsh][bname]
         if self.use_rotations:
             for icrsh in range(self.n_corr_shells):
                 for bname, gf in G_loc[icrsh]:
@@ -264,40 +269,41 @@ class SumkDFTTools(SumkDFT):
                 DOSproj_orb[ish][sp] = numpy.zeros(
                     [n_om, dim, dim], numpy.complex_)
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-
-            G_latt_w = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w="w", broadening=broadening, mesh=mesh, with_Sigma=with_Sigma, with_dc=with_dc)
-            G_latt_w *= self.bz_weights[ik]
+        gf_setup = self._lattice_gf_setup(mu=mu, iw_or_w="w", broadening=broadening, mesh=mesh,
+                                          with_Sigma=with_Sigma, with_dc=with_dc)
+        G_loc_data = [{bname: numpy.zeros(gf.data.shape, numpy.complex_) for bname, gf in G_loc[ish]}
+                      for ish in range(self.n_shells)]
 
+        def dos_k(ik):
+            G_latt_w = self._lattice_gf_data(ik, gf_setup) if gf_setup['with_Sigma'] else None
             # Non-projected DOS
-            for iom in range(n_om):
-                for bname, gf in G_latt_w:
-                    DOS[bname][iom] -= gf.data[iom, :, :].imag.trace() / \
-                        numpy.pi
+            DOS_ik = {bname: self.bz_weights[ik] * self._bloch_dos(ik, bname, G_latt_w, gf_setup)
+                      for bname in DOS}
 
             # Projected DOS:
+            G_loc_ik = [{} for ish in range(self.n_shells)]
             for ish in range(self.n_shells):
-                tmp = G_loc[ish].copy()
-                for ir in range(self.n_parproj[ish]):
-                    for bname, gf in tmp:
-                        tmp[bname] << self.downfold(ik, ish, bname, G_latt_w[
-                                                    bname], gf, shells='all', ir=ir)
-                    G_loc[ish] += tmp
-
-        # Collect data from mpi:
-        for bname in DOS:
-            DOS[bname] = mpi.all_reduce(
-                mpi.world, DOS[bname], lambda x, y: x + y)
-        for ish in range(self.n_shells):
-            G_loc[ish] << mpi.all_reduce(
-                mpi.world, G_loc[ish], lambda x, y: x + y)
-        mpi.barrier()
+                dim = self.shells[ish]['dim']
+                for bname in G_loc_data[ish]:
+                    isp = self.spin_names_to_ind[self.SO][bname]
+                    n_orb = self.n_orbitals[ik, isp]
+                    G_loc_ik[ish][bname] = self.bz_weights[ik] * sum(
+                        self._downfold_gf_data(ik, bname, self.proj_mat_all[ik, isp, ish, ir, 0:dim, 0:n_orb],
+                                               G_latt_w, gf_setup)
+                        for ir in range(self.n_parproj[ish]))
+            return DOS_ik, G_loc_ik
+
+        # Sum over k and collect data from mpi:
+        DOS, G_loc_data = self._sum_over_k(dos_k, (DOS, G_loc_data), reduce=True,
+                                           checkpoint='dos_parproj_basis %r' % ((gf_setup['mu'], gf_setup['broadening'],
+                                                                                 mesh, gf_setup['with_Sigma'], with_dc),))
 
         # Symmetrize and rotate to local coord. system if needed:
         if self.symm_op != 0:
-            G_loc = self.symmpar.symmetrize(G_loc)
+            G_loc_data = self.symmpar.symmetrize(G_loc_data, gf_data=True)
+        for ish in range(self.n_shells):
+            for bname, gf in G_loc[ish]:
+                gf.data[:, :, :] = G_loc_data[ish][bname]
         if self.use_rotations:
             for ish in range(self.n_shells):
                 for bname, gf in G_loc[ish]:
@@ -402,57 +408,39 @@ class SumkDFTTools(SumkDFT):
             Akw = {sp: numpy.zeros(
                 [self.shells[ishell]['dim'], self.n_k, n_om], numpy.float_) for sp in spn}
 
-        if not ishell is None:
-            gf_struct_parproj = [
-                (sp, range(self.shells[ishell]['dim'])) for sp in spn]
-            G_loc = BlockGf(name_block_generator=[(block, GfReFreq(indices=inner, mesh=self.Sigma_imp_w[0].mesh))
-                                                  for block, inner in gf_struct_parproj], make_copies=False)
-            G_loc.zero()
+        gf_setup = self._lattice_gf_setup(mu=mu, iw_or_w="w", broadening=broadening)
+        plot_mask = numpy.logical_and(numpy.array(mesh) > om_minplot, numpy.array(mesh) < om_maxplot)
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-
-            G_latt_w = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w="w", broadening=broadening)
+        def Akw_k(ik):
+            G_latt_w = self._lattice_gf_data(ik, gf_setup) if gf_setup['with_Sigma'] else None
 
             if ishell is None:
                 # Non-projected A(k,w)
-                for iom in range(n_om):
-                    if (mesh[iom] > om_minplot) and (mesh[iom] < om_maxplot):
-                        for bname, gf in G_latt_w:
-                            Akw[bname][ik, iom] += gf.data[iom, :,
-                                                           :].imag.trace() / (-1.0 * numpy.pi)
-                        # shift Akw for plotting stacked k-resolved eps(k)
-                        # curves
-                        Akw[bname][ik, iom] += ik * plot_shift
+                for bname in spn:
+                    Akw[bname][ik, plot_mask] += self._bloch_dos(ik, bname, G_latt_w, gf_setup)[plot_mask]
+                # shift Akw for plotting stacked k-resolved eps(k)
+                # curves
+                Akw[spn[-1]][ik, plot_mask] += ik * plot_shift
 
             else:  # ishell not None
                 # Projected A(k,w):
-                G_loc.zero()
-                tmp = G_loc.copy()
-                for ir in range(self.n_parproj[ishell]):
-                    for bname, gf in tmp:
-                        tmp[bname] << self.downfold(ik, ishell, bname, G_latt_w[
-                                                    bname], gf, shells='all', ir=ir)
-                    G_loc += tmp
-
-                # Rotate to local frame
-                if self.use_rotations:
-                    for bname, gf in G_loc:
-                        G_loc[bname] << self.rotloc(
-                            ishell, gf, direction='toLocal', shells='all')
+                dim = self.shells[ishell]['dim']
+                for sp in spn:
+                    isp = self.spin_names_to_ind[self.SO][sp]
+                    n_orb = self.n_orbitals[ik, isp]
+                    G_loc = sum(self._downfold_gf_data(ik, sp, self.proj_mat_all[ik, isp, ishell, ir, 0:dim, 0:n_orb],
+                                                       G_latt_w, gf_setup)
+                                for ir in range(self.n_parproj[ishell]))
 
-                for iom in range(n_om):
-                    if (mesh[iom] > om_minplot) and (mesh[iom] < om_maxplot):
-                        for ish in range(self.shells[ishell]['dim']):
-                            for sp in spn:
-                                Akw[sp][ish, ik, iom] = G_loc[sp].data[
-                                    iom, ish, ish].imag / (-1.0 * numpy.pi)
+                    # Rotate to local frame
+                    if self.use_rotations:
+                        G_loc = self._rotloc_data(ishell, G_loc, direction='toLocal', shells='all')
 
-        # Collect data from mpi
-        for sp in spn:
-            Akw[sp] = mpi.all_reduce(mpi.world, Akw[sp], lambda x, y: x + y)
-        mpi.barrier()
+                    for ish in range(dim):
+                        Akw[sp][ish, ik, plot_mask] = G_loc[plot_mask, ish, ish].imag / (-1.0 * numpy.pi)
+
+        # Akw is filled for each k-point separately, then collected from mpi
+        Akw = self._sum_over_k(Akw_k, Akw, reduce=True)
 
         if save_to_file and mpi.is_master_node():
             if ishell is None:
@@ -545,29 +533,45 @@ class SumkDFTTools(SumkDFT):
         for ish in range(self.n_shells):
             G_loc[ish].zero()
 
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-
-            G_latt_iw = self.lattice_gf(
-                ik=ik, mu=mu, iw_or_w="iw", beta=beta, with_Sigma=with_Sigma, with_dc=with_dc)
-            G_latt_iw *= self.bz_weights[ik]
+        gf_setup = self._lattice_gf_setup(mu=mu, iw_or_w="iw", beta=beta, mesh=G_loc[0].mesh,
+                                          with_Sigma=with_Sigma, with_dc=with_dc)
+        G_loc_data = [{bname: numpy.zeros(gf.data.shape, numpy.complex_) for bname, gf in G_loc[ish]}
+                      for ish in range(self.n_shells)]
+        G_loc_tail = [{bname: numpy.zeros((3,) + gf.data.shape[1:], numpy.complex_) for bname, gf in G_loc[ish]}
+                      for ish in range(self.n_shells)]
+
+        def G_loc_k(ik):
+            G_latt_iw = self._lattice_gf_data(ik, gf_setup) if gf_setup['with_Sigma'] else None
+            moments = self._lattice_gf_moments(ik, gf_setup)
+            data = [{} for ish in range(self.n_shells)]
+            tail = [{} for ish in range(self.n_shells)]
             for ish in range(self.n_shells):
-                tmp = G_loc[ish].copy()
-                for ir in range(self.n_parproj[ish]):
-                    for bname, gf in tmp:
-                        tmp[bname] << self.downfold(ik, ish, bname, G_latt_iw[
-                                                    bname], gf, shells='all', ir=ir)
-                    G_loc[ish] += tmp
-
-        # Collect data from mpi:
-        for ish in range(self.n_shells):
-            G_loc[ish] << mpi.all_reduce(
-                mpi.world, G_loc[ish], lambda x, y: x + y)
-        mpi.barrier()
+                dim = self.shells[ish]['dim']
+                for bname in G_loc_data[ish]:
+                    isp = ntoi[bname]
+                    n_orb = self.n_orbitals[ik, isp]
+                    projmats = [self.proj_mat_all[ik, isp, ish, ir, 0:dim, 0:n_orb]
+                                for ir in range(self.n_parproj[ish])]
+                    data[ish][bname] = self.bz_weights[ik] * sum(
+                        self._downfold_gf_data(ik, bname, projmat, G_latt_iw, gf_setup) for projmat in projmats)
+                    tail[ish][bname] = self.bz_weights[ik] * sum(
+                        self._downfold_moments(projmat, moments[bname]) for projmat in projmats)
+            return data, tail
+
+        # Sum over k and collect data from mpi:
+        G_loc_data, G_loc_tail = self._sum_over_k(G_loc_k, (G_loc_data, G_loc_tail), reduce=True,
+                                                  checkpoint='partial_charges %r' % ((gf_setup['mu'], beta,
+                                                                                      gf_setup['with_Sigma'], with_dc),))
 
         # Symmetrize and rotate to local coord. system if needed:
         if self.symm_op != 0:
-            G_loc = self.symmpar.symmetrize(G_loc)
+            G_loc_data = self.symmpar.symmetrize(G_loc_data, gf_data=True)
+            G_loc_tail = self.symmpar.symmetrize(G_loc_tail, gf_data=True)
+        for ish in range(self.n_shells):
+            for bname, gf in G_loc[ish]:
+                gf.data[:, :, :] = G_loc_data[ish][bname]
+                tail = G_loc_tail[ish][bname]
+                self._set_gf_tail(gf, {1: tail[0], 2: tail[1], 3: tail[2]})
         if self.use_rotations:
             for ish in range(self.n_shells):
                 for bname, gf in G_loc[ish]:
@@ -590,18 +594,29 @@ class SumkDFTTools(SumkDFT):
     def print_hamiltonian(self):
         """
         Prints the Kohn-Sham Hamiltonian to the text files hamup.dat and hamdn.dat (no spin orbit-coupling), or to ham.dat (with spin-orbit coupling).
+        If the hopping is distributed over the MPI processes (k_data = 'slab' or 'mmap'), the diagonals are gathered and written by the master node.
         """
 
+        if isinstance(self.hopping, KSlab):
+            # only the diagonal is printed, gather it from the k-points of all processes
+            ham_diag = numpy.diagonal(self.hopping.data, axis1=2, axis2=3).real
+            if not mpi.is_master_node():
+                mpi.send(ham_diag, 0)
+                return
+            ham_diag = numpy.concatenate([ham_diag] + [mpi.recv(rank) for rank in range(1, mpi.size)])
+        else:
+            ham_diag = numpy.diagonal(self.hopping, axis1=2, axis2=3).real
+
         if self.SP == 1 and self.SO == 0:
             f1 = open('hamup.dat', 'w')
             f2 = open('hamdn.dat', 'w')
             for ik in range(self.n_k):
                 for i in range(self.n_orbitals[ik, 0]):
                     f1.write('%s    %s\n' %
-                             (ik, self.hopping[ik, 0, i, i].real))
+                             (ik, ham_diag[ik, 0, i]))
                 for i in range(self.n_orbitals[ik, 1]):
                     f2.write('%s    %s\n' %
-                             (ik, self.hopping[ik, 1, i, i].real))
+                             (ik, ham_diag[ik, 1, i]))
                 f1.write('\n')
                 f2.write('\n')
             f1.close()
@@ -611,7 +626,7 @@ class SumkDFTTools(SumkDFT):
             for ik in range(self.n_k):
                 for i in range(self.n_orbitals[ik, 0]):
                     f.write('%s    %s\n' %
-                            (ik, self.hopping[ik, 0, i, i].real))
+                            (ik, ham_diag[ik, 0, i]))
                 f.write('\n')
             f.close()
 
@@ -621,6 +636,15 @@ class SumkDFTTools(SumkDFT):
     def read_transport_input_from_hdf(self):
         r"""
         Reads the data for transport calculations from the hdf5 archive.
+
+        The velocities are stored as one array velocities_k[isp, ik, :, :, :], padded to the largest
+        optical band window (older archives contain a list of arrays, which is indexed in the same way).
+        Additionally, the sum over the symmetry operations needed to symmetrise the transport distribution
+        is set up once here and stored as member rot_sum.
+
+        This is called by :meth:`transport_distribution <dft.sumk_dft_tools.SumkDFTTools.transport_distribution>`
+        whenever the hdf5 file has changed since its last call; it can also be called directly to read the
+        transport input again.
         """
         thingstoread = ['band_window_optics', 'velocities_k']
         self.read_input_from_hdf(
@@ -630,6 +654,13 @@ class SumkDFTTools(SumkDFT):
         self.read_input_from_hdf(
             subgrp=self.misc_data, things_to_read=thingstoread)
 
+        # The velocities transform as vectors under the symmetries, v_R = R v, so that
+        #   sum_R Tr(v_R,a A v_R,b A) = sum_{c,d} S[a,b,c,d] Tr(v_c A v_d A)
+        # with S[a,b,c,d] = sum_R R[a,c] R[b,d], and only the traces of the
+        # Cartesian components are needed for each k-point.
+        rot_symmetries = numpy.array(self.rot_symmetries, dtype=numpy.float_)
+        self.rot_sum = numpy.einsum('rac,rbd->abcd', rot_symmetries, rot_symmetries)
+
     def cellvolume(self, lattice_type, lattice_constants, latticeangle):
         r"""
         Determines the conventional und primitive unit cell volumes.
@@ -676,6 +707,8 @@ class SumkDFTTools(SumkDFT):
            \Gamma_{\alpha\beta}\left(\omega+\Omega/2, \omega-\Omega/2\right) = \frac{1}{V} \sum_k Tr\left(v_{k,\alpha}A_{k}(\omega+\Omega/2)v_{k,\beta}A_{k}\left(\omega-\Omega/2\right)\right)
 
         in the direction :math:`\alpha\beta`. The velocities :math:`v_{k}` are read from the transport subgroup of the hdf5 archive. 
+        They are kept for the following calls and read again only if the archive has changed
+        (see :meth:`read_transport_input_from_hdf <dft.sumk_dft_tools.SumkDFTTools.read_transport_input_from_hdf>`).
 
         Parameters
         ----------
@@ -694,6 +727,8 @@ class SumkDFTTools(SumkDFT):
         with_Sigma : boolean, optional
             Determines whether the calculation is performed with or without self energy. If this parameter is set to False the self energy is set to zero (i.e. the DFT band 
             structure :math:`A(k,\omega)` is used). Note: For with_Sigma=False it is necessary to specify the parameters energy_window, n_om and broadening.
+            In this case :math:`\Gamma` is evaluated analytically in the eigenbasis of :math:`H(k)` as the sum over band pairs of
+            :math:`|v_{nm}|^2 L_n(\omega) L_m(\omega+\Omega)` with the Lorentzians :math:`L_n` of the band energies, without setting up the Green's function.
         n_om : integer, optional
             Number of equidistant frequency points in the interval [energy_window[0]-max(Om_mesh), energy_window[1]+max(Om_mesh)]. This parameters is only used if
             with_Sigma = False.
@@ -711,7 +746,15 @@ class SumkDFTTools(SumkDFT):
             if not ('n_symmetries' in ar['dft_misc_input']):
                 raise IOError,  "transport_distribution: n_symmetries missing. Check if case.outputs file is present and call convert_misc_input() or convert_dft_input()."
 
-        self.read_transport_input_from_hdf()
+        # the transport input is read again only if the hdf5 file has changed since the last call
+        # (e.g. by convert_transport_input) or another file is used
+        hdf_stamp = None
+        if mpi.is_master_node():
+            hdf_stamp = (os.path.abspath(self.hdf_file), os.path.getmtime(self.hdf_file), os.path.getsize(self.hdf_file))
+        hdf_stamp = mpi.bcast(hdf_stamp)
+        if getattr(self, '_transport_input_stamp', None) != hdf_stamp:
+            self.read_transport_input_from_hdf()
+            self._transport_input_stamp = hdf_stamp
 
         if mpi.is_master_node():
             # k-dependent-projections.
@@ -762,6 +805,7 @@ class SumkDFTTools(SumkDFT):
                 # Truncate Sigma to given omega window
                 # In the future there should be an option in gf to manipulate the mesh (e.g. truncate) directly.
                 # For now we stick with this:
+                self.upfold_cache.clear()
                 for icrsh in range(self.n_corr_shells):
                     Sigma_save = self.Sigma_imp_w[icrsh].copy()
                     spn = self.spin_block_names[self.corr_shells[icrsh]['SO']]
@@ -801,25 +845,30 @@ class SumkDFTTools(SumkDFT):
         self.Gamma_w = {direction: numpy.zeros(
             (len(self.Om_mesh), n_om), dtype=numpy.float_) for direction in self.directions}
 
+        # symmetrisation of the traces of the Cartesian velocity components (see read_transport_input_from_hdf)
+        rot_sum = {direction: self.rot_sum[dir_to_int[direction[0]], dir_to_int[direction[1]]].reshape(9)
+                   for direction in self.directions}
+        # frequencies omega contributing for each Omega
+        iw_Om = []
+        for iq in range(len(self.Om_mesh)):
+            iw = numpy.arange(n_om - int(iOm_mesh[iq]))
+            iw_Om.append(iw[numpy.logical_and(self.omega[iw] >= -self.Om_mesh[iq] + energy_window[0],
+                                              self.omega[iw] <= self.Om_mesh[iq] + energy_window[1])])
+
+        # Without self energy G_w is evaluated in the eigenbasis of H(k)
+        gf_setup = self._lattice_gf_setup(mu=mu, iw_or_w="w", beta=beta, broadening=broadening,
+                                          mesh=mesh, with_Sigma=with_Sigma)
+
         # Sum over all k-points
-        ikarray = numpy.array(range(self.n_k))
-        for ik in mpi.slice_array(ikarray):
-            # Calculate G_w  for ik and initialize A_kw
-            G_w = self.lattice_gf(ik, mu, iw_or_w="w", beta=beta,
-                                  broadening=broadening, mesh=mesh, with_Sigma=with_Sigma)
-            A_kw = [numpy.zeros((self.n_orbitals[ik][isp], self.n_orbitals[ik][isp], n_om), dtype=numpy.complex_)
-                    for isp in range(n_inequiv_spin_blocks)]
+        def Gamma_w_k(ik):
+            Gamma_w_ik = {direction: numpy.zeros(
+                (len(self.Om_mesh), n_om), dtype=numpy.float_) for direction in self.directions}
+            # Calculate G_w for ik (only needed with self energy)
+            if gf_setup['with_Sigma']:
+                G_w = self._lattice_gf_data(ik, gf_setup)
 
             for isp in range(n_inequiv_spin_blocks):
-                # copy data from G_w (swapaxes is used to have omega in the 3rd
-                # dimension)
-                A_kw[isp] = copy.deepcopy(G_w[self.spin_block_names[self.SO][
-                                          isp]].data.swapaxes(0, 1).swapaxes(1, 2))
-                # calculate A(k,w) for each frequency
-                for iw in xrange(n_om):
-                    A_kw[isp][:, :, iw] = -1.0 / (2.0 * numpy.pi * 1j) * (
-                        A_kw[isp][:, :, iw] - numpy.conjugate(numpy.transpose(A_kw[isp][:, :, iw])))
-
+                bname = self.spin_block_names[self.SO][isp]
                 b_min = max(self.band_window[isp][
                             ik, 0], self.band_window_optics[isp][ik, 0])
                 b_max = min(self.band_window[isp][
@@ -828,36 +877,134 @@ class SumkDFTTools(SumkDFT):
                     b_min - self.band_window[isp][ik, 0], b_max - self.band_window[isp][ik, 0] + 1)
                 v_i = slice(b_min - self.band_window_optics[isp][
                             ik, 0], b_max - self.band_window_optics[isp][ik, 0] + 1)
-
-                # loop over all symmetries
-                for R in self.rot_symmetries:
-                    # get transformed velocity under symmetry R
-                    vel_R = copy.deepcopy(self.velocities_k[isp][ik])
-                    for nu1 in range(self.band_window_optics[isp][ik, 1] - self.band_window_optics[isp][ik, 0] + 1):
-                        for nu2 in range(self.band_window_optics[isp][ik, 1] - self.band_window_optics[isp][ik, 0] + 1):
-                            vel_R[nu1][nu2][:] = numpy.dot(
-                                R, vel_R[nu1][nu2][:])
-
-                    # calculate Gamma_w for each direction from the velocities
-                    # vel_R and the spectral function A_kw
+                vel = self.velocities_k[isp][ik][v_i, v_i, :].transpose(2, 0, 1)
+
+                if not gf_setup['with_Sigma']:
+                    # A(k,w) = U L(w) U^dagger with the Lorentzians L_n(w) of the eigenvalues of H(k), so that
+                    #   Tr(v_c A(w+Omega) v_d A(w)) = sum_{n,m} V_c[n,m] V_d[m,n] L_m(w+Omega) L_n(w)
+                    # with the velocities in the eigenbasis V_c = U^dagger v_c U.
+                    eps, U = self._eigen_energies(ik, bname, mu)
+                    U = U[A_i, :]
+                    L_w = -(1.0 / numpy.pi) * (1.0 / (gf_setup['z'][:, numpy.newaxis] - eps[numpy.newaxis, :])).imag
+                    V = numpy.matmul(U.conjugate().transpose(), numpy.matmul(vel, U))
                     for direction in self.directions:
-                        for iw in xrange(n_om):
-                            for iq in range(len(self.Om_mesh)):
-                                if(iw + iOm_mesh[iq] >= n_om or self.omega[iw] < -self.Om_mesh[iq] + energy_window[0] or self.omega[iw] > self.Om_mesh[iq] + energy_window[1]):
-                                    continue
+                        M = numpy.einsum('cd,cnm,dmn->nm', rot_sum[direction].reshape(3, 3), V, V).real
+                        for iq in range(len(self.Om_mesh)):
+                            iw = iw_Om[iq]
+                            Gamma_w_ik[direction][iq, iw] += (numpy.dot(L_w[iw], M) * L_w[iw + int(iOm_mesh[iq])]).sum(
+                                axis=1) * self.bz_weights[ik]
+                    continue
+
+                # calculate A(k,w) for all frequencies at once, A_kw[iw, :, :]
+                G_isp = G_w[bname][:, A_i, A_i]
+                A_kw = -1.0 / (2.0 * numpy.pi * 1j) * (G_isp - G_isp.conjugate().transpose(0, 2, 1))
+                # vA[c, iw, :, :] = v_c A(k,w) for the directions c = x, y, z
+                vA = numpy.matmul(vel[:, numpy.newaxis, :, :], A_kw[numpy.newaxis, :, :, :])
+                n_b = vA.shape[-1]
+
+                for iq in range(len(self.Om_mesh)):
+                    iw = iw_Om[iq]
+                    # Tr(v_c A(w+Omega) v_d A(w)) for all pairs (c, d) and frequencies w
+                    vA_Om = vA[:, iw + int(iOm_mesh[iq])].reshape(3, len(iw), n_b * n_b)
+                    vA_w = vA[:, iw].transpose(0, 1, 3, 2).reshape(3, len(iw), n_b * n_b)
+                    traces = numpy.matmul(vA_Om.transpose(1, 0, 2), vA_w.transpose(1, 2, 0)).real
+                    traces = traces.reshape(len(iw), 9)
+                    for direction in self.directions:
+                        Gamma_w_ik[direction][iq, iw] += numpy.dot(traces, rot_sum[direction]) * self.bz_weights[ik]
+            return Gamma_w_ik
 
-                                self.Gamma_w[direction][iq, iw] += (numpy.dot(numpy.dot(numpy.dot(vel_R[v_i, v_i, dir_to_int[direction[0]]],
-                                                                                                  A_kw[isp][A_i, A_i, int(iw + iOm_mesh[iq])]), vel_R[v_i, v_i, dir_to_int[direction[1]]]),
-                                                                              A_kw[isp][A_i, A_i, iw]).trace().real * self.bz_weights[ik])
+        self.Gamma_w = self._sum_over_k(Gamma_w_k, self.Gamma_w, reduce=True,
+                                        checkpoint='transport_distribution %r' % ((beta, directions, energy_window,
+                                                                                   list(self.Om_mesh), n_om, mu, broadening,
+                                                                                   gf_setup['with_Sigma']),))
 
         for direction in self.directions:
-            self.Gamma_w[direction] = (mpi.all_reduce(mpi.world, self.Gamma_w[direction], lambda x, y: x + y)
+            self.Gamma_w[direction] = (self.Gamma_w[direction]
                                        / self.cellvolume(self.lattice_type, self.lattice_constants, self.lattice_angles)[1] / self.n_symmetries)
 
+    def transport_coefficients(self, beta, n, method=None):
+        r"""
+        Calculates the transport coefficients A_n in all directions and for all :math:`\Omega` of the member Om_mesh at once,
+        for a single or for several inverse temperatures. The required members (Gamma_w, directions, Om_mesh) have to be obtained first
+        by calling the function :meth:`transport_distribution <dft.sumk_dft_tools.SumkDFTTools.transport_distribution>`. For n>0 A is set to NaN if :math:`\Omega` is not 0.0.
+
+        Parameters
+        ----------
+        beta : double or array of double
+            Inverse temperature(s) :math:`\beta`.
+        n : integer
+            Number of the desired moment of the transport distribution.
+        method : string
+            Integration method: cubic spline and scipy.integrate.quad ('quad'), simpson rule ('simps'), trapezoidal rule ('trapz'), rectangular integration (otherwise)
+            Note that the sampling points of the the self-energy are used!
+
+        Returns
+        -------
+        A : dictionary of double arrays
+            Transport coefficients in each direction, with shape numpy.shape(beta) + (number of :math:`\Omega` points,).
+        """
+
+        if not (mpi.is_master_node()):
+            return
+
+        assert hasattr(
+            self, 'Gamma_w'), "transport_coefficients: Run transport_distribution first or load data from h5!"
+
+        n_q = self.Gamma_w[self.directions[0]].shape[0]
+        Gamma_w = numpy.array([self.Gamma_w[direction] for direction in self.directions])
+        A = self._transport_integral(Gamma_w, numpy.array(self.Om_mesh[:n_q], dtype=float), beta, n, method)
+        return {direction: A[..., idir, :] for idir, direction in enumerate(self.directions)}
+
+    def _transport_integral(self, Gamma_w, Om_mesh, beta, n, method):
+        r"""
+        Integrates Gamma_w (directions, Omega, omega) for the inverse temperature(s) beta, see transport_coefficients.
+        The result has the shape numpy.shape(beta) + (directions, Omega).
+        """
+
+        n_q = len(Om_mesh)
+        # A_n is only defined for Omega = 0 or n = 0
+        valid = (Om_mesh == 0.0) if n != 0 else numpy.ones(n_q, dtype=bool)
+        is_zero = Om_mesh[valid] == 0.0
+
+        # the temperatures are the leading axes, then Omega and omega
+        b = numpy.asarray(beta, dtype=float)[..., numpy.newaxis, numpy.newaxis]
+        w = self.omega
+        weight = numpy.empty(b.shape[:-2] + (valid.sum(), len(w)))
+        weight[..., is_zero, :] = self.fermi_dis(w, b) * self.fermi_dis(-w, b) * (w * b)**n
+        if not is_zero.all():
+            Om = Om_mesh[valid][~is_zero, numpy.newaxis]
+            weight[..., ~is_zero, :] = (self.fermi_dis(w, b) - self.fermi_dis(w + Om, b)) / (Om * b)
+
+        # setup the integrand for all directions, the directions are the axis before Omega
+        A_int = weight[..., numpy.newaxis, :, :] * Gamma_w[:, valid]
+
+        # w-integration
+        if method == 'quad':
+            # quad on interpolated w-points with cubic spline
+            A_valid = numpy.array([quad(interp1d(w, A_int_w, kind='cubic'), min(w), max(w),
+                                        epsabs=1.0e-12, epsrel=1.0e-12, limit=500)[0]
+                                   for A_int_w in A_int.reshape(-1, len(w))]).reshape(A_int.shape[:-1])
+        elif method == 'simps':
+            # simpson rule for w-grid
+            A_valid = simps(A_int, w, axis=-1)
+        elif method == 'trapz':
+            # trapezoidal rule for w-grid
+            A_valid = numpy.trapz(A_int, w, axis=-1)
+        else:
+            # rectangular integration for w-grid (orignal implementation)
+            A_valid = A_int.sum(axis=-1) * (w[1] - w[0])
+        A_valid *= numpy.pi * (2.0 - self.SP)
+
+        A = numpy.full(A_valid.shape[:-1] + (n_q,), numpy.nan)
+        A[..., valid] = A_valid
+        return A
+
     def transport_coefficient(self, direction, iq, n, beta, method=None):
         r"""
         Calculates the transport coefficient A_n in a given direction for a given :math:`\Omega`. The required members (Gamma_w, directions, Om_mesh) have to be obtained first
         by calling the function :meth:`transport_distribution <dft.sumk_dft_tools.SumkDFTTools.transport_distribution>`. For n>0 A is set to NaN if :math:`\Omega` is not 0.0. 
+        To obtain all directions, :math:`\Omega` points and several temperatures at once use
+        :meth:`transport_coefficients <dft.sumk_dft_tools.SumkDFTTools.transport_coefficients>`.
 
         Parameters
         ----------
@@ -885,61 +1032,33 @@ class SumkDFTTools(SumkDFT):
         assert hasattr(
             self, 'Gamma_w'), "transport_coefficient: Run transport_distribution first or load data from h5!"
 
-        if (self.Om_mesh[iq] == 0.0 or n == 0.0):
-            A = 0.0
-            # setup the integrand
-            if (self.Om_mesh[iq] == 0.0):
-                A_int = self.Gamma_w[direction][iq] * (self.fermi_dis(
-                    self.omega, beta) * self.fermi_dis(-self.omega, beta)) * (self.omega * beta)**n
-            elif (n == 0.0):
-                A_int = self.Gamma_w[direction][iq] * (self.fermi_dis(self.omega, beta) - self.fermi_dis(
-                    self.omega + self.Om_mesh[iq], beta)) / (self.Om_mesh[iq] * beta)
-
-            # w-integration
-            if method == 'quad':
-                # quad on interpolated w-points with cubic spline
-                A_int_interp = interp1d(self.omega, A_int, kind='cubic')
-                A = quad(A_int_interp, min(self.omega), max(self.omega),
-                         epsabs=1.0e-12, epsrel=1.0e-12, limit=500)
-                A = A[0]
-            elif method == 'simps':
-                # simpson rule for w-grid
-                A = simps(A_int, self.omega)
-            elif method == 'trapz':
-                # trapezoidal rule for w-grid
-                A = numpy.trapz(A_int, self.omega)
-            else:
-                # rectangular integration for w-grid (orignal implementation)
-                d_w = self.omega[1] - self.omega[0]
-                for iw in xrange(self.Gamma_w[direction].shape[1]):
-                    A += A_int[iw] * d_w
-            A = A * numpy.pi * (2.0 - self.SP)
-        else:
-            A = numpy.nan
-        return A
+        A = self._transport_integral(self.Gamma_w[direction][numpy.newaxis, iq:iq + 1],
+                                     numpy.array([self.Om_mesh[iq]], dtype=float), beta, n, method)
+        return A[..., 0, 0][()]
 
     def conductivity_and_seebeck(self, beta, method=None):
         r"""
         Calculates the Seebeck coefficient and the optical conductivity by calling 
-        :meth:`transport_coefficient <dft.sumk_dft_tools.SumkDFTTools.transport_coefficient>`. 
+        :meth:`transport_coefficients <dft.sumk_dft_tools.SumkDFTTools.transport_coefficients>`. 
         The required members (Gamma_w, directions, Om_mesh) have to be obtained first by calling the function 
         :meth:`transport_distribution <dft.sumk_dft_tools.SumkDFTTools.transport_distribution>`. 
+        If beta is an array, the results for all temperatures are obtained at once and nothing is printed.
 
         Parameters
         ----------
-        beta : double
-            Inverse temperature :math:`\beta`.
+        beta : double or array of double
+            Inverse temperature(s) :math:`\beta`.
 
         Returns
         -------
-        optic_cond : dictionary of double vectors
-            Optical conductivity in each direction and frequency given by Om_mesh.
+        optic_cond : dictionary of double arrays
+            Optical conductivity in each direction and frequency given by Om_mesh, with shape numpy.shape(beta) + (number of :math:`\Omega` points,).
 
-        seebeck : dictionary of double
-            Seebeck coefficient in each direction. If zero is not present in Om_mesh the Seebeck coefficient is set to NaN.
+        seebeck : dictionary of double (arrays)
+            Seebeck coefficient in each direction, with shape numpy.shape(beta). If zero is not present in Om_mesh the Seebeck coefficient is set to NaN.
 
-        kappa : dictionary of double. 
-            thermal conductivity in each direction. If zero is not present in Om_mesh the thermal conductivity is set to NaN
+        kappa : dictionary of double (arrays)
+            thermal conductivity in each direction, with shape numpy.shape(beta). If zero is not present in Om_mesh the thermal conductivity is set to NaN
         """
 
         if not (mpi.is_master_node()):
@@ -948,43 +1067,41 @@ class SumkDFTTools(SumkDFT):
         assert hasattr(
             self, 'Gamma_w'), "conductivity_and_seebeck: Run transport_distribution first or load data from h5!"
         n_q = self.Gamma_w[self.directions[0]].shape[0]
+        beta = numpy.asarray(beta, dtype=float)
 
-        A0 = {direction: numpy.full((n_q,), numpy.nan)
-              for direction in self.directions}
-        A1 = {direction: numpy.full((n_q,), numpy.nan)
-              for direction in self.directions}
-        A2 = {direction: numpy.full((n_q,), numpy.nan)
-              for direction in self.directions}
-        self.seebeck = {direction: numpy.nan for direction in self.directions}
-        self.kappa = {direction: numpy.nan for direction in self.directions}
-        self.optic_cond = {direction: numpy.full(
-            (n_q,), numpy.nan) for direction in self.directions}
+        A0 = self.transport_coefficients(beta, 0, method=method)
+        A1 = self.transport_coefficients(beta, 1, method=method)
+        A2 = self.transport_coefficients(beta, 2, method=method)
 
+        # Seebeck and kappa are taken from the last Omega = 0 in Om_mesh
+        iq_zero = [iq for iq in xrange(n_q) if self.Om_mesh[iq] == 0.0]
+        self.seebeck = {}
+        self.kappa = {}
+        self.optic_cond = {}
         for direction in self.directions:
-            for iq in xrange(n_q):
-                A0[direction][iq] = self.transport_coefficient(
-                    direction, iq=iq, n=0, beta=beta, method=method)
-                A1[direction][iq] = self.transport_coefficient(
-                    direction, iq=iq, n=1, beta=beta, method=method)
-                A2[direction][iq] = self.transport_coefficient(
-                    direction, iq=iq, n=2, beta=beta, method=method)
-                print "A_0 in direction %s for Omega = %.2f    %e a.u." % (direction, self.Om_mesh[iq], A0[direction][iq])
-                print "A_1 in direction %s for Omega = %.2f    %e a.u." % (direction, self.Om_mesh[iq], A1[direction][iq])
-                print "A_2 in direction %s for Omega = %.2f    %e a.u." % (direction, self.Om_mesh[iq], A2[direction][iq])
-                if ~numpy.isnan(A1[direction][iq]):
-                    # Seebeck and kappa are overwritten if there is more than one Omega =
-                    # 0 in Om_mesh
-                    self.seebeck[direction] = - \
-                        A1[direction][iq] / A0[direction][iq] * 86.17
-                    self.kappa[direction] = A2[direction][iq] - A1[direction][iq]*A1[direction][iq]/A0[direction][iq]
-                    self.kappa[direction] *= 293178.0
-            self.optic_cond[direction] = beta * \
-                A0[direction] * 10700.0 / numpy.pi
-            for iq in xrange(n_q):
-                print "Conductivity in direction %s for Omega = %.2f       %f  x 10^4 Ohm^-1 cm^-1" % (direction, self.Om_mesh[iq], self.optic_cond[direction][iq])
-                if not (numpy.isnan(A1[direction][iq])):
-                    print "Seebeck in direction      %s for Omega = 0.00      %f  x 10^(-6) V/K" % (direction, self.seebeck[direction])
-                    print "kappa in direction      %s for Omega = 0.00      %f  W/(m * K)" % (direction, self.kappa[direction])
+            self.optic_cond[direction] = beta[..., numpy.newaxis] * A0[direction] * 10700.0 / numpy.pi
+            if iq_zero:
+                A0_0, A1_0, A2_0 = [A[direction][..., iq_zero[-1]] for A in (A0, A1, A2)]
+                self.seebeck[direction] = - A1_0 / A0_0 * 86.17
+                self.kappa[direction] = (A2_0 - A1_0 * A1_0 / A0_0) * 293178.0
+            else:
+                self.seebeck[direction] = numpy.full(beta.shape, numpy.nan)
+                self.kappa[direction] = numpy.full(beta.shape, numpy.nan)
+            if beta.ndim == 0:
+                self.seebeck[direction] = self.seebeck[direction][()]
+                self.kappa[direction] = self.kappa[direction][()]
+
+        if beta.ndim == 0:
+            for direction in self.directions:
+                for iq in xrange(n_q):
+                    print "A_0 in direction %s for Omega = %.2f    %e a.u." % (direction, self.Om_mesh[iq], A0[direction][iq])
+                    print "A_1 in direction %s for Omega = %.2f    %e a.u." % (direction, self.Om_mesh[iq], A1[direction][iq])
+                    print "A_2 in direction %s for Omega = %.2f    %e a.u." % (direction, self.Om_mesh[iq], A2[direction][iq])
+                for iq in xrange(n_q):
+                    print "Conductivity in direction %s for Omega = %.2f       %f  x 10^4 Ohm^-1 cm^-1" % (direction, self.Om_mesh[iq], self.optic_cond[direction][iq])
+                    if not (numpy.isnan(A1[direction][iq])):
+                        print "Seebeck in direction      %s for Omega = 0.00      %f  x 10^(-6) V/K" % (direction, self.seebeck[direction])
+                        print "kappa in direction      %s for Omega = 0.00      %f  W/(m * K)" % (direction, self.kappa[direction])
 
         return self.optic_cond, self.seebeck, self.kappa
 
@@ -85,10 +85,57 @@ class Symmetry:
                 srch['atom'] = self.perm[i_symm][self.orbits[iorb]['atom'] - 1]
                 self.orb_map[i_symm][iorb] = self.orbits.index(srch)
 
-    def symmetrize(self, obj):
+    def _symmetrizers(self, iorb, jorb):
+        r"""
+        Returns the symmetry operations mapping orbit iorb to orbit jorb as superoperators,
+        acting on the matrices flattened (row-major) to vectors:
+
+        .. math:: (M X M^{\dagger})_{vec} = (M \otimes M^*) X_{vec}.
+
+        The sum over all symmetry operations (divided by n_symm) is precomputed separately for
+        the operations without and with time inversion.
+        """
+        if not hasattr(self, '_superops'):
+            self._superops = {}
+            for i_symm in range(self.n_symm):
+                for iorb2 in range(self.n_orbits):
+                    jorb2 = self.orb_map[i_symm][iorb2]
+                    mat = numpy.asarray(self.mat[i_symm][iorb2])
+                    if (iorb2, jorb2) not in self._superops:
+                        self._superops[(iorb2, jorb2)] = numpy.zeros(
+                            (2, mat.size, mat.size), numpy.complex_)
+                    self._superops[(iorb2, jorb2)][int(self.time_inv[i_symm] != 0)] += \
+                        numpy.kron(mat, mat.conjugate()) / self.n_symm
+        return self._superops.get((iorb, jorb))
+
+    def _symmetrize_array(self, arr, iorb, jorb, gf_data):
+        r"""
+        Applies all symmetry operations mapping orbit iorb to orbit jorb to arr, an array of
+        matrices with shape [..., dim, dim].
+        With gf_data=True, time inversion transposes the matrices (as for Green's functions),
+        otherwise it conjugates them (as for density matrices).
+        """
+        superop = self._symmetrizers(iorb, jorb)
+        shape = arr.shape
+        dim = shape[-1]
+        x = numpy.asarray(arr, numpy.complex_).reshape(-1, dim * dim)
+        if gf_data:
+            # vec(X^T) is a permutation of vec(X)
+            perm = numpy.arange(dim * dim).reshape(dim, dim).transpose().flatten()
+            res = numpy.dot(x, (superop[0] + superop[1][:, perm]).transpose())
+        else:
+            res = numpy.dot(x, superop[0].transpose()) + \
+                numpy.dot(x.conjugate(), superop[1].transpose())
+        return res.reshape(shape)
+
+    def symmetrize(self, obj, gf_data=False):
         """
         Symmetrizes a given object. 
 
+        All symmetry operations are applied at once, using precomputed superoperators that
+        act on the matrices flattened to vectors. For Green's functions, they are applied to the
+        data arrays of all frequencies and to the tails.
+
         Parameters
         ----------
         obj : list
@@ -97,6 +144,11 @@ class Symmetry:
 
               - BlockGf : list of Green's functions,
               - Matrices : The format is taken from density matrices as obtained from Green's functions (DictType).
+                Arrays of matrices with shape [..., dim, dim] are also accepted.
+
+        gf_data : boolean, optional
+                  If True, the matrices are treated as data of Green's functions, i.e. time inversion
+                  transposes them instead of conjugating them.
 
         Returns
         -------
@@ -121,44 +173,30 @@ class Symmetry:
             for iorb in range(self.n_orbits):
                 if type(symm_obj[iorb]) == DictType:
                     for ii in symm_obj[iorb]:
-                        symm_obj[iorb][ii] *= 0.0
+                        symm_obj[iorb][ii] = numpy.zeros_like(symm_obj[iorb][ii], numpy.complex_)
                 else:
-                    symm_obj[iorb] *= 0.0
+                    symm_obj[iorb] = numpy.zeros_like(symm_obj[iorb], numpy.complex_)
 
-        for i_symm in range(self.n_symm):
-            for iorb in range(self.n_orbits):
-                l = self.orbits[iorb]['l']         # s, p, d, or f
-                dim = self.orbits[iorb]['dim']
-                jorb = self.orb_map[i_symm][iorb]
+        for iorb in range(self.n_orbits):
+            for jorb in range(self.n_orbits):
+                if self._symmetrizers(iorb, jorb) is None:
+                    continue
 
                 if isinstance(obj[0], BlockGf):
 
-                    tmp = obj[iorb].copy()
-                    if self.time_inv[i_symm]:
-                        tmp << tmp.transpose()
-                    for bname, gf in tmp:
-                        tmp[bname].from_L_G_R(self.mat[i_symm][iorb], tmp[bname], self.mat[
-                                              i_symm][iorb].conjugate().transpose())
-                    tmp *= 1.0 / self.n_symm
-                    symm_obj[jorb] += tmp
+                    for bname, gf in obj[iorb]:
+                        symm_obj[jorb][bname].data[...] += self._symmetrize_array(
+                            gf.data, iorb, jorb, gf_data=True)
+                        symm_obj[jorb][bname].tail.data[...] += self._symmetrize_array(
+                            gf.tail.data, iorb, jorb, gf_data=True)
 
+                elif type(obj[iorb]) == DictType:
+                    for ii in obj[iorb]:
+                        symm_obj[jorb][ii] += self._symmetrize_array(
+                            obj[iorb][ii], iorb, jorb, gf_data)
                 else:
-
-                    if type(obj[iorb]) == DictType:
-                        for ii in obj[iorb]:
-                            if self.time_inv[i_symm] == 0:
-                                symm_obj[jorb][ii] += numpy.dot(numpy.dot(self.mat[i_symm][iorb], obj[iorb][ii]),
-                                                                self.mat[i_symm][iorb].conjugate().transpose()) / self.n_symm
-                            else:
-                                symm_obj[jorb][ii] += numpy.dot(numpy.dot(self.mat[i_symm][iorb], obj[iorb][ii].conjugate()),
-                                                                self.mat[i_symm][iorb].conjugate().transpose()) / self.n_symm
-                    else:
-                        if self.time_inv[i_symm] == 0:
-                            symm_obj[jorb] += numpy.dot(numpy.dot(self.mat[i_symm][iorb], obj[iorb]),
-                                                        self.mat[i_symm][iorb].conjugate().transpose()) / self.n_symm
-                        else:
-                            symm_obj[jorb] += numpy.dot(numpy.dot(self.mat[i_symm][iorb], obj[iorb].conjugate()),
-                                                        self.mat[i_symm][iorb].conjugate().transpose()) / self.n_symm
+                    symm_obj[jorb] += self._symmetrize_array(
+                        obj[iorb], iorb, jorb, gf_data)
 
 # Markus: This does not what it is supposed to do, check how this should work (keep for now)
 #        if (self.SO == 0) and (self.SP == 0):
@@ -0,0 +1,151 @@
+
+##########################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+##########################################################################
+
+import os
+import shutil
+import tempfile
+import threading
+import numpy
+
+
+class UpfoldCache(object):
+    r"""
+    Cache of numpy arrays with a memory budget.
+
+    It is used by SumkDFT to keep the self-energies upfolded to the Bloch basis,
+    :math:`P^{\dagger}(k) (\Sigma - dc) P(k)`, between successive k sums
+    (e.g. during the search for the chemical potential).
+    The k sums request the arrays in the same cyclic order each time, for which evicting the
+    least recently used arrays would never give a hit. Instead, arrays are not evicted once the
+    budget is reached: new arrays are moved to memory-mapped files, if a spill directory is
+    given and the spill budget allows, and are discarded otherwise. The arrays stored first
+    are thus reused by all following k sums. The numbers of hits and misses are counted in
+    `hits` and `misses`.
+    The cache can be used from several threads.
+
+    Parameters
+    ----------
+    max_memory : float, optional
+                 Memory budget in MB for arrays kept in memory. No limit if None.
+    spill_dir : string, optional
+                Directory in which arrays beyond the memory budget are stored as memory-mapped files.
+                If None, these arrays are discarded.
+    max_spill : float, optional
+                Budget in MB for the memory-mapped files. No limit if None.
+    """
+
+    def __init__(self, max_memory=1000.0, spill_dir=None, max_spill=10000.0):
+
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.max_spill = max_spill
+        self._arrays = {}
+        self._spilled = {}
+        self._tmp_dir = None
+        self._n_files = 0
+        self._lock = threading.Lock()
+        self.memory = 0
+        self.spilled_memory = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._arrays or key in self._spilled
+
+    def __len__(self):
+        return len(self._arrays) + len(self._spilled)
+
+    def get(self, key):
+        """
+        Returns the array stored under key, or None if it is not in the cache.
+        """
+        with self._lock:
+            if key in self._arrays:
+                self.hits += 1
+                return self._arrays[key]
+            if key in self._spilled:
+                self.hits += 1
+                return self._spilled[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, array):
+        """
+        Stores array under key. If the memory budget is exceeded, the array is spilled
+        to a memory-mapped file or not kept.
+        """
+        with self._lock:
+            self._discard(key)
+            if self.max_memory is not None and self.memory + array.nbytes > self.max_memory * 1024**2:
+                self._spill(key, array)
+                return
+            self._arrays[key] = array
+            self.memory += array.nbytes
+
+    def discard(self, key):
+        """
+        Removes key from the cache.
+        """
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        if key in self._arrays:
+            self.memory -= self._arrays.pop(key).nbytes
+        elif key in self._spilled:
+            mapped, filename = self._spilled.pop(key)
+            self.spilled_memory -= mapped.nbytes
+            del mapped
+            os.remove(filename)
+
+    def clear(self):
+        """
+        Empties the cache and removes all memory-mapped files.
+        """
+        with self._lock:
+            self._arrays.clear()
+            self._spilled.clear()
+            self.memory = 0
+            self.spilled_memory = 0
+            if self._tmp_dir is not None:
+                shutil.rmtree(self._tmp_dir, ignore_errors=True)
+                self._tmp_dir = None
+
+    def _spill(self, key, array):
+        if self.spill_dir is None:
+            return
+        if self.max_spill is not None and self.spilled_memory + array.nbytes > self.max_spill * 1024**2:
+            return
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='upfold_cache_', dir=self.spill_dir)
+        filename = os.path.join(self._tmp_dir, 'array_%s.dat' % self._n_files)
+        self._n_files += 1
+        mapped = numpy.memmap(filename, dtype=array.dtype, mode='w+', shape=array.shape)
+        mapped[...] = array
+        mapped.flush()
+        del mapped
+        self._spilled[key] = (numpy.memmap(filename, dtype=array.dtype, mode='r', shape=array.shape), filename)
+        self.spilled_memory += array.nbytes
+
+    def __del__(self):
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
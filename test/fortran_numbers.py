@@ -0,0 +1,69 @@
+
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import numpy
+from triqs_dft_tools.converters.converter_tools import ConverterTools, FortranNumbers
+
+def read_all(R):
+    return [x for x in R]
+
+# Empty and whitespace-only files contain no numbers
+for text in ["", "\n", " ", " \t\n  \n"]:
+    R = FortranNumbers.from_text(text)
+    assert R is not None and read_all(R) == [], "numbers read from %r" % text
+
+# Reading past the end of the file raises StopIteration, also for blocks
+R = FortranNumbers.from_text(" 1 2\n 3.5 -4e1 \n")
+assert R.next() == 1.0
+assert numpy.allclose(R.read((2, 1)), [[2.0], [3.5]])
+try:
+    R.read(2)
+    raise AssertionError, "read past the end of the file"
+except StopIteration:
+    pass
+assert R.next() == -40.0
+try:
+    R.next()
+    raise AssertionError, "read past the end of the file"
+except StopIteration:
+    pass
+
+# The numbers before a bad token are read, the bad token raises ValueError
+for text in ["1 2 abc 4", "1 2 abc", "1 2 1.5abc 4", "1 2 1.5abc"]:
+    R = FortranNumbers.from_text(text)
+    assert R.next() == 1.0 and R.next() == 2.0, "numbers before the bad token not read from %r" % text
+    try:
+        R.next()
+        raise AssertionError, "bad token not detected in %r" % text
+    except ValueError:
+        pass
+    try:
+        R.read(1)
+        raise AssertionError, "bad token not detected in %r" % text
+    except ValueError:
+        pass
+
+# Fortran D exponents are replaced when the file is read
+with open('fortran_numbers.dat', 'w') as f:
+    f.write("  0.1500000000000D+01 -0.25D-02\n  3\n")
+R = ConverterTools().read_fortran_file('fortran_numbers.dat', {'D': 'E'})
+assert numpy.allclose(read_all(R), [1.5, -2.5e-3, 3.0])
@@ -2,7 +2,7 @@
 import os
 
 import numpy as np
-from triqs_dft_tools.converters.plovasp.atm import dos_tetra_weights_3d
+from triqs_dft_tools.converters.plovasp.atm import dos_tetra_weights_3d, dos_tetra_k_weights_3d
 import mytest
 
 ################################################################################
@@ -18,6 +18,7 @@ class TestProjectorShell(mytest.MyTestCase):
 
     Scenarios:
     - **if** a correct input is given **compare** output arrays
+    - **test** that the k-point weights are the corner weights summed on k-points
     """
 # Scenario 1
     def test_example(self):
@@ -35,4 +36,26 @@ class TestProjectorShell(mytest.MyTestCase):
 
         self.assertEqual(res, r_should)
 
+# Scenario 2
+    def test_k_weights(self):
+        np.random.seed(1)
+        nk, nb = 6, 3
+        eigk = np.random.uniform(-1.0, 1.0, (nk, nb))
+# Tetrahedra with different multiplicities: itt[0] are the weights, itt[1:5] the k-points
+        itt = np.array([[1, 0, 1, 2, 3], [2, 1, 2, 3, 4], [1, 2, 3, 4, 5], [3, 0, 2, 4, 5]]).T
+# Some energies lie outside of the range of a tetrahedron, the first and the last
+# ones outside of all bands
+        emesh = np.array([-1.5, -0.7, -0.3, 0.1, 0.45, 0.8, 1.5])
+
+        res = dos_tetra_k_weights_3d(eigk, emesh, itt)
+
+        r_should = np.zeros((len(emesh), nk, nb))
+        for ie, en in enumerate(emesh):
+            for ib in xrange(nb):
+                cti = dos_tetra_weights_3d(eigk[:, ib].copy(), en, itt)
+                for it in xrange(itt.shape[1]):
+                    for ic in xrange(4):
+                        r_should[ie, itt[ic + 1, it], ib] += itt[0, it] * cti[ic, it]
 
+        self.assertEqual(res, r_should)
+        self.assertEqual(res[[0, -1]], np.zeros((2, nk, nb)))
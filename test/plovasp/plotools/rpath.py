@@ -0,0 +1,5 @@
+r"""
+The sole role of this module is to determine the current path by
+examining rpath.__file__.
+"""
+pass
@@ -0,0 +1,117 @@
+
+import os
+import json
+import shutil
+import tempfile
+import rpath
+_rpath = os.path.dirname(rpath.__file__) + '/'
+
+import numpy as np
+from triqs_dft_tools.converters.plovasp.vaspio import VaspData
+from triqs_dft_tools.converters.plovasp.elstruct import ElectronicStructure
+from triqs_dft_tools.converters.plovasp.inpconf import ConfigParameters
+from triqs_dft_tools.converters.plovasp.plotools import generate_plo, output_as_text
+from triqs_dft_tools.converters.vasp_converter import VaspConverter, dft_input_from_plo
+from triqs_dft_tools.converters.plovasp.sc_dmft import update_sum_k
+from triqs_dft_tools.sumk_dft import SumkDFT
+from pytriqs.archive import HDFArchive
+import mytest
+
+################################################################################
+#
+# TestPloOutput
+#
+################################################################################
+class TestPloOutput(mytest.MyTestCase):
+    """
+    Function:
+
+    def output_as_text(pars, el_struct, pshells, pgroups)
+
+    Scenarios:
+
+    - **test** that the band windows are stored in the Fortran convention
+    - **test** that the text and the binary output give the same DFT input
+    - **test** that the update of SumkDFT in memory gives the same DFT input as the text output
+    """
+    def setUp(self):
+        self.conf_file = _rpath + '../proj_group/example.cfg'
+        self.pars = ConfigParameters(self.conf_file)
+        self.pars.parse_input()
+        vasp_data = VaspData(_rpath + '../proj_group/one_site/')
+        self.el_struct = ElectronicStructure(vasp_data)
+        self.pshells, self.pgroups = generate_plo(self.pars, self.el_struct)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_and_convert(self, basename, binary):
+        """
+        Writes the PLO groups in text or binary form and converts them
+        to an hdf5 file; returns the path without extension.
+        """
+        basename = os.path.join(self.tmp_dir, basename)
+        self.pars.general['basename'] = basename
+        self.pars.general['binary'] = binary
+        output_as_text(self.pars, self.el_struct, self.pshells, self.pgroups)
+        VaspConverter(filename=basename).convert_dft_input()
+        return basename
+
+# Scenario 1
+    def test_band_window(self):
+        basename = self.write_and_convert('binary', True)
+
+        converter = VaspConverter(filename=basename)
+        jheader, rf = converter.read_header_and_data(basename + '.pg1')
+        rf.close()
+        gr_head = json.loads(jheader)
+        data = converter.load_data_file(basename + '.pg1', gr_head)
+
+        ib_win = self.pgroups[0].ib_win.transpose((1, 0, 2))
+        self.assertEqual(data['ib_win'], ib_win + 1)
+
+        band_window = dft_input_from_plo(gr_head, data, ib_win.shape[0])['band_window']
+        for isp, bwin in enumerate(band_window):
+            self.assertEqual(bwin, ib_win[isp] + 1)
+
+# Scenario 2
+    def test_text_binary(self):
+        text_name = self.write_and_convert('text', False)
+        binary_name = self.write_and_convert('binary', True)
+
+        with HDFArchive(text_name + '.h5', 'r') as h5text:
+            with HDFArchive(binary_name + '.h5', 'r') as h5bin:
+                for it in ['n_orbitals', 'hopping', 'proj_mat']:
+                    self.assertEqual(h5bin['dft_input'][it], h5text['dft_input'][it])
+
+                bwin_text = h5text['dft_misc_input']['band_window']
+                bwin_bin = h5bin['dft_misc_input']['band_window']
+                self.assertEqual(len(bwin_bin), len(bwin_text))
+                for isp in xrange(len(bwin_text)):
+                    self.assertEqual(bwin_bin[isp], bwin_text[isp])
+
+# Scenario 3
+    def test_update_sum_k(self):
+        text_name = self.write_and_convert('text', False)
+        sum_k = SumkDFT(hdf_file=text_name + '.h5')
+        sum_k.hopping = np.zeros_like(sum_k.hopping)
+        sum_k.proj_mat = np.zeros_like(sum_k.proj_mat)
+
+        changed = update_sum_k(sum_k, self.conf_file, vasp_dir=_rpath + '../proj_group/one_site/')
+        self.assertTrue('hopping' in changed and 'proj_mat' in changed)
+
+        with HDFArchive(text_name + '.h5', 'r') as h5text:
+            for it in ['n_orbitals', 'hopping', 'proj_mat']:
+                self.assertEqual(getattr(sum_k, it), h5text['dft_input'][it])
+            self.assertEqual(sum_k.density_required, h5text['dft_input']['density_required'])
+# Fermi weights are written with 7 decimals to the text files
+            self.assertTrue(np.allclose(sum_k.dft_fermi_weights, h5text['dft_misc_input']['dft_fermi_weights'], atol=1.e-7))
+            bwin_text = h5text['dft_misc_input']['band_window']
+            self.assertEqual(len(sum_k.band_window), len(bwin_text))
+            for isp in xrange(len(bwin_text)):
+                self.assertEqual(sum_k.band_window[isp], bwin_text[isp])
+
+# Nothing changes if the same PLOs are generated again
+        changed = update_sum_k(sum_k, self.conf_file, vasp_dir=_rpath + '../proj_group/one_site/')
+        self.assertEqual(changed, [])
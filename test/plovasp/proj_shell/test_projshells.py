@@ -9,6 +9,7 @@ from triqs_dft_tools.converters.plovasp.elstruct import ElectronicStructure
 from triqs_dft_tools.converters.plovasp.inpconf import ConfigParameters
 from triqs_dft_tools.converters.plovasp.proj_shell import ProjectorShell
 from triqs_dft_tools.converters.plovasp.proj_group import ProjectorGroup
+from triqs_dft_tools.converters.plovasp.atm import dos_tetra_weights_3d
 import mytest
 
 ################################################################################
@@ -25,6 +26,7 @@ class TestProjectorShell(mytest.MyTestCase):
     Scenarios:
     - **if** a correct input is given **compare** output files
     - **if** a correct input is given **compare** density matrices
+    - **test** that the DOS is given by the tetrahedron corner weights
     """
     def setUp(self):
         """
@@ -76,4 +78,29 @@ class TestProjectorShell(mytest.MyTestCase):
 
         expected_file = _rpath + 'densmat.out'
         self.assertFileEqual(testout, expected_file)
- 
+
+# Scenario 3
+    def test_dos(self):
+        emesh = np.array([-25.0, -2.0, -1.0, -0.2, 0.5, 1.5])
+        dos = self.proj_sh.density_of_states(self.el_struct, emesh)
+
+        kmesh = self.el_struct.kmesh
+        itt = kmesh['itet'].T.copy()
+        itt[1:, :] -= 1
+        ib_min, ib_max = self.proj_sh.ib_min, self.proj_sh.ib_max
+        nion, ns, nk, nlm, nbtot = self.proj_sh.proj_win.shape
+        w_k = abs(self.proj_sh.proj_win)**2
+
+        dos_should = np.zeros((len(emesh), ns, nion, nlm))
+        for isp in xrange(ns):
+            for ib in xrange(ib_max - ib_min + 1):
+                eigk = self.el_struct.eigvals[:, ib_min + ib, isp] - self.el_struct.efermi
+                for ie, en in enumerate(emesh):
+                    cti = dos_tetra_weights_3d(eigk.copy(), en, itt)
+                    wk = np.zeros(nk)
+                    np.add.at(wk, itt[1:, :], itt[0, :] * cti)
+                    dos_should[ie, isp, :, :] += np.dot(w_k[:, isp, :, :, ib].transpose((0, 2, 1)), wk)
+        dos_should *= 2 * kmesh['volt']
+
+        self.assertEqual(dos, dos_should)
+        self.assertEqual(dos[0], np.zeros((ns, nion, nlm)))
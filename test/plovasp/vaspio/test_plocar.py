@@ -0,0 +1,52 @@
+r"""
+Tests for class 'Plocar' from module 'vaspio'
+"""
+import os
+import rpath
+_rpath = os.path.dirname(rpath.__file__) + '/'
+
+import mytest
+import numpy as np
+from triqs_dft_tools.converters.plovasp.vaspio import Plocar
+
+################################################################################
+#
+# TestPlocar
+#
+################################################################################
+class TestPlocar(mytest.MyTestCase):
+    """
+    Function:
+
+    def Plocar.locproj_parser(locproj_filename, sites, chunk_size)
+
+    Scenarios:
+    - the result does not depend on the chunk size
+    - only projectors of selected sites are read
+
+    """
+    def setUp(self):
+        self.filename = _rpath + '../proj_group/two_site/LOCPROJ'
+        self.plocar = Plocar()
+        self.pars, self.plo = self.plocar.locproj_parser(locproj_filename=self.filename)
+
+# Scenario 1
+    def test_chunks(self):
+        plocar = Plocar()
+        pars, plo = plocar.locproj_parser(locproj_filename=self.filename, chunk_size=0.001)
+
+        self.assertEqual(pars, self.pars)
+        self.assertEqual(plo.shape, (10, 1, 8, 32))
+        self.assertEqual(np.abs(plo - self.plo).max(), 0.0)
+        self.assertEqual(np.abs(plocar.eigs - self.plocar.eigs).max(), 0.0)
+        self.assertEqual(np.abs(plocar.ferw - self.plocar.ferw).max(), 0.0)
+
+# Scenario 2
+    def test_sites(self):
+        plocar = Plocar()
+        pars, plo = plocar.locproj_parser(locproj_filename=self.filename, sites=[2])
+
+        inds = [ip for ip, par in enumerate(self.pars) if par['isite'] == 2]
+        self.assertEqual(pars, [self.pars[ip] for ip in inds])
+        self.assertEqual(np.abs(plo - self.plo[inds]).max(), 0.0)
+
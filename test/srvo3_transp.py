@@ -19,6 +19,7 @@
 #
 ################################################################################
 
+import shutil
 from numpy import *
 from triqs_dft_tools.converters.wien2k_converter import *
 from triqs_dft_tools.sumk_dft import *
@@ -32,6 +33,32 @@ Converter = Wien2kConverter(filename='SrVO3', repacking=True)
 Converter.convert_dft_input()
 Converter.convert_transport_input()
 
+# the velocities of the .pmat file (upper triangle of the band pairs, row by row) are stored
+# with the conjugates below the diagonal, padded with zeros to the largest band window
+ar = HDFArchive('SrVO3.h5', 'r')
+velocities_k = ar['dft_transp_input']['velocities_k']
+band_window_optics = ar['dft_transp_input']['band_window_optics']
+n_k = ar['dft_input']['n_k']
+del ar
+with open('SrVO3.pmat', 'r') as f:
+    pmat = iter(map(float, f.read().replace('(', ' ').replace(')', ' ').replace(',', ' ').split()))
+assert velocities_k.shape[:2] == (1, n_k)
+for ik in range(n_k):
+    pmat.next()
+    nu1, nu2 = int(pmat.next()), int(pmat.next())
+    assert tuple(band_window_optics[0][ik]) == (nu1, nu2)
+    for i in range(4):
+        pmat.next()
+    n_bands = nu2 - nu1 + 1
+    for i in range(n_bands):
+        for j in range(i, n_bands):
+            for direction in range(3):
+                v = complex(pmat.next(), pmat.next())
+                assert velocities_k[0, ik, i, j, direction] == v
+                if i != j:
+                    assert velocities_k[0, ik, j, i, direction] == v.conjugate()
+    assert not velocities_k[0, ik, n_bands:].any() and not velocities_k[0, ik, :, n_bands:].any()
+
 SK = SumkDFTTools(hdf_file='SrVO3.h5', use_dft_blocks=True)
 
 ar = HDFArchive('SrVO3_Sigma.h5', 'a')
@@ -50,3 +77,72 @@ SK.save(['seebeck','optic_cond','kappa'])
 
 if mpi.is_master_node():
     h5diff("srvo3_transp.out.h5","srvo3_transp.ref.h5") 
+
+# the transport input is read again from a changed archive: velocities scaled by 2 give 4 * Gamma_w
+Gamma_w = SK.Gamma_w['xx'].copy()
+if mpi.is_master_node():
+    shutil.copy('SrVO3.h5', 'srvo3_transp_scaled.out.h5')
+    ar = HDFArchive('srvo3_transp_scaled.out.h5', 'a')
+    ar['dft_transp_input']['velocities_k'] = 2.0 * ar['dft_transp_input']['velocities_k']
+    del ar
+mpi.barrier()
+SK.hdf_file = 'srvo3_transp_scaled.out.h5'
+SK.transport_distribution(directions=['xx'], broadening=0.0, energy_window=[-0.3,0.3], Om_mesh=[0.00, 0.02] , beta=beta, with_Sigma=True)
+assert_arrays_are_close(SK.Gamma_w['xx'], 4.0 * Gamma_w, 1.e-10)
+
+# Without self energy Gamma_w is calculated in the eigenbasis of H(k): compare with the traces of the
+# velocities (transformed by all symmetries) and A(k,w) = -1/(2 pi i) (G - G^dagger) of the lattice Green's function
+SK.hdf_file = 'SrVO3.h5'
+n_om = 61
+broadening = 0.05
+directions = ['xx', 'xy', 'zz']
+SK.transport_distribution(directions=directions, broadening=broadening, energy_window=[-0.3,0.3], Om_mesh=[0.00, 0.02, 0.1],
+                          beta=beta, n_om=n_om, with_Sigma=False)
+if mpi.is_master_node():
+    mesh = [SK.omega[0], SK.omega[-1], n_om]
+    iOm_mesh = [int(round(Om / (SK.omega[1] - SK.omega[0]))) for Om in SK.Om_mesh]
+    dir_to_int = {'x': 0, 'y': 1, 'z': 2}
+    Gamma_w = {direction: zeros((len(SK.Om_mesh), n_om)) for direction in directions}
+    for ik in range(SK.n_k):
+        G_w = SK.lattice_gf(ik, mu=0.0, iw_or_w='w', broadening=broadening, mesh=mesh, with_Sigma=False)['up'].data
+        A_kw = -1.0 / (2.0 * pi * 1j) * (G_w - G_w.conjugate().transpose(0, 2, 1))
+        b_min = max(SK.band_window[0][ik, 0], SK.band_window_optics[0][ik, 0])
+        b_max = min(SK.band_window[0][ik, 1], SK.band_window_optics[0][ik, 1])
+        A_kw = A_kw[:, b_min - SK.band_window[0][ik, 0]:b_max - SK.band_window[0][ik, 0] + 1,
+                    b_min - SK.band_window[0][ik, 0]:b_max - SK.band_window[0][ik, 0] + 1]
+        vel = SK.velocities_k[0][ik][b_min - SK.band_window_optics[0][ik, 0]:b_max - SK.band_window_optics[0][ik, 0] + 1,
+                                     b_min - SK.band_window_optics[0][ik, 0]:b_max - SK.band_window_optics[0][ik, 0] + 1]
+        for R in SK.rot_symmetries:
+            vel_R = einsum('ab,nmb->nma', R, vel)
+            for direction in directions:
+                v_c, v_d = vel_R[:, :, dir_to_int[direction[0]]], vel_R[:, :, dir_to_int[direction[1]]]
+                for iq in range(len(SK.Om_mesh)):
+                    for iw in range(n_om - iOm_mesh[iq]):
+                        if SK.omega[iw] < -SK.Om_mesh[iq] - 0.3 or SK.omega[iw] > SK.Om_mesh[iq] + 0.3:
+                            continue
+                        Gamma_w[direction][iq, iw] += (dot(dot(dot(v_c, A_kw[iw + iOm_mesh[iq]]), v_d), A_kw[iw]).trace().real
+                                                       * SK.bz_weights[ik])
+    volume = SK.cellvolume(SK.lattice_type, SK.lattice_constants, SK.lattice_angles)[1]
+    for direction in directions:
+        assert_arrays_are_close(SK.Gamma_w[direction], Gamma_w[direction] / volume / SK.n_symmetries, 1.e-10)
+
+# the transport coefficients for an array of temperatures are the ones of the single temperatures
+if mpi.is_master_node():
+    betas = array([[20.0, 40.0], [60.0, 100.0]])
+    for n in range(3):
+        A = SK.transport_coefficients(betas, n, method='simps')
+        for ib in ndindex(betas.shape):
+            A_beta = SK.transport_coefficients(betas[ib], n, method='simps')
+            for direction in directions:
+                assert A[direction][ib].shape == (len(SK.Om_mesh),)
+                assert allclose(A[direction][ib], A_beta[direction], rtol=1.e-12, atol=0.0, equal_nan=True)
+                for iq in range(len(SK.Om_mesh)):
+                    assert allclose(SK.transport_coefficient(direction, iq, n, betas[ib], method='simps'),
+                                    A_beta[direction][iq], rtol=1.e-12, atol=0.0, equal_nan=True)
+    optic_cond, seebeck, kappa = SK.conductivity_and_seebeck(betas)
+    for ib in ndindex(betas.shape):
+        optic_cond_beta, seebeck_beta, kappa_beta = SK.conductivity_and_seebeck(betas[ib])
+        for direction in directions:
+            assert allclose(optic_cond[direction][ib], optic_cond_beta[direction], rtol=1.e-12, atol=0.0)
+            assert allclose(seebeck[direction][ib], seebeck_beta[direction], rtol=1.e-12, atol=0.0)
+            assert allclose(kappa[direction][ib], kappa_beta[direction], rtol=1.e-12, atol=0.0)
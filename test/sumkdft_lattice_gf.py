@@ -0,0 +1,176 @@
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn, L. Pourovskii, V. Vildosola
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+from pytriqs.gf import *
+from triqs_dft_tools.sumk_dft import *
+from triqs_dft_tools.sumk_dft_tools import SumkDFTTools
+from pytriqs.utility.comparison_tests import *
+import numpy
+
+# Compares the batched lattice Green's function engine with the BlockGf-based lattice_gf
+beta = 40
+
+SK = SumkDFT(hdf_file='SrVO3.h5')
+# compare the bare k sums, without symmetrisation and local rotations
+SK.symm_op = 0
+SK.use_rotations = False
+
+num_orbitals = SK.corr_shells[0]['dim']
+spin_names = ['up','down']
+
+glist = [ GfImFreq(indices=range(num_orbitals),beta=beta) for sp in spin_names]
+Sigma_iw = BlockGf(name_list = spin_names, block_list = glist, make_copies = False)
+for bname, sig in Sigma_iw:
+    sig << 0.2 + 0.5 * inverse(iOmega_n + 0.3)
+SK.set_Sigma([Sigma_iw])
+SK.dc_imp = [{sp: 0.1 * numpy.identity(num_orbitals) for sp in spin_names}]
+
+# Reference: sum of BlockGf lattice Green's functions
+G_ref = SK.Sigma_imp_iw[0].copy()
+G_ref.zero()
+dens_ref = 0.0
+for ik in range(SK.n_k):
+    G_latt = SK.lattice_gf(ik=ik)
+    dens_ref += SK.bz_weights[ik] * G_latt.total_density()
+    tmp = G_ref.copy()
+    for bname, gf in tmp:
+        gf << SK.downfold(ik, 0, bname, G_latt[bname], gf)
+    G_ref += SK.bz_weights[ik] * tmp
+
+Gloc = SK.extract_G_loc()
+for bname, gf in Gloc[0]:
+    assert_arrays_are_close(gf.data, G_ref[bname].data, 1.e-10)
+    assert_arrays_are_close(gf.density(), G_ref[bname].density(), 1.e-5)
+
+assert abs(SK.total_density() - dens_ref) < 1.e-4, "total_density differs from the BlockGf result"
+# the upfolded self-energies of extract_G_loc are reused by total_density
+assert SK.upfold_cache.hits > 0, "upfolded self-energies were not reused"
+SK.set_dc(SK.dc_imp, [0.0])
+assert len(SK.upfold_cache) == 0, "set_dc did not invalidate the upfolded self-energies"
+
+dm = SK.density_matrix(method='using_gf')
+for bname, gf in G_ref:
+    assert_arrays_are_close(dm[0][bname], gf.density(), 1.e-4)
+
+# Without self energy the eigenbasis of H(k) is used
+G_ref.zero()
+dens_ref = 0.0
+for ik in range(SK.n_k):
+    G_latt = SK.lattice_gf(ik=ik, with_Sigma=False, beta=beta)
+    dens_ref += SK.bz_weights[ik] * G_latt.total_density()
+    tmp = G_ref.copy()
+    for bname, gf in tmp:
+        gf << SK.downfold(ik, 0, bname, G_latt[bname], gf)
+    G_ref += SK.bz_weights[ik] * tmp
+
+Gloc = SK.extract_G_loc(with_Sigma=False)
+for bname, gf in Gloc[0]:
+    assert_arrays_are_close(gf.data, G_ref[bname].data, 1.e-10)
+
+assert abs(SK.total_density(with_Sigma=False) - dens_ref) < 1.e-4, "total_density differs from the BlockGf result"
+
+# Newton and Brent searches for mu agree with the bisection
+mu_dichotomy = SK.calc_mu(precision=1.e-6)
+for method in ['newton', 'brent']:
+    SK.set_mu(mu_dichotomy + 0.2)
+    mu = SK.calc_mu(precision=1.e-6, method=method)
+    assert SK.calc_mu_info['converged'], "calc_mu with method %s did not converge" % method
+    assert abs(mu - mu_dichotomy) < 1.e-4, "calc_mu with method %s gives a different mu" % method
+    # each k sum is done at a different mu
+    assert len(set(m for m, dens, ddens in SK.calc_mu_info['trace'])) == SK.calc_mu_info['n_k_sums']
+
+# a total charge jumping across the required value (degenerate levels at the Fermi level):
+# the searches stop at the step instead of looping at the resolution of mu
+mu_step = mu_dichotomy + 0.1
+def step_density(mu, with_derivative=False, **kwargs):
+    dens = SK.density_required - SK.charge_below + (1.0 if mu > mu_step else -1.0)
+    return (dens, 0.0) if with_derivative else dens
+SK.total_density = step_density
+for method in ['newton', 'brent']:
+    SK.set_mu(mu_dichotomy)
+    mu = SK.calc_mu(precision=1.e-6, method=method)
+    assert not SK.calc_mu_info['converged'], "calc_mu with method %s converged for a step density" % method
+    assert SK.calc_mu_info['n_k_sums'] <= 100, "calc_mu with method %s exceeds max_loops" % method
+    assert abs(mu - mu_step) < 1.e-6, "calc_mu with method %s does not stop at the step" % method
+del SK.total_density
+SK.set_mu(mu_dichotomy)
+
+# k sums distributed over threads give the same result
+Gloc = SK.extract_G_loc(with_Sigma=False)
+SK.n_threads = 3
+Gloc_threads = SK.extract_G_loc(with_Sigma=False)
+for bname, gf in Gloc[0]:
+    assert_arrays_are_close(gf.data, Gloc_threads[0][bname].data, 1.e-12)
+
+# the result does not depend on the distribution of the k-points
+for k_distribution in ['equal', 'timings']:
+    SK.k_distribution = k_distribution
+    Gloc_dist = SK.extract_G_loc(with_Sigma=False)
+    for bname, gf in Gloc[0]:
+        assert_arrays_are_close(gf.data, Gloc_dist[0][bname].data, 1.e-12)
+SK.report_k_balance()
+
+# hopping and projectors read per MPI process from the hdf5 file
+for k_data in ['slab', 'mmap']:
+    SK_slab = SumkDFT(hdf_file='SrVO3.h5', k_data=k_data)
+    SK_slab.symm_op = 0
+    SK_slab.use_rotations = False
+    SK_slab.set_mu(SK.chemical_potential)
+    Gloc_slab = SK_slab.extract_G_loc(with_Sigma=False)
+    for bname, gf in Gloc[0]:
+        assert_arrays_are_close(gf.data, Gloc_slab[0][bname].data, 1.e-12)
+    # the diagonal of the Hamiltonian is gathered from the slabs for printing
+    ham = {}
+    for k_data_print in [k_data, 'bcast']:
+        SumkDFTTools(hdf_file='SrVO3.h5', k_data=k_data_print).print_hamiltonian()
+        mpi.barrier()
+        if mpi.is_master_node():
+            ham[k_data_print] = open('ham.dat').read()
+        mpi.barrier()
+    if mpi.is_master_node():
+        assert ham[k_data] == ham['bcast'], "Hamiltonian printed from the slabs differs"
+    # in-memory updates are compared with the previous update and only send the own k-points
+    dft_input = {'hopping': 1.1 * SK.hopping, 'proj_mat': SK.proj_mat, 'n_orbitals': SK.n_orbitals}
+    assert SK_slab.update_dft_input(dft_input) == ['hopping', 'proj_mat'], "slabs not updated"
+    assert SK_slab.update_dft_input(dft_input) == [], "unchanged slabs updated"
+    assert_arrays_are_close(SK_slab.hopping.data, dft_input['hopping'][SK_slab.hopping.k_start:SK_slab.hopping.k_stop], 1.e-14)
+
+# Matsubara sums on a compressed set of frequencies
+SK.set_matsubara_sum(method='compressed', accuracy=1.e-6)
+dens_compressed = SK.total_density()
+dens_mat_compressed = SK.density_matrix()
+SK.set_matsubara_sum()
+assert abs(SK.total_density() - dens_compressed) < 1.e-4, "compressed Matsubara sum differs from the full one"
+for bname, dm in SK.density_matrix()[0].iteritems():
+    assert_arrays_are_close(dm, dens_mat_compressed[0][bname], 1.e-4)
+
+# the search for mu with compressed Matsubara sums reuses the upfolded self-energies
+mu_full = SK.calc_mu(precision=1.e-6)
+SK.set_matsubara_sum(method='compressed', accuracy=1.e-6)
+SK.set_mu(mu_full + 0.2)
+hits = SK.upfold_cache.hits
+mu_compressed = SK.calc_mu(precision=1.e-6, method='brent')
+assert abs(mu_compressed - mu_full) < 1.e-4, "calc_mu with compressed Matsubara sums gives a different mu"
+assert SK.upfold_cache.hits > hits, "upfolded self-energies were not reused by calc_mu"
+dens_cached = SK.total_density(mu=mu_compressed + 0.1)
+SK.upfold_cache.clear()
+assert abs(SK.total_density(mu=mu_compressed + 0.1) - dens_cached) < 1.e-12, "upfolded self-energies reused for other frequencies"
+SK.set_matsubara_sum()
@@ -0,0 +1,58 @@
+
+################################################################################
+#
+# TRIQS: a Toolbox for Research in Interacting Quantum Systems
+#
+# Copyright (C) 2011 by M. Aichhorn
+#
+# TRIQS is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# TRIQS is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# TRIQS. If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+import os
+import shutil
+import tempfile
+import numpy
+from triqs_dft_tools.upfold_cache import UpfoldCache
+
+# 10 arrays of 1 MB requested cyclically (as by the k sums in calc_mu) with a budget of 4.5 MB:
+# the first 4 arrays are kept and hit in all following cycles
+arrays = [numpy.full(2**17, ik, numpy.float_) for ik in range(10)]
+cache = UpfoldCache(max_memory=4.5)
+for cycle in range(3):
+    for ik, a in enumerate(arrays):
+        if cache.get(ik) is None:
+            cache.put(ik, a)
+assert len(cache) == 4 and all(ik in cache for ik in range(4))
+assert cache.hits == 2 * 4 and cache.misses == 10 + 2 * 6, "cyclic requests of a full cache do not hit"
+
+# arrays beyond the budget are spilled to files, up to the spill budget
+spill_dir = tempfile.mkdtemp()
+cache = UpfoldCache(max_memory=2.5, spill_dir=spill_dir, max_spill=3.5)
+for ik, a in enumerate(arrays):
+    cache.put(ik, a)
+assert len(cache._arrays) == 2 and len(cache._spilled) == 3 and len(cache) == 5
+assert numpy.array_equal(cache.get(3), arrays[3])
+
+# discarded arrays remove their files
+filename = cache._spilled[3][1]
+cache.discard(3)
+assert 3 not in cache and not os.path.exists(filename), "the file of a discarded array is not removed"
+assert len(os.listdir(cache._tmp_dir)) == 2
+cache.put(5, arrays[5])
+assert 5 in cache and len(os.listdir(cache._tmp_dir)) == 3
+
+cache.clear()
+assert len(cache) == 0 and os.listdir(spill_dir) == []
+shutil.rmtree(spill_dir)
@@ -25,6 +25,8 @@ from triqs_dft_tools.converters import *
 from pytriqs.archive import *
 from pytriqs.utility.h5diff import h5diff
 import pytriqs.utility.mpi as mpi
+import numpy
+from pytriqs.utility.comparison_tests import assert_arrays_are_close
 
 Converter = Wannier90Converter(seedname='LaVO3-Pnma',hdf_filename='w90_convert.out.h5')
 
@@ -32,3 +34,25 @@ Converter.convert_dft_input()
 
 if mpi.is_master_node():
     h5diff("w90_convert.out.h5","w90_convert.ref.h5") 
+
+# Fourier transform of random H(R), with R vectors beyond the k-mesh and degeneracies > 1,
+# by FFT on the mesh and by the product with the phase factors, compared to the explicit sum
+numpy.random.seed(1)
+nki = [4, 3, 5]
+norb = 3
+Converter.n_k, Converter.k_mesh, bz_weights = Converter.kmesh_build(nki)
+Converter.rvec = numpy.random.randint(-7, 8, size=(40, 3))
+Converter.rdeg = numpy.random.randint(1, 5, size=40)
+Converter.nrpt = 40
+h_of_r = [numpy.random.rand(norb, norb) + 1j * numpy.random.rand(norb, norb) for ir in range(Converter.nrpt)]
+
+h_of_k = [numpy.zeros((norb, norb), numpy.complex_) for ik in range(Converter.n_k)]
+for ik in range(Converter.n_k):
+    for ir in range(Converter.nrpt):
+        rdotk = 2 * numpy.pi * numpy.dot(Converter.k_mesh[ik], Converter.rvec[ir])
+        h_of_k[ik] += numpy.exp(1j * rdotk) / Converter.rdeg[ir] * h_of_r[ir]
+
+for h_k in [Converter.fourier_ham(norb, h_of_r, nki), Converter.fourier_ham(norb, h_of_r)]:
+    assert len(h_k) == Converter.n_k
+    for ik in range(Converter.n_k):
+        assert_arrays_are_close(h_k[ik], h_of_k[ik], 1.e-12)